@@ -1,51 +1,56 @@
 import pandas as pd
+import torch
 import torch.nn as nn
 
+def conv_layers():
+    return nn.Sequential(
+        # conv1
+        nn.Conv2d(in_channels=3, out_channels=32,
+                  kernel_size=3, padding=1),
+        nn.ReLU(),
+        nn.BatchNorm2d(32),
+        nn.Conv2d(in_channels=32, out_channels=32,
+                  kernel_size=3, padding=1),
+        nn.ReLU(),
+        nn.BatchNorm2d(32),
+        nn.MaxPool2d(2),
+        # conv2
+        nn.Conv2d(in_channels=32, out_channels=64,
+                  kernel_size=3, padding=1),
+        nn.ReLU(),
+        nn.BatchNorm2d(64),
+        nn.Conv2d(in_channels=64, out_channels=64,
+                  kernel_size=3, padding=1),
+        nn.ReLU(),
+        nn.BatchNorm2d(64),
+        nn.MaxPool2d(2),
+        # conv3
+        nn.Conv2d(in_channels=64, out_channels=128,
+                  kernel_size=3, padding=1),
+        nn.ReLU(),
+        nn.BatchNorm2d(128),
+        nn.Conv2d(in_channels=128, out_channels=128,
+                  kernel_size=3, padding=1),
+        nn.ReLU(),
+        nn.BatchNorm2d(128),
+        nn.MaxPool2d(2),
+        # conv4
+        nn.Conv2d(in_channels=128, out_channels=256,
+                  kernel_size=3, padding=1),
+        nn.ReLU(),
+        nn.BatchNorm2d(256),
+        nn.Conv2d(in_channels=256, out_channels=256,
+                  kernel_size=3, padding=1),
+        nn.ReLU(),
+        nn.BatchNorm2d(256),
+        nn.MaxPool2d(2),
+    )
+
+
 class CNN(nn.Module):
     def __init__(self, K):
         super(CNN, self).__init__()
-        self.conv_layers = nn.Sequential(
-            # conv1
-            nn.Conv2d(in_channels=3, out_channels=32,
-                      kernel_size=3, padding=1),
-            nn.ReLU(),
-            nn.BatchNorm2d(32),
-            nn.Conv2d(in_channels=32, out_channels=32,
-                      kernel_size=3, padding=1),
-            nn.ReLU(),
-            nn.BatchNorm2d(32),
-            nn.MaxPool2d(2),
-            # conv2
-            nn.Conv2d(in_channels=32, out_channels=64,
-                      kernel_size=3, padding=1),
-            nn.ReLU(),
-            nn.BatchNorm2d(64),
-            nn.Conv2d(in_channels=64, out_channels=64,
-                      kernel_size=3, padding=1),
-            nn.ReLU(),
-            nn.BatchNorm2d(64),
-            nn.MaxPool2d(2),
-            # conv3
-            nn.Conv2d(in_channels=64, out_channels=128,
-                      kernel_size=3, padding=1),
-            nn.ReLU(),
-            nn.BatchNorm2d(128),
-            nn.Conv2d(in_channels=128, out_channels=128,
-                      kernel_size=3, padding=1),
-            nn.ReLU(),
-            nn.BatchNorm2d(128),
-            nn.MaxPool2d(2),
-            # conv4
-            nn.Conv2d(in_channels=128, out_channels=256,
-                      kernel_size=3, padding=1),
-            nn.ReLU(),
-            nn.BatchNorm2d(256),
-            nn.Conv2d(in_channels=256, out_channels=256,
-                      kernel_size=3, padding=1),
-            nn.ReLU(),
-            nn.BatchNorm2d(256),
-            nn.MaxPool2d(2),
-        )
+        self.conv_layers = conv_layers()
 
         self.dense_layers = nn.Sequential(
             nn.Dropout(0.4),
@@ -67,6 +72,33 @@ class CNN(nn.Module):
         return out
 
 
+class CNNPooled(nn.Module):
+    # Same conv stack as CNN (conv weights transfer by name), but global
+    # average pooling replaces the 50176 -> 1024 dense layer (~51M parameters)
+    def __init__(self, K, hidden=256):
+        super(CNNPooled, self).__init__()
+        self.conv_layers = conv_layers()
+        self.pool = nn.AdaptiveAvgPool2d(1)
+
+        self.dense_layers = nn.Sequential(
+            nn.Dropout(0.4),
+            nn.Linear(256, hidden),
+            nn.ReLU(),
+            nn.Dropout(0.4),
+            nn.Linear(hidden, K),
+        )
+
+    def forward(self, X):
+        out = self.conv_layers(X)
+
+        # Global average pool to (N, 256)
+        out = torch.flatten(self.pool(out), 1)
+
+        # Fully connected
+        out = self.dense_layers(out)
+
+        return out
+
 idx_to_classes = {0: 'Apple___Apple_scab',
                   1: 'Apple___Black_rot',
                   2: 'Apple___Cedar_apple_rust',
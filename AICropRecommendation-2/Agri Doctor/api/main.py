@@ -3,19 +3,17 @@ FastAPI Backend for Crop Disease Detection
 Provides REST API endpoints for disease prediction with visual explanations
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import torch
-import torch.nn.functional as F
-from PIL import Image
-import io
-import json
 import sys
 import os
+import queue
+import time
 from pathlib import Path
 from typing import Optional, Dict, Any
-import tempfile
 import traceback
 
 # Add src to path for imports
@@ -27,6 +25,19 @@ try:
     from src.explain import CropDiseaseExplainer
     from src.risk_level import RiskLevelCalculator
     from src.dataset import get_transforms
+    from src.inference_engine import InferenceEngine
+    from src.model_loader import load_serving_model, TINY_MODEL_PATH
+    from src.cascade import build_cascade_engine, CascadeEngine, DISEASE_CASCADE
+    from src.early_exit import EarlyExitModel, DISEASE_EARLY_EXIT, has_exit_heads, load_exit_thresholds
+    from src.prune import apply_channel_config
+    from src.knowledge_base import get_knowledge_base
+    from src.result_cache import build_cached_engine, model_version
+    from src.image_decode import read_upload_limited, decode_image, ImageTooLarge, InvalidImage
+    from src.explanation_jobs import build_explanation_jobs, EXPLANATION_MAX_WAIT_S
+    from src.response_encoding import CompressionMiddleware, artifact_response, encode_heatmap, encode_attention
+    from src.batch_predict import (iter_batch_predictions, wants_ndjson, ndjson_line, detach_uploads, close_uploads,
+                                   BATCH_PREDICT_MAX_FILES, NDJSON_MEDIA_TYPE)
+    from src.tiling import predict_tiles, TILE_MAX_TILES
 except ImportError as e:
     print(f"Import error: {e}")
     print("Make sure all required modules are available")
@@ -47,16 +58,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Brotli/gzip for JSON responses (binary heatmaps and event streams pass through)
+app.add_middleware(CompressionMiddleware)
+
 # Global variables for model and components
 model = None
 explainer = None
 risk_calculator = None
 class_names = []
 device = None
+engine = None
+model_variant = None
+model_backend = None
+early_exit_model = None
+cascade_enabled = False
+explanation_jobs = None
 
 def load_model_and_components():
     """Load trained model and initialize components"""
-    global model, explainer, risk_calculator, class_names, device
+    global model, explainer, risk_calculator, class_names, device, engine, model_variant, model_backend, early_exit_model, cascade_enabled, explanation_jobs
     
     try:
         # Set device
@@ -86,7 +106,6 @@ def load_model_and_components():
         model_path = 'models/crop_disease_v3_model.pth'
         
         if os.path.exists(model_path):
-            model = CropDiseaseResNet50(num_classes=len(class_names), pretrained=False)
             checkpoint = torch.load(model_path, map_location=device)
             
             # Handle checkpoint format from crop_disease_v3_model.pth
@@ -98,6 +117,13 @@ def load_model_and_components():
             else:
                 state_dict = checkpoint
             
+            # Checkpoints trained with early exits carry the extra heads
+            model = CropDiseaseResNet50(num_classes=len(class_names), pretrained=False,
+                                        early_exits=has_exit_heads(state_dict))
+            
+            # Pruned checkpoints (see src/prune.py) have narrower Bottleneck layers
+            if isinstance(checkpoint, dict) and checkpoint.get('pruning'):
+                apply_channel_config(model, checkpoint['pruning']['channels'])
             model.load_state_dict(state_dict, strict=True)
             model.to(device)
             model.eval()
@@ -108,10 +134,43 @@ def load_model_and_components():
             model.to(device)
             model.eval()
         
+        # Shared engine serves the configured variant; explanations use the FP32 model
+        serving_model, model_variant, model_backend = load_serving_model(model, model_path, device=device)
+        
+        # Optionally stop confident images at the layer2/layer3 exits (eager FP32 only)
+        if DISEASE_EARLY_EXIT:
+            thresholds = load_exit_thresholds(model_path)
+            if not model.early_exits or thresholds is None:
+                print(f"⚠️ Early exit disabled: checkpoint has no calibrated exit heads ({model_path})")
+            elif (model_variant, model_backend) != ('fp32', 'eager'):
+                print(f"⚠️ Early exit disabled: needs the eager FP32 model, not {model_variant}/{model_backend}")
+            else:
+                model.exit_thresholds = {k: v for k, v in thresholds.items() if v is not None}
+                early_exit_model = EarlyExitModel(serving_model)
+                serving_model = early_exit_model
+                print(f"✅ Early exit enabled (thresholds {model.exit_thresholds})")
+        
+        engine = InferenceEngine(serving_model, class_names, device=device)
+        
+        # Optionally answer confident images with the distilled tiny model first
+        if DISEASE_CASCADE:
+            engine = build_cascade_engine(engine, TINY_MODEL_PATH, device=device) or engine
+        cascade_enabled = isinstance(engine, CascadeEngine)
+        
+        # Repeated and near-duplicate uploads are answered from the result cache
+        engine = build_cached_engine(engine, model_version(
+            model_path, model_variant, model_backend,
+            f"cascade={cascade_enabled}", f"early_exit={early_exit_model is not None}"
+        ))
+        engine.start()
+        
         # Initialize explainer
         explainer = CropDiseaseExplainer(model, class_names, device)
         print("Explainer initialized")
         
+        # Heatmaps are computed in the background unless env EXPLANATION_JOBS is off
+        explanation_jobs = build_explanation_jobs(explain_jobs_batch, 'resnet')
+        
         # Initialize risk calculator
         risk_calculator = RiskLevelCalculator()
         print("Risk calculator initialized")
@@ -130,6 +189,14 @@ async def startup_event():
     if not success:
         print("Warning: Failed to load some components. API may have limited functionality.")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the inference batcher and explanation workers"""
+    if engine:
+        engine.stop()
+    if explanation_jobs:
+        explanation_jobs.stop()
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -139,7 +206,11 @@ async def root():
         "status": "active",
         "endpoints": {
             "predict": "/predict - POST with image file",
-            "health": "/health - GET for health check"
+            "predict_tiles": "/predict_tiles - POST high-resolution field photo for a per-tile disease map",
+            "explanations": "/explanations/{explanation_id} - GET Grad-CAM result (long-poll with ?wait=, SSE with Accept: text/event-stream)",
+            "heatmap": "/explanations/{explanation_id}/heatmap - GET WebP/JPEG bytes (/attention for the float16 map)",
+            "health": "/health - GET for health check",
+            "metrics": "/metrics - GET inference batching metrics"
         }
     }
 
@@ -150,11 +221,131 @@ async def health_check():
         "status": "ok",
         "model_loaded": model is not None,
         "explainer_ready": explainer is not None,
+        "explanation_jobs": explanation_jobs is not None,
         "risk_calculator_ready": risk_calculator is not None,
         "device": str(device) if device else "unknown",
+        "model_variant": model_variant,
+        "model_backend": model_backend,
+        "cascade": cascade_enabled,
+        "early_exit": early_exit_model is not None,
+        "knowledge_base": get_knowledge_base().stats(),
         "classes": len(class_names)
     }
 
+@app.get("/metrics")
+async def inference_metrics():
+    """Micro-batching metrics (batch-size histogram and timings)"""
+    if not engine:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    metrics = engine.metrics()
+    if early_exit_model is not None:
+        metrics['early_exit'] = early_exit_model.exit_stats()
+    if explanation_jobs is not None:
+        metrics['explanation_jobs'] = explanation_jobs.metrics()
+    return metrics
+
+def explainer_serves_prediction():
+    """Whether the explainer's eager FP32 ResNet50 is exactly the model being served"""
+    return ((model_variant, model_backend) == ('fp32', 'eager')
+            and early_exit_model is None and not cascade_enabled)
+
+def explain_jobs_batch(jobs):
+    """
+    Explanation worker: Grad-CAM for a batch of queued uploads in one pass
+    
+    Args:
+        jobs: Queued jobs with image_bytes and params['target_idx'] (the class
+            reported by /predict)
+    
+    Returns:
+        One result dict per job
+    """
+    results = [None] * len(jobs)
+    images, targets, positions = [], [], []
+    for i, job in enumerate(jobs):
+        try:
+            images.append(decode_image(job['image_bytes']))
+        except (ImageTooLarge, InvalidImage) as e:
+            results[i] = {'error': str(e)}
+            continue
+        targets.append(job['params'].get('target_idx'))
+        positions.append(i)
+    
+    if images:
+        explanations = explainer.explain_images(images, targets)
+        for i, explanation in zip(positions, explanations):
+            job_id = jobs[i]['id']
+            results[i] = {
+                'target_class': explanation['target_class'],
+                'predicted_class': explanation['predicted_class'],
+                'confidence': explanation['confidence'],
+                'heatmap_url': f"/explanations/{job_id}/heatmap",
+                'attention_url': f"/explanations/{job_id}/attention",
+                'attention_shape': list(explanation['cam'].shape),
+                # Served as bytes from /heatmap and /attention, not inlined as base64
+                'artifacts': {
+                    'heatmap': encode_heatmap(explanation['cam_image']),
+                    'attention': encode_attention(explanation['cam'])
+                }
+            }
+    return results
+
+@app.get("/explanations/{explanation_id}")
+async def get_explanation(explanation_id: str, request: Request, wait: float = 0):
+    """
+    Grad-CAM result for an explanation id returned by /predict
+    
+    Args:
+        explanation_id: Id from the /predict response
+        wait: Long-poll up to this many seconds for the result
+    
+    Returns:
+        The result (200) or the current status (202); with
+        Accept: text/event-stream, a status event followed by the result event
+    """
+    if explanation_jobs is None:
+        raise HTTPException(status_code=503, detail="Explanation jobs not running")
+    if explanation_jobs.get(explanation_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired explanation id")
+    
+    if 'text/event-stream' in request.headers.get('accept', ''):
+        return StreamingResponse(
+            explanation_jobs.events(explanation_id, wait or EXPLANATION_MAX_WAIT_S),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache'}
+        )
+    
+    state = await explanation_jobs.wait(explanation_id, wait)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired explanation id")
+    return JSONResponse(content=state, status_code=200 if 'result' in state else 202)
+
+def explanation_artifact_response(request, explanation_id, name):
+    """Binary output of a finished explanation, or its status (202) while queued"""
+    if explanation_jobs is None:
+        raise HTTPException(status_code=503, detail="Explanation jobs not running")
+    found = explanation_jobs.artifact(explanation_id, name)
+    if found is not None:
+        artifact, remaining_s = found
+        return artifact_response(request, artifact, remaining_s)
+    
+    state = explanation_jobs.get(explanation_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired explanation id")
+    if 'result' in state:
+        raise HTTPException(status_code=404, detail=f"Explanation has no {name}")
+    return JSONResponse(content=state, status_code=202, headers={'Retry-After': '1'})
+
+@app.get("/explanations/{explanation_id}/heatmap")
+async def get_explanation_heatmap(explanation_id: str, request: Request):
+    """Heatmap overlay as raw WebP/JPEG bytes with ETag and Cache-Control"""
+    return explanation_artifact_response(request, explanation_id, 'heatmap')
+
+@app.get("/explanations/{explanation_id}/attention")
+async def get_explanation_attention(explanation_id: str, request: Request):
+    """Low-resolution attention map as little-endian float16 (shape in X-Attention-Shape)"""
+    return explanation_artifact_response(request, explanation_id, 'attention')
+
 @app.post("/predict")
 async def predict_disease(
     file: UploadFile = File(...),
@@ -187,34 +378,48 @@ async def predict_disease(
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Read and process image
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data)).convert('RGB')
-        
-        # Preprocess image
-        from torchvision import transforms
-        transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-        
-        input_tensor = transform(image).unsqueeze(0).to(device)
-        
-        # Make prediction
-        with torch.no_grad():
-            outputs = model(input_tensor)
-            probabilities = F.softmax(outputs, dim=1)
-            confidence, predicted_idx = torch.max(probabilities, 1)
-            
-            predicted_class = class_names[predicted_idx.item()]
-            confidence_score = confidence.item()
+        # Read upload into a bounded buffer and decode near the model resolution
+        try:
+            image_data = await read_upload_limited(file)
+            image = decode_image(image_data)
+        except ImageTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except InvalidImage as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        # Inline explanations (no job queue). When the served model is the
+        # explainer's own eager FP32 ResNet50, the Grad-CAM pass also classifies
+        # the image; otherwise the engine classifies and the heatmap targets its class
+        explanation = None
+        prediction = None
+        inline_explanation = include_explanation and explainer and explanation_jobs is None
+        if inline_explanation and explainer_serves_prediction():
+            try:
+                start = time.perf_counter()
+                explanation = await run_in_threadpool(explainer.explain_image, image, return_base64=True)
+                prediction = explanation['prediction']
+                engine.remember(image_data, image, prediction, (time.perf_counter() - start) * 1000)
+                prediction['cache'] = None
+            except Exception as e:
+                print(f"Error generating explanation: {e}")
+        
+        if prediction is None:
+            # Make prediction (cached by upload hash, batched with concurrent requests)
+            prediction = await engine.predict_async(image, image_bytes=image_data)
+            if inline_explanation:
+                try:
+                    explanation = await run_in_threadpool(
+                        explainer.explain_image, image,
+                        target_class=prediction['index'], return_base64=True
+                    )
+                except Exception as e:
+                    print(f"Error generating explanation: {e}")
+        
+        predicted_class = prediction['class_name']
+        confidence_score = prediction['confidence']
         
         # Get all class probabilities
-        class_probabilities = {
-            class_names[i]: probabilities[0, i].item() 
-            for i in range(len(class_names))
-        }
+        class_probabilities = engine.class_probabilities(prediction)
         
         # Parse crop and disease from class name (improved for V3 model formats)
         if '___' in predicted_class:
@@ -246,23 +451,8 @@ async def predict_disease(
             predicted_class, confidence_score, weather_data, growth_stage
         )
         
-        # Load disease information
-        disease_info = {}
-        try:
-            with open('knowledge_base/disease_info.json', 'r') as f:
-                kb_data = json.load(f)
-                for d in kb_data['diseases']:
-                    # Use the class_name field directly instead of constructing it
-                    if d.get('class_name') == predicted_class:
-                        disease_info = {
-                            'description': d['description'],
-                            'symptoms': d['symptoms'],
-                            'solutions': d['solutions'],
-                            'prevention': d['prevention']
-                        }
-                        break
-        except Exception as e:
-            print(f"Error loading disease info: {e}")
+        # Disease information from the shared, indexed knowledge base
+        disease_info = get_knowledge_base().info(predicted_class)
         
         # Prepare response
         response = {
@@ -274,59 +464,63 @@ async def predict_disease(
             'class_probabilities': class_probabilities,
             'risk_assessment': risk_assessment,
             'disease_info': disease_info,
+            'model_used': prediction.get('model', 'resnet50'),
+            'cache_hit': prediction.get('cache'),
             'prediction_timestamp': risk_assessment['assessment_timestamp']
         }
         
-        # Generate visual explanation if requested
-        if include_explanation and explainer:
+        # Attach the visual explanation if requested: queued for the background
+        # workers (fetch from /explanations/{id}) or computed inline above
+        if include_explanation and explainer and explanation_jobs is not None:
             try:
-                # Save temporary image file
-                with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp_file:
-                    image.save(tmp_file.name)
-                    tmp_path = tmp_file.name
-                
-                # Generate explanation
-                explanation = explainer.explain_prediction(
-                    tmp_path, return_base64=True
-                )
-                
-                if 'error' in explanation:
-                    response['explanation'] = {
-                        'error': explanation['error'],
-                        'explanation_image': ''
-                    }
-                else:
-                    response['explanation'] = {
-                        'explanation_image': explanation.get('overlay_base64', ''),
-                        'predicted_class': explanation.get('predicted_class', predicted_class),
-                        'confidence': explanation.get('confidence', confidence_score),
-                        'save_path': explanation.get('save_path', '')
-                    }
-                
-                # Clean up temporary file
-                os.unlink(tmp_path)
-                
-            except Exception as e:
-                print(f"Error generating explanation: {e}")
+                explanation_id = explanation_jobs.submit(image_data, target_idx=prediction['index'])
+                response['explanation_id'] = explanation_id
                 response['explanation'] = {
-                    'error': 'Could not generate visual explanation',
-                    'explanation_image': ''
+                    'explanation_id': explanation_id,
+                    'status': 'queued',
+                    'url': f"/explanations/{explanation_id}"
                 }
+            except queue.Full as e:
+                response['explanation'] = {'error': str(e), 'explanation_image': ''}
+        elif explanation is not None:
+            response['explanation'] = {
+                'explanation_image': explanation.get('overlay_base64', ''),
+                'predicted_class': explanation['predicted_class'],
+                'confidence': explanation['confidence'],
+                'target_class': explanation['target_class']
+            }
+        elif include_explanation and explainer:
+            response['explanation'] = {
+                'error': 'Could not generate visual explanation',
+                'explanation_image': ''
+            }
         
         return JSONResponse(content=response)
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Prediction error: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 @app.post("/batch_predict")
-async def batch_predict(files: list[UploadFile] = File(...)):
+async def batch_predict(
+    request: Request,
+    files: list[UploadFile] = File(...),
+    include_explanation: bool = Form(False)
+):
     """
     Predict diseases for multiple images
     
+    Uploads are decoded in parallel and predicted in stacked sub-batches. With
+    Accept: application/x-ndjson, one JSON line per image is streamed as each
+    sub-batch completes, followed by a summary line.
+    
     Args:
         files: List of uploaded image files
+        include_explanation: Whether to include Grad-CAM explanations, computed
+            for each sub-batch in one forward/backward pass
     
     Returns:
         JSON response with predictions for all images
@@ -335,74 +529,181 @@ async def batch_predict(files: list[UploadFile] = File(...)):
     if not model:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
-    if len(files) > 10:  # Limit batch size
-        raise HTTPException(status_code=400, detail="Maximum 10 images per batch")
+    if len(files) > BATCH_PREDICT_MAX_FILES:  # Limit batch size
+        raise HTTPException(status_code=400, detail=f"Maximum {BATCH_PREDICT_MAX_FILES} images per batch")
     
-    try:
-        predictions = []
-        
-        for i, file in enumerate(files):
-            if not file.content_type.startswith('image/'):
-                predictions.append({
-                    'filename': file.filename,
-                    'error': 'Invalid file type'
-                })
-                continue
-            
-            try:
-                # Process individual image
-                image_data = await file.read()
-                image = Image.open(io.BytesIO(image_data)).convert('RGB')
-                
-                # Make prediction (simplified for batch processing)
-                from torchvision import transforms
-                transform = transforms.Compose([
-                    transforms.Resize((224, 224)),
-                    transforms.ToTensor(),
-                    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-                ])
-                
-                input_tensor = transform(image).unsqueeze(0).to(device)
+    explain = include_explanation and explainer is not None
+    
+    async def sub_batches(files):
+        async for items in iter_batch_predictions(files, engine, keep_images=explain):
+            predictions = []
+            # (prediction entry, decoded image, upload bytes, class index) to explain
+            to_explain = []
+            for item in items:
+                if 'error' in item:
+                    predictions.append({'filename': item['filename'], 'error': item['error']})
+                    continue
                 
-                with torch.no_grad():
-                    outputs = model(input_tensor)
-                    probabilities = F.softmax(outputs, dim=1)
-                    confidence, predicted_idx = torch.max(probabilities, 1)
-                    
-                    predicted_class = class_names[predicted_idx.item()]
-                    confidence_score = confidence.item()
+                prediction = item['prediction']
+                predicted_class = prediction['class_name']
+                confidence_score = prediction['confidence']
                 
                 # Calculate basic risk
                 risk_level = risk_calculator.calculate_base_risk(predicted_class, confidence_score)
                 
-                predictions.append({
-                    'filename': file.filename,
+                entry = {
+                    'filename': item['filename'],
                     'predicted_class': predicted_class,
                     'confidence': confidence_score,
-                    'risk_level': risk_level
-                })
-                
-            except Exception as e:
-                predictions.append({
-                    'filename': file.filename,
-                    'error': str(e)
-                })
-        
-        # Generate summary
-        summary = risk_calculator.get_risk_summary([
-            p for p in predictions if 'error' not in p
-        ])
-        
-        return JSONResponse(content={
-            'predictions': predictions,
-            'summary': summary,
+                    'risk_level': risk_level,
+                    'cache_hit': prediction.get('cache')
+                }
+                predictions.append(entry)
+                if explain:
+                    to_explain.append((entry, item['image'], item['image_bytes'], prediction['index']))
+            
+            if to_explain:
+                await explain_batch_predictions(to_explain)
+            del items, to_explain
+            yield predictions
+    
+    def summary_of(predictions):
+        successful = [p for p in predictions if 'error' not in p]
+        return {
+            'summary': risk_calculator.get_risk_summary(successful),
             'total_processed': len(files),
-            'successful_predictions': len([p for p in predictions if 'error' not in p])
-        })
+            'successful_predictions': len(successful)
+        }
+    
+    if wants_ndjson(request):
+        # The stream reads the uploads after this handler has returned
+        uploads = detach_uploads(files)
+        
+        async def lines():
+            # Only the fields the risk summary needs are kept across sub-batches
+            seen = []
+            try:
+                async for predictions in sub_batches(uploads):
+                    for entry in predictions:
+                        yield ndjson_line(entry)
+                        seen.append({k: entry[k] for k in ('predicted_class', 'confidence', 'risk_level', 'error') if k in entry})
+                yield ndjson_line(summary_of(seen))
+            finally:
+                close_uploads(uploads)
+        return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+    
+    try:
+        predictions = []
+        async for sub_batch in sub_batches(files):
+            predictions.extend(sub_batch)
+        
+        return JSONResponse(content={'predictions': predictions, **summary_of(predictions)})
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Batch prediction failed: {str(e)}")
 
+@app.post("/predict_tiles")
+async def predict_disease_tiles(
+    file: UploadFile = File(...),
+    max_tiles: Optional[int] = Form(None),
+    overlap: Optional[float] = Form(None)
+):
+    """
+    Tiled prediction for high-resolution field photos
+    
+    The photo is split into overlapping 224px tiles (downscaled first when the
+    grid would exceed the tile budget), all tiles are classified in batched
+    forward passes and the result is a coarse disease-probability grid plus
+    an aggregated verdict.
+    
+    Args:
+        file: Uploaded image file
+        max_tiles: Tile budget, capped at env TILE_MAX_TILES
+        overlap: Fraction of a tile shared with its neighbour (0 to 0.9)
+    
+    Returns:
+        JSON response with the verdict, risk level, disease info and tile grid
+    """
+    
+    if not model:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if max_tiles is not None and not 1 <= max_tiles <= TILE_MAX_TILES:
+        raise HTTPException(status_code=400, detail=f"max_tiles must be between 1 and {TILE_MAX_TILES}")
+    if overlap is not None and not 0 <= overlap <= 0.9:
+        raise HTTPException(status_code=400, detail="overlap must be between 0 and 0.9")
+    
+    try:
+        if not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="File must be an image")
+        
+        try:
+            image_data = await read_upload_limited(file)
+            result = await predict_tiles(image_data, engine, max_tiles=max_tiles, overlap=overlap)
+        except ImageTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except InvalidImage as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        predicted_class = result['predicted_class']
+        result['risk_level'] = risk_calculator.calculate_base_risk(predicted_class, result['confidence'])
+        result['disease_info'] = get_knowledge_base().info(predicted_class)
+        result['filename'] = file.filename
+        
+        return JSONResponse(content=result)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Tiled prediction error: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Tiled prediction failed: {str(e)}")
+
+async def explain_batch_predictions(to_explain):
+    """
+    Attach Grad-CAM explanations to /batch_predict entries
+    
+    Queued together as one group for the background workers, or computed
+    inline in one batched pass when the job queue is off.
+    
+    Args:
+        to_explain: List of (prediction entry, image, upload bytes, class index)
+    """
+    if explanation_jobs is not None:
+        try:
+            explanation_ids = explanation_jobs.submit_many([
+                (image_data, {'target_idx': index}) for _, _, image_data, index in to_explain
+            ])
+        except queue.Full as e:
+            for entry, _, _, _ in to_explain:
+                entry['explanation'] = {'error': str(e)}
+            return
+        for (entry, _, _, _), explanation_id in zip(to_explain, explanation_ids):
+            entry['explanation_id'] = explanation_id
+            entry['explanation'] = {
+                'explanation_id': explanation_id,
+                'status': 'queued',
+                'url': f"/explanations/{explanation_id}"
+            }
+        return
+    
+    try:
+        explanations = await run_in_threadpool(
+            explainer.explain_images,
+            [image for _, image, _, _ in to_explain],
+            [index for _, _, _, index in to_explain],
+            True
+        )
+    except Exception as e:
+        print(f"Error generating batch explanation: {e}")
+        for entry, _, _, _ in to_explain:
+            entry['explanation'] = {'error': 'Could not generate visual explanation', 'explanation_image': ''}
+        return
+    for (entry, _, _, _), explanation in zip(to_explain, explanations):
+        entry['explanation'] = {
+            'explanation_image': explanation['overlay_base64'],
+            'target_class': explanation['target_class']
+        }
+
 @app.get("/classes")
 async def get_classes():
     """Get list of supported disease classes"""
@@ -441,20 +742,14 @@ async def get_model_info():
 async def get_disease_info(crop: str, disease: str):
     """Get detailed information about a specific disease"""
     
-    try:
-        with open('knowledge_base/disease_info.json', 'r') as f:
-            kb_data = json.load(f)
-            
-        for d in kb_data['diseases']:
-            if d['crop'].lower() == crop.lower() and d['disease'].lower() == disease.lower():
-                return d
-        
-        raise HTTPException(status_code=404, detail="Disease information not found")
-        
-    except FileNotFoundError:
+    knowledge_base = get_knowledge_base()
+    if not knowledge_base.loaded:
         raise HTTPException(status_code=503, detail="Knowledge base not available")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error retrieving disease info: {str(e)}")
+    
+    entry = knowledge_base.find(crop, disease)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Disease information not found")
+    return entry
 
 if __name__ == "__main__":
     import uvicorn
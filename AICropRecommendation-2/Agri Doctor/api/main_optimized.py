@@ -3,32 +3,34 @@ Memory-optimized FastAPI Backend for Crop Disease Detection
 Optimized to use <512MB RAM
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import torch
-import torch.nn.functional as F
-from PIL import Image
-import io
-import json
 import sys
 import os
-from pathlib import Path
+import queue
 from typing import Optional, Dict, Any
 import tempfile
 import traceback
 import gc
-import psutil
 
 # Add src to path for imports
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 try:
-    from src.model import CropDiseaseResNet50Lite
     from src.explain_lite import CropDiseaseExplainerLite
     from src.risk_level import RiskLevelCalculator
     from src.dataset import get_inference_transforms
+    from src.inference_engine import InferenceEngine, build_preprocess
+    from src.model_loader import load_memory_budget_model, LITE_MODEL_PATH
+    from src.image_decode import read_upload_limited, decode_image, ImageTooLarge, InvalidImage
+    from src.memory_governor import MemoryGovernor
+    from src.knowledge_base import get_knowledge_base
+    from src.result_cache import build_cached_engine, model_version
+    from src.explanation_jobs import build_explanation_jobs, EXPLANATION_MAX_WAIT_S
+    from src.response_encoding import CompressionMiddleware, artifact_response, encode_heatmap, encode_attention
 except ImportError as e:
     print(f"Import error: {e}")
     print("Make sure all required modules are available")
@@ -49,6 +51,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Brotli/gzip for JSON responses (binary heatmaps and event streams pass through)
+app.add_middleware(CompressionMiddleware)
+
 # Global variables for model and components
 model = None
 explainer = None
@@ -56,22 +61,29 @@ risk_calculator = None
 class_names = []
 device = None
 transforms = None
+engine = None
+model_variant = None
+model_backend = None
+model_selection = {}
+memory_governor = None
+explanation_jobs = None
+
+# Explanations are skipped above this RSS (from the governor's last sample)
+EXPLANATION_MEMORY_LIMIT_MB = 400
 
 def get_memory_usage():
-    """Get current memory usage in MB"""
-    process = psutil.Process(os.getpid())
-    memory_info = process.memory_info()
-    return memory_info.rss / 1024 / 1024  # Convert to MB
+    """Current memory usage in MB from the governor's last sample"""
+    return memory_governor.rss_mb() if memory_governor else 0.0
 
 def optimize_memory():
-    """Force garbage collection and clear GPU cache"""
+    """Force garbage collection and clear GPU cache (startup only)"""
     gc.collect()
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
 
 def load_model_and_components():
     """Load trained model and initialize components with memory optimization"""
-    global model, explainer, risk_calculator, class_names, device, transforms
+    global model, explainer, risk_calculator, class_names, device, transforms, engine, model_variant, model_backend, model_selection, memory_governor, explanation_jobs
     
     try:
         # Set device - prefer CPU for memory efficiency
@@ -100,46 +112,21 @@ def load_model_and_components():
             'Tomato_Spider_mites'
         ]
         
-        # Load model with memory optimization
-        model_path = 'models/crop_disease_v3_model.pth'
-        
-        if os.path.exists(model_path):
-            # Use lite version of model
-            model = CropDiseaseResNet50Lite(num_classes=len(class_names), pretrained=False)
-            
-            # Load with memory mapping for large files
-            checkpoint = torch.load(model_path, map_location=device, weights_only=True)
-            
-            if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
-                state_dict = checkpoint['model_state_dict']
-                if 'class_names' in checkpoint:
-                    class_names = checkpoint['class_names']
-            else:
-                state_dict = checkpoint
-            
-            # Load state dict and immediately clear checkpoint from memory
-            model.load_state_dict(state_dict, strict=False)
-            del checkpoint, state_dict
-            optimize_memory()
-            
-            model.to(device)
-            model.eval()
-            
-            # Enable memory efficient mode
-            if hasattr(model, 'set_memory_efficient'):
-                model.set_memory_efficient(True)
-            
-            print(f"Lite model loaded from {model_path}")
-        else:
-            print("Warning: No trained model found. Creating lite model.")
-            model = CropDiseaseResNet50Lite(num_classes=len(class_names), pretrained=True)
-            model.to(device)
-            model.eval()
+        # Load the largest model variant that fits the available RAM
+        model_path = LITE_MODEL_PATH
+        model, model_selection = load_memory_budget_model(model_path, len(class_names), device=device)
+        if model_selection['class_names']:
+            class_names = model_selection['class_names']
+        model_variant = model_selection['variant']
+        model_backend = model_selection['backend']
         
         # Initialize lite explainer only if needed
         explainer = CropDiseaseExplainerLite(model, class_names, device)
         print("Lite explainer initialized")
         
+        # Attention maps are computed in the background unless env EXPLANATION_JOBS is off
+        explanation_jobs = build_explanation_jobs(explain_jobs_batch, 'lite')
+        
         # Initialize risk calculator
         risk_calculator = RiskLevelCalculator()
         print("Risk calculator initialized")
@@ -147,11 +134,15 @@ def load_model_and_components():
         # Pre-load transforms
         transforms = get_inference_transforms(input_size=224)
         
-        # Force memory cleanup
-        optimize_memory()
+        # Shared engine: preprocessing plus batched forward passes
+        engine = InferenceEngine(model, class_names, device=device, preprocess=build_preprocess(224))
+        # Repeated and near-duplicate uploads are answered from the result cache
+        engine = build_cached_engine(engine, model_version(model_path, model_variant, model_backend)).start()
         
-        memory_usage = get_memory_usage()
-        print(f"Memory usage after loading: {memory_usage:.1f} MB")
+        # One collection after loading, then leave housekeeping to the governor
+        optimize_memory()
+        memory_governor = MemoryGovernor().start()
+        print(f"Memory usage after loading: {get_memory_usage():.1f} MB")
         
         return True
         
@@ -170,6 +161,16 @@ async def startup_event():
     else:
         print("⚠️ Failed to load some components")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the inference batcher, explanation workers and memory governor"""
+    if engine:
+        engine.stop()
+    if explanation_jobs:
+        explanation_jobs.stop()
+    if memory_governor:
+        memory_governor.stop()
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -182,8 +183,11 @@ async def root():
         "optimization": "Memory optimized for <512MB usage",
         "endpoints": {
             "predict": "/predict - POST with image file",
+            "explanations": "/explanations/{explanation_id} - GET attention map (long-poll with ?wait=, SSE with Accept: text/event-stream)",
+            "heatmap": "/explanations/{explanation_id}/heatmap - GET WebP/JPEG bytes (/attention for the float16 map)",
             "health": "/health - GET for health check",
-            "memory": "/memory - GET memory usage info"
+            "memory": "/memory - GET memory usage info",
+            "metrics": "/metrics - GET inference batching metrics"
         }
     }
 
@@ -195,28 +199,129 @@ async def health_check():
         "status": "ok",
         "model_loaded": model is not None,
         "explainer_loaded": explainer is not None,
+        "explanation_jobs": explanation_jobs is not None,
         "device": str(device) if device else "unknown",
+        "model_variant": model_variant,
+        "model_backend": model_backend,
+        "memory_available_at_load_mb": model_selection.get('available_mb'),
+        "knowledge_base": get_knowledge_base().stats(),
         "memory_usage_mb": f"{memory_usage:.1f}",
         "memory_optimized": memory_usage < 512
     }
 
 @app.get("/memory")
 async def memory_info():
-    """Get detailed memory usage information"""
-    memory_usage = get_memory_usage()
-    process = psutil.Process(os.getpid())
-    memory_info = process.memory_info()
+    """Memory usage from the governor's last background sample"""
+    if memory_governor is None:
+        raise HTTPException(status_code=503, detail="Memory governor not running")
     
+    sample = memory_governor.last_sample()
     return {
-        "memory_usage_mb": f"{memory_usage:.1f}",
-        "memory_percent": f"{process.memory_percent():.1f}%",
-        "rss_mb": f"{memory_info.rss / 1024 / 1024:.1f}",
-        "vms_mb": f"{memory_info.vms / 1024 / 1024:.1f}",
-        "available_memory_mb": f"{psutil.virtual_memory().available / 1024 / 1024:.1f}",
-        "gpu_memory_allocated": f"{torch.cuda.memory_allocated() / 1024 / 1024:.1f}" if torch.cuda.is_available() else "N/A",
-        "optimization_status": "Optimized" if memory_usage < 512 else "Needs optimization"
+        "memory_usage_mb": f"{sample['rss_mb']:.1f}",
+        "memory_percent": f"{sample['memory_percent']:.1f}%",
+        "rss_mb": f"{sample['rss_mb']:.1f}",
+        "vms_mb": f"{sample['vms_mb']:.1f}",
+        "available_memory_mb": f"{sample['available_memory_mb']:.1f}",
+        "gpu_memory_allocated": f"{sample['gpu_memory_allocated_mb']:.1f}" if sample['gpu_memory_allocated_mb'] is not None else "N/A",
+        "optimization_status": "Optimized" if sample['within_target'] else "Needs optimization",
+        "governor": {
+            "sampled_at": sample['sampled_at'],
+            "sample_interval_s": sample['sample_interval_s'],
+            "high_water_mb": sample['high_water_mb'],
+            "collections": sample['collections'],
+            "last_collection_freed_mb": sample['last_collection_freed_mb']
+        }
     }
 
+@app.get("/metrics")
+async def inference_metrics():
+    """Micro-batching metrics (batch-size histogram and timings)"""
+    if not engine:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    metrics = engine.metrics()
+    if explanation_jobs is not None:
+        metrics['explanation_jobs'] = explanation_jobs.metrics()
+    return metrics
+
+def explain_jobs_batch(jobs):
+    """Explanation worker: lite attention maps for a batch of queued uploads"""
+    results = []
+    for job in jobs:
+        if not explainer.enabled:
+            results.append({"error": "Explanations disabled due to memory constraints"})
+            continue
+        try:
+            explanation = explainer.explain_lite(job['image_bytes'], job['params']['predicted_class'])
+        except Exception as e:
+            print(f"Lite explanation generation failed: {e}")
+            results.append({"error": f"Explanation generation failed: {str(e)}"})
+            continue
+        
+        job_id = job['id']
+        results.append({
+            "method": "simple_attention",
+            "size": explanation["size"],
+            "heatmap_url": f"/explanations/{job_id}/heatmap",
+            "attention_url": f"/explanations/{job_id}/attention",
+            "attention_shape": list(explanation["attention"].shape),
+            # Served as bytes from /heatmap and /attention, not inlined as base64
+            "artifacts": {
+                "heatmap": encode_heatmap(explanation["image"], quality=60),
+                "attention": encode_attention(explanation["attention"])
+            }
+        })
+        del explanation
+    return results
+
+@app.get("/explanations/{explanation_id}")
+async def get_explanation(explanation_id: str, request: Request, wait: float = 0):
+    """
+    Attention map for an explanation id returned by /predict: the result (200)
+    or current status (202), long-polled with ?wait= or streamed as SSE
+    """
+    if explanation_jobs is None:
+        raise HTTPException(status_code=503, detail="Explanation jobs not running")
+    if explanation_jobs.get(explanation_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired explanation id")
+    
+    if 'text/event-stream' in request.headers.get('accept', ''):
+        return StreamingResponse(
+            explanation_jobs.events(explanation_id, wait or EXPLANATION_MAX_WAIT_S),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache'}
+        )
+    
+    state = await explanation_jobs.wait(explanation_id, wait)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired explanation id")
+    return JSONResponse(content=state, status_code=200 if 'result' in state else 202)
+
+def explanation_artifact_response(request, explanation_id, name):
+    """Binary output of a finished explanation, or its status (202) while queued"""
+    if explanation_jobs is None:
+        raise HTTPException(status_code=503, detail="Explanation jobs not running")
+    found = explanation_jobs.artifact(explanation_id, name)
+    if found is not None:
+        artifact, remaining_s = found
+        return artifact_response(request, artifact, remaining_s)
+    
+    state = explanation_jobs.get(explanation_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired explanation id")
+    if 'result' in state:
+        raise HTTPException(status_code=404, detail=f"Explanation has no {name}")
+    return JSONResponse(content=state, status_code=202, headers={'Retry-After': '1'})
+
+@app.get("/explanations/{explanation_id}/heatmap")
+async def get_explanation_heatmap(explanation_id: str, request: Request):
+    """Heatmap overlay as raw WebP/JPEG bytes with ETag and Cache-Control"""
+    return explanation_artifact_response(request, explanation_id, 'heatmap')
+
+@app.get("/explanations/{explanation_id}/attention")
+async def get_explanation_attention(explanation_id: str, request: Request):
+    """Low-resolution attention map as little-endian float16 (shape in X-Attention-Shape)"""
+    return explanation_artifact_response(request, explanation_id, 'attention')
+
 @app.post("/predict")
 async def predict_disease(
     file: UploadFile = File(...),
@@ -228,60 +333,36 @@ async def predict_disease(
     """
     Predict plant disease from uploaded image (memory optimized)
     """
-    if model is None:
+    if engine is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
     try:
-        # Memory optimization: track usage
-        initial_memory = get_memory_usage()
+        # Read and validate image with memory limits; draft-mode decode keeps
+        # the decoded bitmap close to 224px instead of the full photo
+        try:
+            contents = await read_upload_limited(file, max_bytes=5 * 1024 * 1024)  # 5MB limit
+            image = decode_image(contents)
+        except ImageTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except InvalidImage as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # Read and validate image with memory limits
-        contents = await file.read()
-        if len(contents) > 5 * 1024 * 1024:  # 5MB limit
-            raise HTTPException(status_code=413, detail="Image too large. Maximum size: 5MB")
-        
-        # Process image with memory optimization
-        image = Image.open(io.BytesIO(contents))
-        
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Resize to reduce memory usage
-        max_size = 224
-        if image.size[0] > max_size or image.size[1] > max_size:
-            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-        
-        # Apply transforms
-        if transforms is None:
-            transforms_fn = get_inference_transforms(input_size=224)
-        else:
-            transforms_fn = transforms
-            
-        input_tensor = transforms_fn(image).unsqueeze(0).to(device)
+        # Prediction (cached by upload hash, batched with concurrent requests)
+        prediction = await engine.predict_async(image, image_bytes=contents)
+        cache_hit = prediction.get('cache')
         
-        # Clear image from memory
-        del image, contents
-        optimize_memory()
+        # Drop the decoded image (raw bytes are kept only for the explanation)
+        del image
+        if not include_explanation:
+            del contents
         
-        # Prediction with memory optimization
-        with torch.no_grad():
-            outputs = model(input_tensor)
-            probabilities = F.softmax(outputs, dim=1)
-            confidence, predicted_idx = torch.max(probabilities, 1)
-            
-            predicted_class = class_names[predicted_idx.item()]
-            confidence_score = confidence.item()
+        predicted_class = prediction['class_name']
+        confidence_score = prediction['confidence']
         
         # Get class probabilities (top 3 only to save memory)
-        class_probs = {}
-        top_probs, top_indices = torch.topk(probabilities[0], min(3, len(class_names)))
-        for i, (prob, idx) in enumerate(zip(top_probs, top_indices)):
-            class_probs[class_names[idx.item()]] = prob.item()
+        class_probs = {p['class_name']: p['confidence'] for p in prediction['top_k']}
         
-        # Clear tensors
-        del input_tensor, outputs, probabilities
-        optimize_memory()
+        del prediction
         
         # Load disease information efficiently
         disease_info = get_disease_info_lite(predicted_class)
@@ -303,10 +384,21 @@ async def predict_disease(
         explanation_data = {}
         current_memory = get_memory_usage()
         
-        if include_explanation and current_memory < 400 and explainer:  # Only if we have memory headroom
+        if include_explanation and current_memory < EXPLANATION_MEMORY_LIMIT_MB and explainer and explanation_jobs:
+            # Queued: the upload bytes wait in SQLite, not in this request's memory
+            try:
+                explanation_id = explanation_jobs.submit(contents, predicted_class=predicted_class)
+                explanation_data = {
+                    "explanation_id": explanation_id,
+                    "status": "queued",
+                    "url": f"/explanations/{explanation_id}"
+                }
+            except queue.Full as e:
+                explanation_data = {"error": str(e)}
+        elif include_explanation and current_memory < EXPLANATION_MEMORY_LIMIT_MB and explainer:  # Only if we have memory headroom
             try:
                 explanation_data = explainer.generate_explanation_lite(
-                    await file.read(), predicted_class
+                    contents, predicted_class
                 )
             except Exception as e:
                 print(f"Explanation generation failed: {e}")
@@ -314,10 +406,6 @@ async def predict_disease(
         elif include_explanation:
             explanation_data = {"error": "Explanation disabled due to memory constraints"}
         
-        # Final memory cleanup
-        optimize_memory()
-        final_memory = get_memory_usage()
-        
         # Prepare response
         result = {
             "predicted_class": predicted_class,
@@ -326,47 +414,34 @@ async def predict_disease(
             "disease_info": disease_info,
             "risk_assessment": risk_assessment,
             "crop": extract_crop_name(predicted_class),
+            "cache_hit": cache_hit,
             "memory_usage": {
-                "initial_mb": f"{initial_memory:.1f}",
-                "final_mb": f"{final_memory:.1f}",
-                "memory_optimized": final_memory < 512
+                "rss_mb": f"{current_memory:.1f}",
+                "memory_optimized": current_memory < memory_governor.target_mb
             }
         }
         
         if explanation_data:
             result["explanation"] = explanation_data
+            if "explanation_id" in explanation_data:
+                result["explanation_id"] = explanation_data["explanation_id"]
         
         return JSONResponse(content=result)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        # Cleanup on error
-        optimize_memory()
         print(f"Prediction error: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 def get_disease_info_lite(disease_class: str) -> Dict[str, Any]:
     """Get disease information with memory optimization"""
-    try:
-        # Load only essential disease info to save memory
-        knowledge_base_path = Path(__file__).parent.parent / "knowledge_base" / "disease_info.json"
-        
-        if knowledge_base_path.exists():
-            with open(knowledge_base_path, 'r') as f:
-                all_disease_info = json.load(f)
-            
-            # Get specific disease info
-            disease_info = all_disease_info.get(disease_class, {})
-            
-            # Return only essential fields to save memory
-            return {
-                "symptoms": disease_info.get("symptoms", [])[:3],  # Limit to 3 symptoms
-                "solutions": disease_info.get("solutions", [])[:3],  # Limit to 3 solutions
-                "prevention": disease_info.get("prevention", [])[:3],  # Limit to 3 prevention methods
-                "description": disease_info.get("description", "No description available")[:200]  # Truncate description
-            }
-    except Exception as e:
-        print(f"Error loading disease info: {e}")
+    # Truncated views (3 items per list, 200-char description) are precomputed
+    # when the shared knowledge base loads
+    disease_info = get_knowledge_base().lite(disease_class)
+    if disease_info is not None:
+        return disease_info
     
     return {
         "symptoms": ["Symptoms information unavailable"],
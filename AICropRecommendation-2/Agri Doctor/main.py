@@ -1,5 +1,4 @@
 import os
-import io
 import json
 import traceback
 from datetime import datetime
@@ -7,23 +6,36 @@ from typing import Optional, List, Dict, Any
 import uvicorn
 import pandas as pd
 import torch
-import torchvision.transforms.functional as TF
 from PIL import Image
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import numpy as np
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import CNN
 from database_manager import get_db_manager
+from src.inference_engine import InferenceEngine, build_preprocess
+from src.model_loader import load_serving_model
+from src.cnn_pooled import load_cnn_state_dict
+from src.result_cache import build_cached_engine, model_version
+from src.image_decode import read_upload_limited, decode_image, ImageTooLarge, InvalidImage, BICUBIC
+from src.response_encoding import CompressionMiddleware
+from src.batch_predict import (iter_batch_predictions, wants_ndjson, ndjson_line, detach_uploads, close_uploads,
+                               BATCH_PREDICT_MAX_FILES, NDJSON_MEDIA_TYPE)
 
 # Global variables for model and data
 model = None
+engine = None
+model_variant = None
+model_backend = None
 disease_info = None
 supplement_info = None
 db_manager = None
 
 # Configuration
 MODEL_PATH = r"C:\Document Local\Projects\SIH2025Test\AICropRecommendation-2\Agri Doctor\models\plant_disease_model_1_latest.pt"
+# 'dense' serves the original CNN, 'pooled' the global-average-pooled head (python -m src.cnn_pooled)
+CNN_HEAD = os.getenv('CNN_HEAD', 'dense').lower()
+POOLED_MODEL_PATH = os.getenv('CNN_POOLED_MODEL_PATH', os.path.splitext(MODEL_PATH)[0] + '_pooled.pt')
 DISEASE_INFO_PATH = r"C:\Document Local\Projects\SIH2025Test\AICropRecommendation-2\Agri Doctor\disease_info.csv"
 SUPPLEMENT_INFO_PATH = r"C:\Document Local\Projects\SIH2025Test\AICropRecommendation-2\Agri Doctor\supplement_info.csv"
 
@@ -32,7 +44,7 @@ idx_to_classes = CNN.idx_to_classes
 
 def load_model_and_components():
     """Load CNN model and CSV data exactly like Flask app"""
-    global model, disease_info, supplement_info, db_manager
+    global model, engine, model_variant, model_backend, disease_info, supplement_info, db_manager
     
     try:
         print("📊 Loading CNN model and CSV data...")
@@ -48,16 +60,28 @@ def load_model_and_components():
             print(f"⚠️ Database manager initialization failed: {e}")
             db_manager = None
         
-        # Load CNN model exactly like Flask app
-        if os.path.exists(MODEL_PATH):
-            print(f"Loading CNN model from: {MODEL_PATH}")
-            model = CNN.CNN(39)    
-            model.load_state_dict(torch.load(MODEL_PATH))
+        # Load CNN model exactly like Flask app (or its pooled-head variant)
+        model_path = POOLED_MODEL_PATH if CNN_HEAD == 'pooled' else MODEL_PATH
+        if os.path.exists(model_path):
+            print(f"Loading CNN model ({CNN_HEAD} head) from: {model_path}")
+            if CNN_HEAD == 'pooled':
+                model = CNN.CNNPooled(39)
+                model.load_state_dict(load_cnn_state_dict(model_path))
+            else:
+                model = CNN.CNN(39)    
+                model.load_state_dict(torch.load(MODEL_PATH))
             model.eval()
+            serving_model, model_variant, model_backend = load_serving_model(model, model_path)
+            # Legacy CNN takes un-normalised [0, 1] tensors resized with PIL's default (bicubic) filter
+            engine = InferenceEngine(
+                serving_model, idx_to_classes, preprocess=build_preprocess(224, normalize=False, resample=BICUBIC)
+            )
+            # Repeated and near-duplicate uploads are answered from the result cache
+            engine = build_cached_engine(engine, model_version(model_path, CNN_HEAD, model_variant, model_backend)).start()
             print("✅ CNN model loaded successfully")
         else:
-            print(f"❌ Model file not found: {MODEL_PATH}")
-            raise Exception(f"Model file not found: {MODEL_PATH}")
+            print(f"❌ Model file not found: {model_path}")
+            raise Exception(f"Model file not found: {model_path}")
             
         # Load disease information
         if os.path.exists(DISEASE_INFO_PATH):
@@ -82,36 +106,29 @@ def load_model_and_components():
         traceback.print_exc()
         return False
 
-def prediction(image: Image.Image) -> int:
-    """Predict disease using CNN model - same logic as Flask app"""
-    try:
-        image = image.resize((224, 224))
-        input_data = TF.to_tensor(image)
-        input_data = input_data.view((-1, 3, 224, 224))
-        
-        with torch.no_grad():
-            output = model(input_data)
-            output = output.detach().numpy()
-            index = np.argmax(output)
-        return index
-    except Exception as e:
-        print(f"Error in prediction: {e}")
-        return 0  # Return default class if prediction fails
-
-def predict_disease(image: Image.Image) -> Dict[str, Any]:
-    """Predict disease using CNN model"""
+def predict_disease(image: Image.Image, image_bytes: Optional[bytes] = None) -> Dict[str, Any]:
+    """Predict disease using CNN model (cached by upload hash when image_bytes is given)"""
     global model, disease_info, supplement_info
     
     try:
-        if model is None:
+        if engine is None:
             raise Exception("CNN model not loaded")
             
         # Convert to RGB if necessary
         if image.mode != 'RGB':
             image = image.convert('RGB')
             
-        # Make prediction using the same function as Flask app
-        pred_index = prediction(image)
+        # Single forward pass gives class, confidence and probabilities
+        return format_prediction(engine.predict(image, image_bytes=image_bytes))
+        
+    except Exception as e:
+        print(f"Prediction error: {e}")
+        raise e
+
+def format_prediction(pred: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the API result (class, crop, risk, CSV disease info) for an engine prediction"""
+    try:
+        pred_index = pred['index']
         
         # Get class name
         predicted_class = idx_to_classes.get(pred_index, "Unknown")
@@ -127,20 +144,8 @@ def predict_disease(image: Image.Image) -> Dict[str, Any]:
         disease_details = get_disease_info(pred_index)
         supplement_details = get_supplement_info(pred_index)
         
-        # Calculate confidence from model output
-        with torch.no_grad():
-            image_resized = image.resize((224, 224))
-            input_data = TF.to_tensor(image_resized)
-            input_data = input_data.view((-1, 3, 224, 224))
-            output = model(input_data)
-            probabilities = torch.nn.functional.softmax(output, dim=1)
-            confidence = float(torch.max(probabilities).item())
-            
-            # Create class probabilities dictionary
-            class_probabilities = {}
-            for idx, prob in enumerate(probabilities[0]):
-                if idx in idx_to_classes:
-                    class_probabilities[idx_to_classes[idx]] = float(prob.item())
+        confidence = pred['confidence']
+        class_probabilities = engine.class_probabilities(pred)
         
         result = {
             "predicted_class": predicted_class,
@@ -154,7 +159,8 @@ def predict_disease(image: Image.Image) -> Dict[str, Any]:
             "disease_info": disease_details,
             "class_probabilities": class_probabilities,
             "supplement_info": supplement_details,
-            "model_status": "CNN"
+            "model_status": "CNN",
+            "cache_hit": pred.get('cache')
         }
         
         return result
@@ -276,6 +282,8 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     print("🛑 Shutting down CropAI Disease Detection API...")
+    if engine:
+        engine.stop()
 
 app = FastAPI(
     title="CropAI Disease Detection API",
@@ -293,18 +301,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Brotli/gzip for JSON responses (binary heatmaps and event streams pass through)
+app.add_middleware(CompressionMiddleware)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "ok",
         "model_loaded": model is not None,
+        "model_variant": model_variant,
+        "model_backend": model_backend,
+        "cnn_head": CNN_HEAD,
         "disease_data_loaded": disease_info is not None,
         "supplement_data_loaded": supplement_info is not None,
         "classes": len(idx_to_classes),
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics")
+async def inference_metrics():
+    """Micro-batching metrics (batch-size histogram and timings)"""
+    if engine is None:
+        raise HTTPException(status_code=503, detail="CNN model not loaded")
+    return engine.metrics()
+
 @app.get("/classes")
 async def get_classes():
     """Get all disease classes"""
@@ -332,16 +353,17 @@ async def predict_disease_endpoint(
         if not file.content_type or not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Read and process image
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        # Read upload into a bounded buffer and decode near the model resolution
+        try:
+            image_data = await read_upload_limited(file)
+            image = decode_image(image_data)
+        except ImageTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except InvalidImage as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # Make prediction
-        result = predict_disease(image)
+        # Make prediction in a worker thread so concurrent requests can be batched
+        result = await run_in_threadpool(predict_disease, image, image_data)
         
         # Add timestamp
         result["timestamp"] = datetime.now().isoformat()
@@ -402,46 +424,56 @@ async def predict_disease_endpoint(
         
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Prediction error: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
 @app.post("/batch_predict")
-async def batch_predict(files: List[UploadFile] = File(...)):
-    """Predict diseases for multiple images"""
-    if len(files) > 10:
-        raise HTTPException(status_code=400, detail="Maximum 10 files allowed")
+async def batch_predict(request: Request, files: List[UploadFile] = File(...)):
+    """
+    Predict diseases for multiple images
     
-    results = []
-    for file in files:
-        try:
-            # Validate file type
-            if not file.content_type or not file.content_type.startswith('image/'):
-                results.append({"error": f"Invalid file type: {file.filename}"})
-                continue
-            
-            # Read and process image
-            image_data = await file.read()
-            image = Image.open(io.BytesIO(image_data))
-            
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Make prediction
-            result = predict_disease(image)
-            result["filename"] = file.filename
-            result["timestamp"] = datetime.now().isoformat()
-            results.append(result)
-            
-        except Exception as e:
-            results.append({
-                "filename": file.filename,
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            })
+    Uploads are decoded in parallel and predicted in stacked sub-batches. With
+    Accept: application/x-ndjson, one JSON line per image is streamed as each
+    sub-batch completes; otherwise the results are returned as one JSON list.
+    """
+    if len(files) > BATCH_PREDICT_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Maximum {BATCH_PREDICT_MAX_FILES} files allowed")
+    if engine is None:
+        raise HTTPException(status_code=503, detail="CNN model not loaded")
+    
+    async def results(files):
+        async for items in iter_batch_predictions(files, engine):
+            for item in items:
+                timestamp = datetime.now().isoformat()
+                if 'error' in item:
+                    yield {"filename": item['filename'], "error": item['error'], "timestamp": timestamp}
+                    continue
+                try:
+                    result = format_prediction(item['prediction'])
+                except Exception as e:
+                    yield {"filename": item['filename'], "error": str(e), "timestamp": timestamp}
+                    continue
+                result["filename"] = item['filename']
+                result["timestamp"] = timestamp
+                yield result
+    
+    if wants_ndjson(request):
+        # The stream reads the uploads after this handler has returned
+        uploads = detach_uploads(files)
+        
+        async def lines():
+            try:
+                async for result in results(uploads):
+                    yield ndjson_line(result)
+            finally:
+                close_uploads(uploads)
+        return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
     
-    return results
+    return [result async for result in results(files)]
 
 @app.get("/disease_info/{crop}/{disease}")
 async def get_disease_info_endpoint(crop: str, disease: str):
@@ -550,6 +582,7 @@ async def root():
             "predict": "/predict - POST with image file",
             "health": "/health - GET for health check",
             "classes": "/classes - GET all disease classes",
+            "metrics": "/metrics - GET inference batching metrics",
             "batch_predict": "/batch_predict - POST with multiple images",
             "history": "/history/{user_id} - GET user detection history",
             "user_stats": "/stats/user/{user_id} - GET user statistics",
@@ -0,0 +1,156 @@
+"""
+Batched multi-image prediction for crop disease detection APIs
+Decodes and preprocesses uploads in parallel on a thread pool, stacks them
+into sub-batches for one forward pass each and yields results as every
+sub-batch completes, so memory is bounded by the sub-batch size
+"""
+
+import io
+import os
+import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from .image_decode import read_upload_limited, decode_image, ImageTooLarge, InvalidImage
+
+# Defaults, overridable through the environment
+BATCH_PREDICT_MAX_FILES = int(os.getenv('BATCH_PREDICT_MAX_FILES', '256'))
+# Images per forward pass; only one sub-batch of bytes and tensors is held at a time
+BATCH_PREDICT_CHUNK_SIZE = int(os.getenv('BATCH_PREDICT_CHUNK_SIZE', '32'))
+BATCH_DECODE_WORKERS = int(os.getenv('BATCH_DECODE_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
+
+def get_decode_pool():
+    """Get or create the shared decode/preprocess thread pool"""
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            _decode_pool = ThreadPoolExecutor(max_workers=BATCH_DECODE_WORKERS, thread_name_prefix='batch-decode')
+        return _decode_pool
+
+def wants_ndjson(request):
+    """Whether the client asked for a streamed NDJSON response"""
+    return NDJSON_MEDIA_TYPE in request.headers.get('accept', '')
+
+def ndjson_line(item):
+    return json.dumps(item) + '\n'
+
+class DetachedUpload:
+    """
+    Upload whose spooled file outlives the request handler
+
+    FastAPI before 0.118 closes form files as soon as the handler returns,
+    before a StreamingResponse has read them. The spooled file is taken over
+    here and the UploadFile is left an empty buffer for FastAPI to close.
+    """
+
+    def __init__(self, upload):
+        self.filename = upload.filename
+        self.content_type = upload.content_type
+        self.file = upload.file
+        upload.file = io.BytesIO()
+
+    async def read(self, size=-1):
+        return await asyncio.get_running_loop().run_in_executor(None, self.file.read, size)
+
+    def close(self):
+        self.file.close()
+
+def detach_uploads(files):
+    """Detach uploads for a streamed response; close them with close_uploads"""
+    return [DetachedUpload(file) for file in files]
+
+def close_uploads(files):
+    for file in files:
+        try:
+            file.close()
+        except Exception:
+            pass
+
+def _prepare(engine, image_bytes, keep_image):
+    """Decode, preprocess and compute cache keys for one upload (decode pool)"""
+    image = decode_image(image_bytes)
+    cache_keys = engine.cache_keys(image_bytes, image) if hasattr(engine, 'cache_keys') else None
+    return engine.preprocess(image), cache_keys, image if keep_image else None
+
+async def iter_batch_predictions(files, engine, chunk_size=None, keep_images=False):
+    """
+    Predict a list of uploads in stacked sub-batches
+
+    Args:
+        files: List of UploadFile (DetachedUpload when the results are streamed)
+        engine: InferenceEngine, CascadeEngine or CachedEngine
+        chunk_size: Images per forward pass (env BATCH_PREDICT_CHUNK_SIZE)
+        keep_images: Also return the decoded PIL images and upload bytes (for
+            explanations); they are dropped with the sub-batch otherwise
+
+    Yields:
+        One list per sub-batch of item dicts, in upload order: filename plus
+        either prediction (and image/image_bytes with keep_images) or error
+    """
+    chunk_size = max(1, chunk_size or BATCH_PREDICT_CHUNK_SIZE)
+    loop = asyncio.get_running_loop()
+    pool = get_decode_pool()
+
+    for start in range(0, len(files), chunk_size):
+        items = []
+        for file in files[start:start + chunk_size]:
+            item = {'filename': file.filename}
+            items.append(item)
+            if not file.content_type or not file.content_type.startswith('image/'):
+                item['error'] = 'Invalid file type'
+                continue
+            try:
+                item['image_bytes'] = await read_upload_limited(file)
+            except ImageTooLarge as e:
+                item['error'] = str(e)
+            except Exception as e:
+                # One unreadable upload must not end the whole stream
+                item['error'] = f"Upload read failed: {e}"
+
+        # Decode and preprocess the sub-batch in parallel off the event loop
+        pending = [item for item in items if 'image_bytes' in item]
+        prepared = await asyncio.gather(
+            *[loop.run_in_executor(pool, _prepare, engine, item['image_bytes'], keep_images) for item in pending],
+            return_exceptions=True
+        )
+
+        ready, tensors, cache_keys = [], [], []
+        for item, result in zip(pending, prepared):
+            if isinstance(result, BaseException):
+                item['error'] = str(result) if isinstance(result, (InvalidImage, ImageTooLarge)) else f"Decode failed: {result}"
+                continue
+            tensor, keys, image = result
+            ready.append(item)
+            tensors.append(tensor)
+            cache_keys.append(keys)
+            if keep_images:
+                item['image'] = image
+
+        if ready:
+            input_batch = torch.stack(tensors)
+            del tensors
+            try:
+                if hasattr(engine, 'cache_keys'):
+                    predictions = await loop.run_in_executor(None, engine.predict_tensor_batch, input_batch, cache_keys)
+                else:
+                    predictions = await loop.run_in_executor(None, engine.predict_tensor_batch, input_batch)
+                for item, prediction in zip(ready, predictions):
+                    item['prediction'] = prediction
+            except Exception as e:
+                print(f"⚠️ Batch forward pass failed: {e}")
+                for item in ready:
+                    item['error'] = f"Prediction failed: {e}"
+            del input_batch
+
+        if not keep_images:
+            for item in items:
+                item.pop('image_bytes', None)
+        yield items
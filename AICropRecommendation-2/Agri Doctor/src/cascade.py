@@ -0,0 +1,356 @@
+"""
+Cascade inference for crop disease detection
+Answers with the distilled TinyDiseaseClassifier when it is confident and
+escalates to the ResNet50 otherwise; calibrates the confidence threshold
+"""
+
+import os
+import json
+import time
+import threading
+from datetime import datetime
+
+import torch
+
+# Allowed accuracy drop versus the teacher when calibrating the threshold
+DEFAULT_MAX_ACCURACY_DROP = 0.01
+
+# Serve the cascade in the ResNet50 app (needs a distilled, calibrated tiny model)
+DISEASE_CASCADE = os.getenv('DISEASE_CASCADE', 'false').lower() in ('1', 'true', 'yes')
+
+def cascade_config_path(tiny_checkpoint_path):
+    """Calibration file saved next to the tiny checkpoint"""
+    stem, _ = os.path.splitext(tiny_checkpoint_path)
+    return f"{stem}_cascade.json"
+
+def load_cascade_calibration(tiny_checkpoint_path):
+    """Calibration report saved for a tiny checkpoint, or None if not calibrated"""
+    path = cascade_config_path(tiny_checkpoint_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def load_cascade_threshold(tiny_checkpoint_path, default=None):
+    """Calibrated threshold for a tiny checkpoint, or default if not calibrated"""
+    calibration = load_cascade_calibration(tiny_checkpoint_path)
+    return default if calibration is None else calibration.get('threshold', default)
+
+def cascade_unusable_reason(calibration):
+    """
+    Why a calibration should not be served, or None if it is usable
+
+    A threshold above 1 means no tiny confidence met the accuracy target, so
+    every request would escalate and pay for both models.
+    """
+    threshold = calibration.get('threshold')
+    if threshold is None:
+        return "calibration has no threshold"
+    if threshold > 1:
+        return (f"no tiny-model threshold meets the accuracy target "
+                f"(max drop {calibration.get('max_accuracy_drop')}), every request would escalate")
+    saving = calibration.get('latency_saving')
+    if saving is not None and saving <= 0:
+        return f"calibrated cascade is not faster than the ResNet50 alone (saving {saving:.1%})"
+    return None
+
+class CascadeEngine:
+    """Two-stage engine with the InferenceEngine interface"""
+
+    def __init__(self, tiny_engine, full_engine, threshold):
+        """
+        Args:
+            tiny_engine: InferenceEngine around the distilled tiny model
+            full_engine: InferenceEngine around the ResNet50
+            threshold: Tiny-model confidence at or above which no escalation happens
+        """
+        self.tiny_engine = tiny_engine
+        self.full_engine = full_engine
+        self.threshold = threshold
+
+        # Both models take the same normalised 224px input
+        self.preprocess = full_engine.preprocess
+        self.class_names = full_engine.class_names
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._escalations = 0
+        self._tiny_ms_total = 0.0
+        self._full_ms_total = 0.0
+
+    def start(self):
+        self.tiny_engine.start()
+        self.full_engine.start()
+        return self
+
+    def stop(self):
+        self.tiny_engine.stop()
+        self.full_engine.stop()
+
+    def _record(self, escalated, tiny_ms, full_ms=0.0):
+        with self._lock:
+            self._requests += 1
+            self._escalations += int(escalated)
+            self._tiny_ms_total += tiny_ms
+            self._full_ms_total += full_ms
+
+    def _answer(self, prediction, stage, tiny_confidence):
+        prediction['model'] = stage
+        prediction['tiny_confidence'] = tiny_confidence
+        return prediction
+
+    def predict_tensor(self, input_tensor):
+        """Blocking cascade prediction for a preprocessed (C, H, W) tensor"""
+        start = time.perf_counter()
+        tiny = self.tiny_engine.predict_tensor(input_tensor)
+        tiny_ms = (time.perf_counter() - start) * 1000
+
+        if tiny['confidence'] >= self.threshold:
+            self._record(False, tiny_ms)
+            return self._answer(tiny, 'tiny', tiny['confidence'])
+
+        start = time.perf_counter()
+        full = self.full_engine.predict_tensor(input_tensor)
+        self._record(True, tiny_ms, (time.perf_counter() - start) * 1000)
+        return self._answer(full, 'resnet50', tiny['confidence'])
+
+    async def predict_tensor_async(self, input_tensor):
+        """Awaitable cascade prediction for a preprocessed (C, H, W) tensor"""
+        start = time.perf_counter()
+        tiny = await self.tiny_engine.predict_tensor_async(input_tensor)
+        tiny_ms = (time.perf_counter() - start) * 1000
+
+        if tiny['confidence'] >= self.threshold:
+            self._record(False, tiny_ms)
+            return self._answer(tiny, 'tiny', tiny['confidence'])
+
+        start = time.perf_counter()
+        full = await self.full_engine.predict_tensor_async(input_tensor)
+        self._record(True, tiny_ms, (time.perf_counter() - start) * 1000)
+        return self._answer(full, 'resnet50', tiny['confidence'])
+
+    def predict_tensor_batch(self, input_batch):
+        """
+        Blocking cascade predictions for a stacked (N, C, H, W) batch: one tiny
+        pass over all images, one ResNet50 pass over the unconfident ones
+        """
+        start = time.perf_counter()
+        tiny = self.tiny_engine.predict_tensor_batch(input_batch)
+        tiny_ms = (time.perf_counter() - start) * 1000 / len(tiny)
+
+        escalate = [i for i, p in enumerate(tiny) if p['confidence'] < self.threshold]
+        predictions = [self._answer(p, 'tiny', p['confidence']) for p in tiny]
+        full_ms = 0.0
+        if escalate:
+            start = time.perf_counter()
+            full = self.full_engine.predict_tensor_batch(input_batch[escalate])
+            full_ms = (time.perf_counter() - start) * 1000 / len(escalate)
+            for i, prediction in zip(escalate, full):
+                predictions[i] = self._answer(prediction, 'resnet50', tiny[i]['confidence'])
+
+        escalated = set(escalate)
+        for i in range(len(tiny)):
+            self._record(i in escalated, tiny_ms, full_ms if i in escalated else 0.0)
+        return predictions
+
+    def predict(self, image):
+        return self.predict_tensor(self.preprocess(image))
+
+    async def predict_async(self, image):
+        return await self.predict_tensor_async(self.preprocess(image))
+
+    def class_probabilities(self, prediction):
+        return self.full_engine.class_probabilities(prediction)
+
+    def metrics(self):
+        """
+        Cascade metrics plus the batching metrics of both stages
+
+        Returns:
+            Dictionary with escalation rate and average per-stage latency
+        """
+        with self._lock:
+            requests = max(self._requests, 1)
+            escalations = max(self._escalations, 1)
+            cascade = {
+                'threshold': self.threshold,
+                'requests': self._requests,
+                'escalations': self._escalations,
+                'escalation_rate': round(self._escalations / requests, 4),
+                'avg_tiny_ms': round(self._tiny_ms_total / requests, 3),
+                'avg_full_ms_when_escalated': round(self._full_ms_total / escalations, 3),
+                'avg_total_ms': round((self._tiny_ms_total + self._full_ms_total) / requests, 3)
+            }
+        return {
+            'cascade': cascade,
+            'tiny': self.tiny_engine.metrics(),
+            'resnet50': self.full_engine.metrics()
+        }
+
+def build_cascade_engine(full_engine, tiny_checkpoint_path, device='cpu'):
+    """
+    Wrap a ResNet50 engine in a cascade with the distilled tiny model
+
+    Args:
+        full_engine: InferenceEngine around the ResNet50 (not yet started)
+        tiny_checkpoint_path: Distilled tiny checkpoint (see distill.py)
+        device: Device the app runs on
+
+    Returns:
+        CascadeEngine, or None if the tiny model is missing, uncalibrated,
+        calibrated without a latency saving or trained on different classes
+    """
+    from .inference_engine import InferenceEngine
+    from .model_loader import load_tiny_model
+    from .serving_prep import prepare_for_serving
+
+    if not os.path.exists(tiny_checkpoint_path):
+        print(f"⚠️ Cascade disabled: tiny model not found at {tiny_checkpoint_path}")
+        return None
+
+    calibration = load_cascade_calibration(tiny_checkpoint_path)
+    if calibration is None:
+        print(f"⚠️ Cascade disabled: no calibration at {cascade_config_path(tiny_checkpoint_path)}")
+        return None
+    reason = cascade_unusable_reason(calibration)
+    if reason is not None:
+        print(f"⚠️ Cascade disabled: {reason}")
+        return None
+    threshold = calibration['threshold']
+
+    tiny_model, tiny_classes = load_tiny_model(tiny_checkpoint_path, len(full_engine.class_names))
+    if tiny_classes and list(tiny_classes) != full_engine.class_names:
+        print("⚠️ Cascade disabled: tiny model classes differ from the ResNet50 classes")
+        return None
+
+    tiny_engine = InferenceEngine(prepare_for_serving(tiny_model, device=device), full_engine.class_names,
+                                  device=device, preprocess=full_engine.preprocess)
+    print(f"✅ Cascade enabled (tiny confidence threshold {threshold:.4f})")
+    return CascadeEngine(tiny_engine, full_engine, threshold)
+
+def collect_outputs(model, data_loader, device='cpu'):
+    """
+    Run a model over a loader
+
+    Returns:
+        Tuple of (confidences, predictions, labels, seconds per image)
+    """
+    model.eval()
+    confidences, predictions, labels = [], [], []
+    images_seen = 0
+    start = time.perf_counter()
+
+    with torch.inference_mode():
+        for inputs, targets in data_loader:
+            probabilities = torch.softmax(model(inputs.to(device)).float(), dim=1).cpu()
+            confidence, predicted = probabilities.max(dim=1)
+            confidences.append(confidence)
+            predictions.append(predicted)
+            labels.append(targets)
+            images_seen += len(targets)
+
+    seconds_per_image = (time.perf_counter() - start) / max(images_seen, 1)
+    return torch.cat(confidences), torch.cat(predictions), torch.cat(labels), seconds_per_image
+
+def calibrate_threshold(tiny_outputs, full_outputs, max_accuracy_drop=DEFAULT_MAX_ACCURACY_DROP):
+    """
+    Lowest tiny-model confidence threshold whose cascade accuracy stays within
+    max_accuracy_drop of the ResNet50 alone (lowest threshold = fewest escalations)
+
+    Args:
+        tiny_outputs: collect_outputs result for the tiny model
+        full_outputs: collect_outputs result for the ResNet50
+        max_accuracy_drop: Allowed accuracy drop versus the ResNet50
+
+    Returns:
+        Calibration report dictionary
+    """
+    tiny_conf, tiny_pred, labels, tiny_s = tiny_outputs
+    _, full_pred, _, full_s = full_outputs
+
+    full_accuracy = float((full_pred == labels).float().mean())
+    tiny_accuracy = float((tiny_pred == labels).float().mean())
+
+    def evaluate(threshold):
+        accept = tiny_conf >= threshold
+        cascade_pred = torch.where(accept, tiny_pred, full_pred)
+        escalation_rate = 1.0 - float(accept.float().mean())
+        return float((cascade_pred == labels).float().mean()), escalation_rate
+
+    # Candidate thresholds: every observed tiny confidence, plus "always escalate"
+    candidates = sorted(set(round(float(c), 4) for c in tiny_conf)) + [1.01]
+    threshold = 1.01
+    for candidate in candidates:
+        accuracy, _ = evaluate(candidate)
+        if accuracy >= full_accuracy - max_accuracy_drop:
+            threshold = candidate
+            break
+
+    cascade_accuracy, escalation_rate = evaluate(threshold)
+    cascade_ms = (tiny_s + escalation_rate * full_s) * 1000
+
+    return {
+        'threshold': threshold,
+        'max_accuracy_drop': max_accuracy_drop,
+        'samples': int(len(labels)),
+        'escalation_rate': round(escalation_rate, 4),
+        'accuracy': {
+            'tiny': round(tiny_accuracy, 4),
+            'resnet50': round(full_accuracy, 4),
+            'cascade': round(cascade_accuracy, 4)
+        },
+        'latency_ms_per_image': {
+            'tiny': round(tiny_s * 1000, 3),
+            'resnet50': round(full_s * 1000, 3),
+            'cascade_expected': round(cascade_ms, 3)
+        },
+        'latency_saving': round(1 - cascade_ms / (full_s * 1000), 4) if full_s > 0 else None,
+        'timestamp': datetime.now().isoformat()
+    }
+
+def main():
+    import argparse
+
+    from .dataset import CropDiseaseDataset, get_inference_transforms
+    from .model_loader import load_tiny_model
+    from .distill import load_teacher
+    from torch.utils.data import DataLoader
+
+    parser = argparse.ArgumentParser(description='Calibrate the tiny -> ResNet50 cascade threshold')
+    parser.add_argument('--tiny', default='models/crop_disease_tiny.pth', help='Distilled tiny checkpoint')
+    parser.add_argument('--teacher', default='models/crop_disease_v3_model.pth', help='ResNet50 checkpoint')
+    parser.add_argument('--data-dir', default='data/val', help='Labelled validation image folder')
+    parser.add_argument('--max-accuracy-drop', type=float, default=DEFAULT_MAX_ACCURACY_DROP)
+    parser.add_argument('--batch-size', type=int, default=1, help='Batch size (1 matches single-request latency)')
+
+    args = parser.parse_args()
+
+    tiny, class_names = load_tiny_model(args.tiny)
+    dataset = CropDiseaseDataset(args.data_dir, transform=get_inference_transforms(224))
+    if class_names and dataset.classes != list(class_names):
+        print("⚠️ Validation folder classes differ from the tiny checkpoint's class names")
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=0)
+
+    teacher = load_teacher(args.teacher, tiny.num_classes)
+
+    report = calibrate_threshold(collect_outputs(tiny, loader), collect_outputs(teacher, loader),
+                                 args.max_accuracy_drop)
+
+    print(f"Threshold: {report['threshold']:.4f}")
+    print(f"Escalation rate: {report['escalation_rate']:.1%}")
+    print(f"Accuracy - tiny: {report['accuracy']['tiny']:.4f}, resnet50: {report['accuracy']['resnet50']:.4f}, "
+          f"cascade: {report['accuracy']['cascade']:.4f}")
+    print(f"Latency per image - resnet50: {report['latency_ms_per_image']['resnet50']:.2f}ms, "
+          f"cascade: {report['latency_ms_per_image']['cascade_expected']:.2f}ms "
+          f"({report['latency_saving']:.1%} saved)")
+    reason = cascade_unusable_reason(report)
+    if reason is not None:
+        print(f"⚠️ The cascade will not be served: {reason}")
+
+    path = cascade_config_path(args.tiny)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Cascade calibration saved: {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Pooled-head variant of the legacy PlantVillage CNN
+Transfers the conv weights of the dense CNN checkpoint into CNNPooled,
+fine-tunes it with Trainer and compares memory, load time, latency and
+accuracy against the original
+"""
+
+import os
+import sys
+import json
+import time
+from datetime import datetime
+
+import psutil
+import torch
+from torch.utils.data import DataLoader
+from torchvision import transforms
+from torchvision.transforms import InterpolationMode
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import CNN
+
+from .dataset import CropDiseaseDataset
+
+DEFAULT_DENSE_CHECKPOINT = 'models/plant_disease_model_1_latest.pt'
+
+def pooled_model_path(dense_checkpoint_path):
+    """Pooled checkpoint saved next to the dense CNN checkpoint"""
+    stem, ext = os.path.splitext(dense_checkpoint_path)
+    return f"{stem}_pooled{ext or '.pt'}"
+
+def load_cnn_state_dict(checkpoint_path):
+    """State dict from a plain CNN checkpoint or a Trainer checkpoint"""
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
+        return checkpoint['model_state_dict']
+    return checkpoint
+
+def transfer_conv_weights(dense_state_dict, pooled_model):
+    """
+    Copy the conv stack of a dense CNN state dict into a CNNPooled model
+
+    Returns:
+        Number of tensors copied
+    """
+    conv_state = {k: v for k, v in dense_state_dict.items() if k.startswith('conv_layers.')}
+    pooled_model.load_state_dict(conv_state, strict=False)
+    return len(conv_state)
+
+def get_cnn_transforms(split='train', input_size=224):
+    """
+    CNN preprocessing: un-normalised [0, 1] tensors, bicubic resize as in main.py
+
+    Args:
+        split: 'train' adds light augmentation; anything else is the serving transform
+        input_size: Square model input size
+    """
+    resize = transforms.Resize((input_size, input_size), interpolation=InterpolationMode.BICUBIC)
+    if split == 'train':
+        return transforms.Compose([
+            resize,
+            transforms.RandomHorizontalFlip(p=0.5),
+            transforms.RandomVerticalFlip(p=0.3),
+            transforms.RandomRotation(degrees=15),
+            transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2),
+            transforms.ToTensor()
+        ])
+    return transforms.Compose([resize, transforms.ToTensor()])
+
+def create_cnn_loaders(data_dir, batch_size=32, num_workers=0):
+    """
+    Train/val loaders labelled with the CNN's own class indices
+
+    Args:
+        data_dir: Dataset root with train/ and val/ folders named like CNN.idx_to_classes
+
+    Returns:
+        Tuple of (train_loader, val_loader, class_names)
+    """
+    class_names = [CNN.idx_to_classes[i] for i in range(len(CNN.idx_to_classes))]
+    class_to_idx = {name: idx for idx, name in enumerate(class_names)}
+
+    for split in ('train', 'val'):
+        unknown = [d.name for d in os.scandir(os.path.join(data_dir, split))
+                   if d.is_dir() and not d.name.startswith('.') and d.name not in class_to_idx]
+        if unknown:
+            raise ValueError(f"{split} folders not in CNN.idx_to_classes: {unknown}")
+
+    train_dataset = CropDiseaseDataset(os.path.join(data_dir, 'train'), get_cnn_transforms('train'), class_to_idx)
+    val_dataset = CropDiseaseDataset(os.path.join(data_dir, 'val'), get_cnn_transforms('val'), class_to_idx)
+
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+    val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    return train_loader, val_loader, class_names
+
+def profile_model(model_class, checkpoint_path, eval_loader=None, num_classes=39):
+    """
+    Load cost, size, latency and accuracy of one CNN variant
+
+    Returns:
+        Dictionary with load time, RSS growth, parameter count, size,
+        batch-1 CPU latency and (with eval_loader) top-1 accuracy
+    """
+    from .quantize import collect_predictions, measure_latency
+
+    process = psutil.Process(os.getpid())
+    rss_before = process.memory_info().rss
+
+    start = time.perf_counter()
+    model = model_class(num_classes)
+    model.load_state_dict(load_cnn_state_dict(checkpoint_path))
+    model.eval()
+    load_s = time.perf_counter() - start
+
+    result = {
+        'checkpoint': checkpoint_path,
+        'file_size_mb': round(os.path.getsize(checkpoint_path) / 1024 / 1024, 2),
+        'parameters': sum(p.numel() for p in model.parameters()),
+        'load_time_s': round(load_s, 3),
+        'rss_growth_mb': round((process.memory_info().rss - rss_before) / 1024 / 1024, 1),
+        'latency_ms_batch1': round(measure_latency(model, batch_size=1), 2)
+    }
+    if eval_loader is not None:
+        predictions, labels = collect_predictions(model, eval_loader)
+        result['accuracy'] = round(float((predictions == labels).float().mean()), 4)
+
+    del model
+    return result
+
+def main():
+    import argparse
+
+    from .train import Trainer
+
+    parser = argparse.ArgumentParser(description='Fine-tune the pooled-head CNN from the dense CNN checkpoint')
+    parser.add_argument('--dense', default=DEFAULT_DENSE_CHECKPOINT, help='Dense CNN checkpoint')
+    parser.add_argument('--output', default=None, help='Pooled checkpoint (default: <dense>_pooled.pt)')
+    parser.add_argument('--data-dir', default='data', help='Dataset root with train/val in PlantVillage layout')
+    parser.add_argument('--epochs', type=int, default=15)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--learning-rate', type=float, default=5e-4)
+    parser.add_argument('--report', default='outputs/cnn_pooled_report.json', help='Comparison report file')
+
+    args = parser.parse_args()
+    output_path = args.output or pooled_model_path(args.dense)
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    print(f"Using device: {device}")
+
+    train_loader, val_loader, class_names = create_cnn_loaders(
+        args.data_dir, args.batch_size, num_workers=0 if device.type == 'cpu' else 2
+    )
+
+    model = CNN.CNNPooled(len(class_names))
+    copied = transfer_conv_weights(load_cnn_state_dict(args.dense), model)
+    print(f"✅ Transferred {copied} conv tensors from {args.dense}")
+    model.to(device)
+
+    # Trainer builds its optimizer from the trainable parameters up front, so
+    # the transferred conv layers are fine-tuned together with the new head
+    trainer = Trainer(model, train_loader, val_loader, class_names, device)
+    trainer.train(
+        num_epochs=args.epochs,
+        learning_rate=args.learning_rate,
+        use_class_weights=False,
+        checkpoint_path=output_path,
+        fine_tune_epoch=args.epochs + 1
+    )
+
+    checkpoint = torch.load(output_path, map_location='cpu')
+    checkpoint['class_names'] = class_names
+    torch.save(checkpoint, output_path)
+    trainer.plot_training_curves(save_path='outputs/cnn_pooled_curves.png')
+
+    report = {
+        # Pooled first, so its RSS growth does not reuse memory freed by the dense model
+        'pooled': profile_model(CNN.CNNPooled, output_path, val_loader, len(class_names)),
+        'dense': profile_model(CNN.CNN, args.dense, val_loader, len(class_names)),
+        'timestamp': datetime.now().isoformat()
+    }
+
+    for name in ('dense', 'pooled'):
+        r = report[name]
+        print(f"{name:>6}: {r['parameters']:,} params, {r['file_size_mb']:.1f} MB file, "
+              f"load {r['load_time_s']:.2f}s (+{r['rss_growth_mb']:.0f} MB RSS), "
+              f"{r['latency_ms_batch1']:.2f}ms/image, accuracy {r['accuracy']:.4f}")
+
+    os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nPooled CNN saved at: {output_path}")
+    print(f"Comparison report saved: {args.report}")
+    print("Serve it from main.py with CNN_HEAD=pooled")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Knowledge distillation for crop disease detection
+Trains TinyDiseaseClassifier on the soft labels of the ResNet50 teacher
+"""
+
+import torch
+import torch.nn.functional as F
+
+from .dataset import create_data_loaders
+from .model import CropDiseaseResNet50
+from .model_lite import TinyDiseaseClassifier
+from .train import Trainer
+
+class DistillationTrainer(Trainer):
+    """Trainer that mixes the teacher's softened outputs into the student loss"""
+
+    def __init__(self, model, teacher, train_loader, val_loader, class_names, device='cpu',
+                 temperature=4.0, alpha=0.7):
+        """
+        Args:
+            model: Student model (TinyDiseaseClassifier)
+            teacher: Trained teacher model (CropDiseaseResNet50), kept frozen
+            train_loader: Training data loader
+            val_loader: Validation data loader
+            class_names: Class names shared by teacher and student
+            device: Device to train on
+            temperature: Softmax temperature for the soft labels
+            alpha: Weight of the distillation term (1 - alpha for the hard-label loss)
+        """
+        super(DistillationTrainer, self).__init__(model, train_loader, val_loader, class_names, device)
+        self.teacher = teacher.to(device).eval()
+        for param in self.teacher.parameters():
+            param.requires_grad = False
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def distillation_loss(self, student_logits, teacher_logits, labels, criterion):
+        """Hinton-style loss: T^2-scaled KL on softened outputs plus hard-label loss"""
+        T = self.temperature
+        soft_loss = F.kl_div(
+            F.log_softmax(student_logits / T, dim=1),
+            F.softmax(teacher_logits / T, dim=1),
+            reduction='batchmean'
+        ) * (T * T)
+        hard_loss = criterion(student_logits, labels)
+        return self.alpha * soft_loss + (1 - self.alpha) * hard_loss
+
+    def train_epoch(self, criterion, optimizer):
+        """Train the student for one epoch against teacher soft labels"""
+        self.model.train()
+        running_loss = 0.0
+        running_corrects = 0
+        total_samples = 0
+
+        for inputs, labels in self.train_loader:
+            inputs = inputs.to(self.device)
+            labels = labels.to(self.device)
+
+            with torch.no_grad():
+                teacher_logits = self.teacher(inputs)
+
+            optimizer.zero_grad()
+
+            outputs = self.model(inputs)
+            _, preds = torch.max(outputs, 1)
+            loss = self.distillation_loss(outputs, teacher_logits, labels, criterion)
+
+            loss.backward()
+            optimizer.step()
+
+            running_loss += loss.item() * inputs.size(0)
+            running_corrects += torch.sum(preds == labels.data)
+            total_samples += inputs.size(0)
+
+        epoch_loss = running_loss / total_samples
+        epoch_acc = running_corrects.double() / total_samples
+
+        return epoch_loss, epoch_acc.item()
+
+def load_teacher(checkpoint_path, num_classes, device='cpu'):
+    """Load the trained ResNet50 teacher from a checkpoint"""
+    teacher = CropDiseaseResNet50(num_classes=num_classes, pretrained=False)
+    checkpoint = torch.load(checkpoint_path, map_location=device)
+    state_dict = checkpoint['model_state_dict'] if 'model_state_dict' in checkpoint else checkpoint
+    teacher.load_state_dict(state_dict)
+    return teacher.to(device).eval()
+
+def main():
+    """Distil the tiny model from the ResNet50 teacher"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Distil TinyDiseaseClassifier from the ResNet50 teacher')
+    parser.add_argument('--teacher', default='models/crop_disease_v3_model.pth', help='Teacher checkpoint')
+    parser.add_argument('--data-dir', default='data', help='Dataset root with train/val/test')
+    parser.add_argument('--output', default='models/crop_disease_tiny.pth', help='Student checkpoint')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--learning-rate', type=float, default=1e-3)
+    parser.add_argument('--temperature', type=float, default=4.0)
+    parser.add_argument('--alpha', type=float, default=0.7)
+
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    print(f"Using device: {device}")
+
+    train_loader, val_loader, _, class_names = create_data_loaders(
+        data_dir=args.data_dir,
+        batch_size=args.batch_size,
+        num_workers=0 if device.type == 'cpu' else 2
+    )
+    print(f"Dataset loaded: {len(class_names)} classes")
+
+    teacher = load_teacher(args.teacher, len(class_names), device)
+    student = TinyDiseaseClassifier(len(class_names)).to(device)
+    print(f"Student size: {student.get_model_size():.2f} MB")
+
+    trainer = DistillationTrainer(
+        student, teacher, train_loader, val_loader, class_names, device,
+        temperature=args.temperature, alpha=args.alpha
+    )
+
+    # The student is trained from scratch: no class weights file lookup and no
+    # frozen backbone to unfreeze
+    trainer.train(
+        num_epochs=args.epochs,
+        learning_rate=args.learning_rate,
+        use_class_weights=False,
+        checkpoint_path=args.output,
+        fine_tune_epoch=args.epochs + 1
+    )
+
+    # Store the class names with the best checkpoint so serving can read them
+    checkpoint = torch.load(args.output, map_location='cpu')
+    checkpoint['class_names'] = class_names
+    checkpoint['distillation'] = {
+        'teacher': args.teacher,
+        'temperature': args.temperature,
+        'alpha': args.alpha
+    }
+    torch.save(checkpoint, args.output)
+
+    trainer.plot_training_curves(save_path='outputs/distillation_curves.png')
+
+    print(f"\nDistilled model saved at: {args.output}")
+    print(f"Calibrate the cascade with: python -m src.cascade --tiny {args.output} --teacher {args.teacher}")
+
+if __name__ == "__main__":
+    main()
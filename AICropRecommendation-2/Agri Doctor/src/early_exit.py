@@ -0,0 +1,208 @@
+"""
+Early-exit inference for the ResNet50 crop disease model
+Calibrates per-exit confidence thresholds on validation data and serves the
+model so confident images stop at layer2 or layer3
+"""
+
+import os
+import json
+import time
+from datetime import datetime
+
+import torch
+import torch.nn as nn
+
+from .model import EXIT_LAYERS
+
+# Allowed accuracy drop versus the final classifier when calibrating
+DEFAULT_ACCURACY_TOLERANCE = 0.01
+
+# Serve early exits in the ResNet50 app when the checkpoint has exit heads
+DISEASE_EARLY_EXIT = os.getenv('DISEASE_EARLY_EXIT', 'false').lower() in ('1', 'true', 'yes')
+
+def exit_config_path(checkpoint_path):
+    """Calibrated thresholds file saved next to the checkpoint"""
+    stem, _ = os.path.splitext(checkpoint_path)
+    return f"{stem}_exits.json"
+
+def load_exit_thresholds(checkpoint_path):
+    """Calibrated thresholds for a checkpoint, or None if not calibrated"""
+    path = exit_config_path(checkpoint_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f).get('thresholds')
+
+def has_exit_heads(state_dict):
+    """Whether a state dict contains early-exit head weights"""
+    return any(key.startswith('exit_heads.') for key in state_dict)
+
+class EarlyExitModel(nn.Module):
+    """Serving wrapper: model(x) returns logits from the first confident exit"""
+
+    def __init__(self, model, thresholds=None):
+        """
+        Args:
+            model: CropDiseaseResNet50 with early-exit heads, in eval mode
+            thresholds: Dict mapping exit name to confidence threshold
+                (defaults to model.exit_thresholds)
+        """
+        super(EarlyExitModel, self).__init__()
+        self.model = model
+        self.thresholds = thresholds if thresholds is not None else model.exit_thresholds
+        self.exit_names = list(EXIT_LAYERS) + ['final']
+        self.exit_counts = [0] * len(self.exit_names)
+
+    def forward(self, x):
+        logits, exit_index = self.model.forward_early_exit(x, self.thresholds)
+        for i in exit_index.tolist():
+            self.exit_counts[i] += 1
+        return logits
+
+    def exit_stats(self):
+        """Share of images answered at each exit"""
+        total = max(sum(self.exit_counts), 1)
+        return {
+            name: {'count': count, 'rate': round(count / total, 4)}
+            for name, count in zip(self.exit_names, self.exit_counts)
+        }
+
+def collect_exit_outputs(model, data_loader, device='cpu'):
+    """
+    Confidences and predictions of every exit over a loader
+
+    Returns:
+        Tuple of (confidences [exits, N], predictions [exits, N], labels [N])
+    """
+    model.eval()
+    confidences, predictions, labels = [], [], []
+
+    with torch.inference_mode():
+        for inputs, targets in data_loader:
+            outputs = model.forward_exits(inputs.to(device))
+            probabilities = torch.stack([torch.softmax(o.float(), dim=1) for o in outputs]).cpu()
+            confidence, predicted = probabilities.max(dim=2)
+            confidences.append(confidence)
+            predictions.append(predicted)
+            labels.append(targets)
+
+    return torch.cat(confidences, dim=1), torch.cat(predictions, dim=1), torch.cat(labels)
+
+def _policy_accuracy(confidences, predictions, labels, thresholds):
+    """Accuracy and per-exit rates of the first-confident-exit policy"""
+    n = labels.shape[0]
+    final = len(EXIT_LAYERS)
+    chosen = torch.full((n,), final, dtype=torch.long)
+    undecided = torch.ones(n, dtype=torch.bool)
+
+    for i, name in enumerate(EXIT_LAYERS):
+        take = undecided & (confidences[i] >= thresholds.get(name, float('inf')))
+        chosen[take] = i
+        undecided &= ~take
+
+    policy_predictions = predictions[chosen, torch.arange(n)]
+    rates = [float((chosen == i).float().mean()) for i in range(final + 1)]
+    return float((policy_predictions == labels).float().mean()), rates
+
+def calibrate_exit_thresholds(confidences, predictions, labels, tolerance=DEFAULT_ACCURACY_TOLERANCE):
+    """
+    Per-exit thresholds, chosen greedily from the earliest exit
+
+    Each exit gets the lowest threshold (most images exiting) that keeps the
+    policy's accuracy within tolerance of the final classifier, with the
+    earlier exits' thresholds already fixed.
+
+    Returns:
+        Tuple of (thresholds dict, policy accuracy, final accuracy, exit rates)
+    """
+    final_accuracy = float((predictions[-1] == labels).float().mean())
+    thresholds = {}
+
+    for i, name in enumerate(EXIT_LAYERS):
+        candidates = sorted(set(round(float(c), 4) for c in confidences[i]))
+        chosen = float('inf')
+        for candidate in candidates:
+            accuracy, _ = _policy_accuracy(confidences, predictions, labels, {**thresholds, name: candidate})
+            if accuracy >= final_accuracy - tolerance:
+                chosen = candidate
+                break
+        thresholds[name] = chosen
+
+    accuracy, rates = _policy_accuracy(confidences, predictions, labels, thresholds)
+    return thresholds, accuracy, final_accuracy, rates
+
+def measure_average_latency(model_fn, data_loader, max_images=200):
+    """Average per-image CPU latency at batch size 1 (ms)"""
+    timings = []
+    with torch.inference_mode():
+        for inputs, _ in data_loader:
+            for image in inputs:
+                start = time.perf_counter()
+                model_fn(image.unsqueeze(0))
+                timings.append(time.perf_counter() - start)
+                if len(timings) >= max_images:
+                    return sum(timings) / len(timings) * 1000
+    return sum(timings) / max(len(timings), 1) * 1000
+
+def main():
+    import argparse
+
+    from torch.utils.data import DataLoader
+
+    from .dataset import CropDiseaseDataset, get_inference_transforms
+    from .model import CropDiseaseResNet50
+
+    parser = argparse.ArgumentParser(description='Calibrate early-exit thresholds for the ResNet50 model')
+    parser.add_argument('--checkpoint', required=True, help='Checkpoint trained with early_exits=True')
+    parser.add_argument('--data-dir', default='data/val', help='Labelled validation image folder')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_ACCURACY_TOLERANCE,
+                        help='Allowed accuracy drop versus the final classifier')
+    parser.add_argument('--latency-images', type=int, default=200, help='Images timed for the latency report')
+
+    args = parser.parse_args()
+
+    checkpoint = torch.load(args.checkpoint, map_location='cpu')
+    state_dict = checkpoint['model_state_dict'] if 'model_state_dict' in checkpoint else checkpoint
+    if not has_exit_heads(state_dict):
+        parser.error(f"{args.checkpoint} has no early-exit heads; train with early_exits=True first")
+
+    dataset = CropDiseaseDataset(args.data_dir, transform=get_inference_transforms(224))
+    num_classes = len(checkpoint.get('class_names', dataset.classes))
+    model = CropDiseaseResNet50(num_classes=num_classes, pretrained=False, early_exits=True)
+    model.load_state_dict(state_dict)
+    model.eval()
+
+    loader = DataLoader(dataset, batch_size=32, shuffle=False, num_workers=0)
+    thresholds, accuracy, final_accuracy, rates = calibrate_exit_thresholds(
+        *collect_exit_outputs(model, loader), tolerance=args.tolerance
+    )
+
+    single_loader = DataLoader(dataset, batch_size=1, shuffle=False, num_workers=0)
+    baseline_ms = measure_average_latency(model, single_loader, args.latency_images)
+    early_exit_ms = measure_average_latency(EarlyExitModel(model, thresholds), single_loader, args.latency_images)
+
+    report = {
+        'checkpoint': args.checkpoint,
+        'thresholds': {name: (t if t != float('inf') else None) for name, t in thresholds.items()},
+        'tolerance': args.tolerance,
+        'samples': len(dataset),
+        'accuracy': {'final_only': round(final_accuracy, 4), 'early_exit': round(accuracy, 4)},
+        'exit_rates': {name: round(rate, 4) for name, rate in zip(list(EXIT_LAYERS) + ['final'], rates)},
+        'latency_ms_per_image': {'final_only': round(baseline_ms, 3), 'early_exit': round(early_exit_ms, 3)},
+        'latency_saving': round(1 - early_exit_ms / baseline_ms, 4) if baseline_ms > 0 else None,
+        'timestamp': datetime.now().isoformat()
+    }
+
+    print(f"Thresholds: {report['thresholds']}")
+    print(f"Exit rates: {report['exit_rates']}")
+    print(f"Accuracy - final only: {final_accuracy:.4f}, early exit: {accuracy:.4f} "
+          f"(tolerance {args.tolerance})")
+    print(f"CPU latency per image - final only: {baseline_ms:.2f}ms, early exit: {early_exit_ms:.2f}ms")
+
+    path = exit_config_path(args.checkpoint)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Early-exit calibration saved: {path}")
+
+if __name__ == "__main__":
+    main()
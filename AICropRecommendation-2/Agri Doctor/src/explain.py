@@ -14,6 +14,8 @@ from pathlib import Path
 import base64
 import io
 import os
+import threading
+from torchvision import transforms
 
 try:
     from pytorch_grad_cam import GradCAM
@@ -34,6 +36,12 @@ except ImportError:
         PYTORCH_GRAD_CAM_AVAILABLE = False
         print("Warning: Could not import pytorch-grad-cam after installation")
 
+def _classifier_target(index):
+    """Per-sample Grad-CAM target: the logit of one class for one image"""
+    if PYTORCH_GRAD_CAM_AVAILABLE:
+        return ClassifierOutputTarget(index)
+    return lambda model_output: model_output[index]
+
 class CropDiseaseExplainer:
     """High-level interface for crop disease explanation using pytorch-grad-cam"""
     
@@ -50,6 +58,17 @@ class CropDiseaseExplainer:
         self.class_names = class_names
         self.device = device
         
+        # Preprocessing transforms (should match training transforms), built once
+        self.transform = transforms.Compose([
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], 
+                               std=[0.229, 0.224, 0.225])
+        ])
+        
+        # One in-memory Grad-CAM pass at a time (the activation hook is shared)
+        self._cam_lock = threading.Lock()
+        
         # Define target layer for Grad-CAM (last convolutional layer)
         target_layers = []
         
@@ -125,20 +144,11 @@ class CropDiseaseExplainer:
         original_image = Image.open(image_path).convert('RGB')
         original_np = np.array(original_image) / 255.0  # Normalize to [0,1]
         
-        # Preprocessing transforms (should match training transforms)
-        from torchvision import transforms
-        transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], 
-                               std=[0.229, 0.224, 0.225])
-        ])
-        
-        input_tensor = transform(original_image).unsqueeze(0).to(self.device)
+        input_tensor = self.transform(original_image).unsqueeze(0).to(self.device)
         
         # Get prediction
         self.model.eval()
-        with torch.no_grad():
+        with torch.inference_mode():
             outputs = self.model(input_tensor)
             probabilities = F.softmax(outputs, dim=1)
             predicted_idx = torch.argmax(probabilities, dim=1).item()
@@ -203,6 +213,164 @@ class CropDiseaseExplainer:
                 'cam_image': original_image
             }
     
+    def _gradcam_pass(self, input_batch, target_indices=None):
+        """
+        Classification and Grad-CAM from a single forward and backward pass
+        
+        A forward hook on the target layer keeps its activations from the same
+        forward pass that produces the logits; their gradients come from one
+        autograd.grad call on the sum of the per-sample ClassifierOutputTarget
+        scores. The weights are frozen for the pass, so autograd only records
+        (and backward only runs through) the layers after the target layer.
+        
+        Args:
+            input_batch: Preprocessed (N, C, H, W) tensor
+            target_indices: Class index per image; None (or None entries) use
+                the predicted class
+        
+        Returns:
+            Tuple of (logits [N, K], low-resolution CAMs [N, h, w] in [0, 1],
+            target indices)
+        """
+        if not getattr(self, 'target_layers', None):
+            raise RuntimeError("No Grad-CAM target layer available for this model")
+        
+        captured = {}
+        owner = threading.get_ident()
+        
+        def save_activation(module, inputs, output):
+            # The serving batcher may run the same model on another thread
+            if threading.get_ident() != owner:
+                return
+            if not output.requires_grad:
+                # Weights are frozen for the pass: the graph starts at this layer
+                output.requires_grad_(True)
+            captured['activation'] = output
+        
+        with self._cam_lock:
+            parameters = list(self.model.parameters())
+            grad_flags = [p.requires_grad for p in parameters]
+            handle = self.target_layers[-1].register_forward_hook(save_activation)
+            try:
+                for p in parameters:
+                    p.requires_grad_(False)
+                self.model.eval()
+                with torch.enable_grad():
+                    logits = self.model(input_batch.to(self.device))
+                    predicted = logits.argmax(dim=1).tolist()
+                    if target_indices is None:
+                        target_indices = predicted
+                    target_indices = [p if t is None else t for t, p in zip(target_indices, predicted)]
+                    targets = [_classifier_target(t) for t in target_indices]
+                    score = sum(target(logits[i]) for i, target in enumerate(targets))
+                    activation = captured['activation']
+                    gradients = torch.autograd.grad(score, activation)[0]
+            finally:
+                handle.remove()
+                for p, flag in zip(parameters, grad_flags):
+                    p.requires_grad_(flag)
+        
+        # Channel weights are the spatially averaged gradients (Grad-CAM)
+        weights = gradients.mean(dim=(2, 3), keepdim=True)
+        cams = F.relu((weights * activation).sum(dim=1)).detach()
+        
+        flat = cams.flatten(1)
+        low, high = flat.min(dim=1).values.view(-1, 1, 1), flat.max(dim=1).values.view(-1, 1, 1)
+        cams = (cams - low) / (high - low).clamp_min(1e-8)
+        
+        return logits.detach(), cams.cpu(), target_indices
+    
+    def _overlay(self, image, cam, size=224):
+        """Blend an upsampled CAM over the image resized to size x size"""
+        grayscale_cam = F.interpolate(cam[None, None], size=(size, size), mode='bilinear',
+                                      align_corners=False)[0, 0].numpy()
+        original_resized = np.asarray(image.convert('RGB').resize((size, size), Image.BILINEAR)) / 255.0
+        
+        if PYTORCH_GRAD_CAM_AVAILABLE:
+            cam_image = show_cam_on_image(original_resized.astype(np.float32), grayscale_cam, use_rgb=True)
+            return Image.fromarray(cam_image.astype(np.uint8)), grayscale_cam
+        
+        heatmap = cm.jet(grayscale_cam)[:, :, :3]
+        overlay = 0.7 * original_resized + 0.3 * heatmap
+        return Image.fromarray((overlay * 255).astype(np.uint8)), grayscale_cam
+    
+    def _prediction_dict(self, logits, top_k=3):
+        """Prediction in the InferenceEngine format for one row of logits"""
+        probabilities = F.softmax(logits.float(), dim=0)
+        top_probs, top_indices = torch.topk(probabilities, min(top_k, len(probabilities)))
+        index = int(top_indices[0])
+        return {
+            'index': index,
+            'class_name': self.class_names[index],
+            'confidence': float(top_probs[0]),
+            'top_k': [
+                {'index': int(i), 'class_name': self.class_names[int(i)], 'confidence': float(p)}
+                for p, i in zip(top_probs, top_indices)
+            ],
+            'probabilities': probabilities.tolist()
+        }
+    
+    def explain_images(self, images, target_classes=None, return_base64=False):
+        """
+        Predict and explain in-memory PIL images in one batched forward/backward pass
+        
+        No temporary files are written: the decoded images are preprocessed with
+        the cached transform and the heatmaps stay in memory.
+        
+        Args:
+            images: List of RGB PIL images
+            target_classes: Class index per image, None entries (or None for all)
+                use the predicted class
+            return_base64: Whether to add each overlay as base64 JPEG
+            
+        Returns:
+            List of explanation dictionaries with the prediction (InferenceEngine
+            format), the low-resolution and 224px CAMs and the overlay image
+        """
+        input_batch = torch.stack([self.transform(image.convert('RGB')) for image in images])
+        logits, cams, target_indices = self._gradcam_pass(input_batch, target_classes)
+        
+        results = []
+        for i, image in enumerate(images):
+            prediction = self._prediction_dict(logits[i])
+            cam_image, grayscale_cam = self._overlay(image, cams[i])
+            target_idx = target_indices[i]
+            
+            result = {
+                'prediction': prediction,
+                'predicted_class': prediction['class_name'],
+                'predicted_idx': prediction['index'],
+                'confidence': prediction['confidence'],
+                'target_class': self.class_names[target_idx],
+                'target_idx': target_idx,
+                'cam': cams[i].numpy(),
+                'grayscale_cam': grayscale_cam,
+                'cam_image': cam_image
+            }
+            
+            if return_base64:
+                buffer = io.BytesIO()
+                cam_image.save(buffer, format='JPEG')
+                result['overlay_base64'] = base64.b64encode(buffer.getvalue()).decode()
+            
+            results.append(result)
+        
+        return results
+    
+    def explain_image(self, image, target_class=None, return_base64=False):
+        """
+        Predict and explain one in-memory PIL image (see explain_images)
+        
+        Args:
+            image: RGB PIL image
+            target_class: Specific class to target (if None, uses predicted class)
+            return_base64: Whether to add the overlay as base64 JPEG
+            
+        Returns:
+            explanation: Dictionary with prediction and explanation
+        """
+        return self.explain_images([image], [target_class], return_base64)[0]
+    
     def _generate_pytorch_gradcam(self, input_tensor, original_image, target_idx):
         """Generate Grad-CAM using pytorch-grad-cam library"""
         targets = [ClassifierOutputTarget(target_idx)]
@@ -11,7 +11,6 @@ from PIL import Image
 import io
 import base64
 import os
-import gc
 
 class CropDiseaseExplainerLite:
     """Memory-optimized explainer for crop disease detection"""
@@ -40,6 +39,51 @@ class CropDiseaseExplainerLite:
         except ImportError:
             pass
     
+    def explain_lite(self, image_bytes, predicted_class, max_size=112, attention_size=28):
+        """
+        Lightweight explanation as raw outputs (no base64)
+        
+        Args:
+            image_bytes: Raw image bytes
+            predicted_class: Predicted disease class
+            max_size: Maximum image size for processing (smaller = less memory)
+            attention_size: Side of the returned low-resolution attention map
+        
+        Returns:
+            Dictionary with the overlay PIL image, the low-resolution float32
+            attention map in [0, 1] and the processing size
+        """
+        # Process image with aggressive memory optimization
+        image = Image.open(io.BytesIO(image_bytes))
+        
+        # Convert and resize aggressively to save memory
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        # Use very small size for explanation to save memory
+        image = image.resize((max_size, max_size), Image.Resampling.LANCZOS)
+        
+        # Convert to numpy for simple processing
+        img_array = np.array(image)
+        
+        # Generate simple attention map using basic image processing
+        attention_map = self._generate_simple_attention(img_array)
+        
+        # Create explanation visualization
+        explanation_image = self._create_explanation_visualization(
+            img_array, attention_map, predicted_class
+        )
+        
+        attention = cv2.resize(attention_map, (attention_size, attention_size), interpolation=cv2.INTER_AREA)
+        
+        del image, img_array, attention_map
+        
+        return {
+            "image": explanation_image,
+            "attention": attention.astype(np.float32),
+            "size": f"{max_size}x{max_size}"
+        }
+    
     def generate_explanation_lite(self, image_bytes, predicted_class, max_size=112):
         """
         Generate lightweight explanation with minimal memory usage
@@ -56,33 +100,12 @@ class CropDiseaseExplainerLite:
             return {"error": "Explanations disabled due to memory constraints"}
         
         try:
-            # Process image with aggressive memory optimization
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # Convert and resize aggressively to save memory
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Use very small size for explanation to save memory
-            image = image.resize((max_size, max_size), Image.Resampling.LANCZOS)
-            
-            # Convert to numpy for simple processing
-            img_array = np.array(image)
-            
-            # Generate simple attention map using basic image processing
-            attention_map = self._generate_simple_attention(img_array)
-            
-            # Create explanation visualization
-            explanation_image = self._create_explanation_visualization(
-                img_array, attention_map, predicted_class
-            )
+            explanation = self.explain_lite(image_bytes, predicted_class, max_size)
             
             # Convert to base64 with compression
-            explanation_base64 = self._image_to_base64(explanation_image, quality=60)
+            explanation_base64 = self._image_to_base64(explanation["image"], quality=60)
             
-            # Clear memory
-            del image, img_array, attention_map, explanation_image
-            gc.collect()
+            del explanation
             
             return {
                 "explanation_image": explanation_base64,
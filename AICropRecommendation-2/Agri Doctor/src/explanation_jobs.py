@@ -0,0 +1,473 @@
+"""
+Asynchronous explanation jobs for crop disease detection APIs
+/predict answers with the diagnosis and an explanation id; a worker pool
+computes heatmaps in batches from a SQLite-backed queue (so queued jobs
+survive a restart) and keeps results in a bounded TTL store for polling
+"""
+
+import os
+import json
+import time
+import uuid
+import queue
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+# Defaults, overridable through the environment
+EXPLANATION_JOBS_ENABLED = os.getenv('EXPLANATION_JOBS', 'true').lower() in ('1', 'true', 'yes')
+# Queue file; unset gives each app its own (outputs/explanation_jobs_<app>.db)
+EXPLANATION_JOBS_DB = os.getenv('EXPLANATION_JOBS_DB', '')
+EXPLANATION_WORKERS = int(os.getenv('EXPLANATION_WORKERS', '1'))
+# Jobs explained per Grad-CAM pass (a /batch_predict sub-batch is queued together)
+EXPLANATION_BATCH_SIZE = int(os.getenv('EXPLANATION_BATCH_SIZE', '10'))
+# Jobs waiting in the queue before /predict stops accepting explanations
+EXPLANATION_QUEUE_MAX = int(os.getenv('EXPLANATION_QUEUE_MAX', '256'))
+EXPLANATION_RESULT_TTL_S = float(os.getenv('EXPLANATION_RESULT_TTL_S', '600'))
+EXPLANATION_RESULT_MAX = int(os.getenv('EXPLANATION_RESULT_MAX', '256'))
+# Longest long-poll / event stream wait
+EXPLANATION_MAX_WAIT_S = float(os.getenv('EXPLANATION_MAX_WAIT_S', '30'))
+
+# Worker sleep between queue checks when nothing signalled new work
+IDLE_POLL_S = 1.0
+# Idle interval between checks for jobs left by a process that died
+ADOPT_INTERVAL_S = 30.0
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def default_jobs_db(app):
+    """Queue file for an app: env EXPLANATION_JOBS_DB, else one file per app"""
+    return EXPLANATION_JOBS_DB or f'outputs/explanation_jobs_{app}.db'
+
+class _JobTable:
+    """
+    SQLite table of queued and running jobs (image bytes plus parameters)
+
+    Rows carry the app that queued them and the PID of the submitting process.
+    Results are kept in that process's memory, so it is the only one that
+    claims them; another process of the same app adopts them once it is gone.
+    """
+
+    def __init__(self, path, app):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.app = app
+        self._lock = threading.Lock()
+        # Autocommit, so claims can open their own BEGIN IMMEDIATE transaction
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._transaction():
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, status TEXT NOT NULL, image BLOB NOT NULL, '
+                'params TEXT NOT NULL, owner INTEGER, created REAL NOT NULL)'
+            )
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')]
+            if 'app' not in columns:
+                # Queue files from before app scoping cannot tell whose jobs they hold
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN app TEXT')
+                self._conn.execute('DELETE FROM jobs')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (app, owner, status, created)')
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction that takes the database write lock up front"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def recover(self, startup=False):
+        """
+        Adopt this app's jobs whose submitting process is gone and requeue them
+
+        Args:
+            startup: Also adopt rows carrying this process's own PID, left by
+                an earlier run (a restarted container often reuses the PID)
+
+        Returns:
+            Number of jobs adopted
+        """
+        pid = os.getpid()
+        with self._transaction():
+            rows = self._conn.execute(
+                'SELECT id, owner FROM jobs WHERE app = ?', (self.app,)
+            ).fetchall()
+            dead = {}
+            for _, owner in rows:
+                if owner is not None and owner != pid and owner not in dead:
+                    dead[owner] = not _pid_alive(owner)
+            orphans = [job_id for job_id, owner in rows
+                       if owner is None or (owner == pid and startup) or dead.get(owner)]
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'queued', owner = ? WHERE id = ?",
+                [(pid, job_id) for job_id in orphans]
+            )
+        return len(orphans)
+
+    def insert(self, jobs):
+        """Queue (job_id, image_bytes, params) tuples owned by this process in one transaction"""
+        now = time.time()
+        pid = os.getpid()
+        with self._transaction():
+            self._conn.executemany(
+                "INSERT INTO jobs (id, status, image, params, owner, created, app) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                [(job_id, sqlite3.Binary(image_bytes), json.dumps(params), pid, now, self.app)
+                 for job_id, image_bytes, params in jobs]
+            )
+
+    def claim(self, limit):
+        """Mark up to limit of this process's queued jobs (oldest first) as running"""
+        with self._transaction():
+            rows = self._conn.execute(
+                "SELECT id, image, params FROM jobs WHERE app = ? AND owner = ? AND status = 'queued' "
+                "ORDER BY created LIMIT ?",
+                (self.app, os.getpid(), limit)
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'running' WHERE id = ?", [(row[0],) for row in rows]
+            )
+        return [{'id': row[0], 'image_bytes': bytes(row[1]), 'params': json.loads(row[2])} for row in rows]
+
+    def delete(self, job_ids):
+        with self._transaction():
+            self._conn.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in job_ids])
+
+    def status(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT status FROM jobs WHERE id = ? AND app = ?', (job_id, self.app)
+            ).fetchone()
+        return row[0] if row else None
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT status, COUNT(*) FROM jobs WHERE app = ? GROUP BY status', (self.app,)
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ExplanationJobQueue:
+    """
+    Background explanation queue with batched workers and a TTL result store
+
+    Jobs persist in SQLite, but results live in memory, so each process only
+    runs the jobs it accepted and polls must reach the process that answered
+    /predict (one server process per app, or sticky routing). Jobs of a
+    process that died are adopted by the next process of the same app.
+    """
+
+    def __init__(self, explain_batch, app, db_path=None, workers=None, batch_size=None,
+                 max_queued=None, ttl_s=None, max_results=None):
+        """
+        Args:
+            explain_batch: Callable taking a list of jobs ({'id', 'image_bytes',
+                'params'}) and returning one JSON-serialisable result dict per
+                job (a dict with 'error' marks that job as failed). Binary
+                outputs go under the result's 'artifacts' key (name -> encoded
+                dict, see response_encoding); they are kept out of the JSON
+                views and served through artifact()
+            app: Name of the serving app; jobs are scoped to it, so apps
+                sharing a queue file never run each other's jobs
+            db_path: SQLite queue file (default from default_jobs_db; ':memory:'
+                gives up restart recovery)
+            workers: Worker threads (env EXPLANATION_WORKERS)
+            batch_size: Jobs handed to explain_batch at once (env EXPLANATION_BATCH_SIZE)
+            max_queued: Queue length at which submit refuses (env EXPLANATION_QUEUE_MAX)
+            ttl_s: Seconds a finished result stays available (env EXPLANATION_RESULT_TTL_S)
+            max_results: Finished results kept at most (env EXPLANATION_RESULT_MAX)
+        """
+        self.explain_batch = explain_batch
+        self.workers = max(1, workers or EXPLANATION_WORKERS)
+        self.batch_size = max(1, batch_size or EXPLANATION_BATCH_SIZE)
+        self.max_queued = max_queued or EXPLANATION_QUEUE_MAX
+        self.ttl_s = EXPLANATION_RESULT_TTL_S if ttl_s is None else ttl_s
+        self.max_results = max_results or EXPLANATION_RESULT_MAX
+        self._table = _JobTable(db_path or default_jobs_db(app), app)
+        self._next_adopt = 0.0
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._signalled = False
+        # job id -> (expires_at, state, artifacts); insertion order is completion order
+        self._results = OrderedDict()
+        # job id -> Future resolved when the job finishes (only while someone waits)
+        self._waiters = {}
+        self._threads = []
+        self._running = False
+
+        self._counts = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'batches': 0,
+                        'recovered': 0, 'expired': 0}
+        self._explain_ms_total = 0.0
+
+    def start(self):
+        """Requeue jobs interrupted by a restart and start the workers"""
+        if self._running:
+            return self
+        with self._lock:
+            self._counts['recovered'] = self._table.recover(startup=True)
+            self._next_adopt = time.monotonic() + ADOPT_INTERVAL_S
+        self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'explanation-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"✅ Explanation jobs started ({self.workers} workers, batch size {self.batch_size}, "
+              f"queue {self._table.path}, {self._counts['recovered']} recovered)")
+        return self
+
+    def stop(self):
+        """Stop the workers; unfinished jobs stay queued in SQLite for the next start"""
+        with self._lock:
+            self._running = False
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=10)
+        self._threads = []
+        self._table.close()
+
+    def submit(self, image_bytes, **params):
+        """
+        Queue an explanation
+
+        Args:
+            image_bytes: Uploaded image bytes
+            params: JSON-serialisable parameters for explain_batch (target class, ...)
+
+        Returns:
+            Explanation id
+
+        Raises:
+            queue.Full: When max_queued jobs are already waiting
+        """
+        return self.submit_many([(image_bytes, params)])[0]
+
+    def submit_many(self, items):
+        """
+        Queue several explanations together, so a worker can claim them as one batch
+
+        Args:
+            items: List of (image_bytes, params dict) tuples
+
+        Returns:
+            List of explanation ids, in order
+
+        Raises:
+            queue.Full: When the items do not fit below max_queued
+        """
+        if self._table.counts().get('queued', 0) + len(items) > self.max_queued:
+            with self._lock:
+                self._counts['rejected'] += len(items)
+            raise queue.Full(f"Explanation queue is full ({self.max_queued} jobs)")
+
+        jobs = [(uuid.uuid4().hex, image_bytes, params) for image_bytes, params in items]
+        self._table.insert(jobs)
+        with self._lock:
+            self._counts['submitted'] += len(jobs)
+            self._signalled = True
+            self._wakeup.notify()
+        return [job[0] for job in jobs]
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                if not self._running:
+                    return
+                self._signalled = False
+            jobs = self._table.claim(self.batch_size)
+            if not jobs and self._adopt_due():
+                jobs = self._table.claim(self.batch_size)
+            if not jobs:
+                with self._lock:
+                    # A submit between the claim and here must not wait for the poll
+                    if self._running and not self._signalled:
+                        self._wakeup.wait(timeout=IDLE_POLL_S)
+                continue
+            self._run_batch(jobs)
+
+    def _adopt_due(self):
+        """Periodically adopt jobs of dead processes; True if any were adopted"""
+        with self._lock:
+            if time.monotonic() < self._next_adopt:
+                return False
+            self._next_adopt = time.monotonic() + ADOPT_INTERVAL_S
+        try:
+            adopted = self._table.recover()
+        except sqlite3.Error as e:
+            print(f"⚠️ Explanation job adoption failed: {e}")
+            return False
+        with self._lock:
+            self._counts['recovered'] += adopted
+        return adopted > 0
+
+    def _run_batch(self, jobs):
+        start = time.perf_counter()
+        try:
+            results = self.explain_batch(jobs)
+        except Exception as e:
+            print(f"⚠️ Explanation batch failed: {e}")
+            results = [{'error': f"Explanation generation failed: {e}"} for _ in jobs]
+        explain_ms = (time.perf_counter() - start) * 1000
+
+        # Store results before deleting the rows, so a poll never sees neither
+        for job, result in zip(jobs, results):
+            self._finish(job['id'], result)
+        self._table.delete([job['id'] for job in jobs])
+
+        with self._lock:
+            self._counts['batches'] += 1
+            self._explain_ms_total += explain_ms
+
+    def _finish(self, job_id, result):
+        status = 'error' if 'error' in result else 'done'
+        artifacts = result.pop('artifacts', None) or {}
+        entry = {'explanation_id': job_id, 'status': status, 'result': result}
+        with self._lock:
+            self._expire()
+            self._results[job_id] = (time.monotonic() + self.ttl_s, entry, artifacts)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+                self._counts['expired'] += 1
+            self._counts['completed' if status == 'done' else 'failed'] += 1
+            waiter = self._waiters.pop(job_id, None)
+        if waiter is not None:
+            waiter.set_result(entry)
+
+    def _expire(self):
+        """Drop expired results (caller holds the lock)"""
+        now = time.monotonic()
+        while self._results:
+            job_id, (expires_at, _, _) = next(iter(self._results.items()))
+            if expires_at > now:
+                break
+            del self._results[job_id]
+            self._counts['expired'] += 1
+
+    def get(self, job_id):
+        """
+        Current state of an explanation
+
+        Returns:
+            Dictionary with explanation_id, status ('queued', 'running', 'done'
+            or 'error') and, once finished, result; None if unknown or expired
+        """
+        with self._lock:
+            self._expire()
+            entry = self._results.get(job_id)
+        if entry is not None:
+            return entry[1]
+        status = self._table.status(job_id)
+        if status is None:
+            return None
+        return {'explanation_id': job_id, 'status': status}
+
+    def artifact(self, job_id, name):
+        """
+        Binary output of a finished explanation
+
+        Returns:
+            Tuple of (encoded artifact dict, seconds until it expires), or
+            None if the job is unknown, unfinished, expired or has no such output
+        """
+        with self._lock:
+            self._expire()
+            entry = self._results.get(job_id)
+        if entry is None or name not in entry[2]:
+            return None
+        return entry[2][name], entry[0] - time.monotonic()
+
+    async def wait(self, job_id, timeout):
+        """
+        Long-poll: state of an explanation once finished, or after timeout seconds
+
+        Returns:
+            Same as get
+        """
+        state = self.get(job_id)
+        if state is None or 'result' in state or timeout <= 0:
+            return state
+
+        with self._lock:
+            # Re-check under the lock: _finish pops the waiter in the same section
+            if job_id in self._results:
+                return self._results[job_id][1]
+            waiter = self._waiters.setdefault(job_id, Future())
+
+        # asyncio.wait does not cancel the shared future on timeout
+        done, _ = await asyncio.wait({asyncio.wrap_future(waiter)}, timeout=min(timeout, EXPLANATION_MAX_WAIT_S))
+        if done:
+            return done.pop().result()
+        return self.get(job_id)
+
+    async def events(self, job_id, timeout):
+        """
+        Server-sent events for an explanation: the current status, then the
+        finished result (or a final status after timeout seconds)
+        """
+        state = self.get(job_id)
+        yield f"event: status\ndata: {json.dumps({k: v for k, v in state.items() if k != 'result'})}\n\n"
+        if 'result' not in state:
+            state = await self.wait(job_id, timeout) or {'explanation_id': job_id, 'status': 'expired'}
+        event = 'result' if 'result' in state else 'status'
+        yield f"event: {event}\ndata: {json.dumps(state)}\n\n"
+
+    def metrics(self):
+        """
+        Queue metrics
+
+        Returns:
+            Dictionary with queue depth, result store size, job counts and
+            average batch time
+        """
+        table_counts = self._table.counts()
+        with self._lock:
+            self._expire()
+            batches = max(self._counts['batches'], 1)
+            return {
+                'queue_db': self._table.path,
+                'app': self._table.app,
+                'workers': self.workers,
+                'batch_size': self.batch_size,
+                'queued': table_counts.get('queued', 0),
+                'running': table_counts.get('running', 0),
+                'stored_results': len(self._results),
+                'result_ttl_s': self.ttl_s,
+                **self._counts,
+                'avg_batch_ms': round(self._explain_ms_total / batches, 1)
+            }
+
+def build_explanation_jobs(explain_batch, app):
+    """
+    Start an explanation queue, or return None when env EXPLANATION_JOBS is off
+
+    Args:
+        explain_batch: See ExplanationJobQueue
+        app: Name of the serving app ('resnet', 'lite', ...)
+    """
+    if not EXPLANATION_JOBS_ENABLED:
+        return None
+    try:
+        return ExplanationJobQueue(explain_batch, app).start()
+    except sqlite3.Error as e:
+        print(f"⚠️ Explanation jobs disabled ({default_jobs_db(app)}): {e}")
+        return None
@@ -0,0 +1,279 @@
+"""
+TorchScript and ONNX export for crop disease detection models
+Exports frozen, inference-optimized TorchScript and ONNX files next to the
+FP32 checkpoint and checks each runtime against eager PyTorch
+"""
+
+import os
+import json
+from datetime import datetime
+
+import torch
+
+from .quantize import MODEL_TYPES, load_fp32_model, create_image_loader, measure_latency
+
+BACKENDS = ('eager', 'torchscript', 'onnxruntime')
+
+ONNX_OPSET = 17
+
+# Parity tolerance on logits between eager PyTorch and an exported runtime
+PARITY_ATOL = 1e-3
+
+def backend_path(checkpoint_path, backend):
+    """
+    Path of an exported model saved alongside the FP32 checkpoint
+
+    Args:
+        checkpoint_path: FP32 checkpoint path
+        backend: 'torchscript' or 'onnxruntime'
+
+    Returns:
+        Path of the exported file (<stem>_torchscript.pt or <stem>.onnx)
+    """
+    stem, _ = os.path.splitext(checkpoint_path)
+    if backend == 'torchscript':
+        return f"{stem}_torchscript.pt"
+    if backend == 'onnxruntime':
+        return f"{stem}.onnx"
+    raise ValueError(f"No exported file for backend: {backend}")
+
+def export_torchscript(model, path, input_size=224):
+    """
+    Trace, freeze and optimize a model for CPU inference
+
+    Freezing inlines parameters as constants; optimize_for_inference then
+    folds Conv-BN pairs and applies CPU-specific rewrites.
+
+    Args:
+        model: FP32 model in eval mode
+        path: Output file
+        input_size: Square model input size
+
+    Returns:
+        Optimized ScriptModule
+    """
+    model.eval()
+    example = torch.randn(1, 3, input_size, input_size)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        optimized = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    torch.jit.save(optimized, path)
+    print(f"✅ TorchScript model saved: {path}")
+    return optimized
+
+def export_onnx(model, path, input_size=224, opset=ONNX_OPSET):
+    """
+    Export a model to ONNX with a dynamic batch dimension
+
+    Args:
+        model: FP32 model in eval mode
+        path: Output file
+        input_size: Square model input size
+        opset: ONNX opset version
+    """
+    model.eval()
+    example = torch.randn(1, 3, input_size, input_size)
+    with torch.no_grad():
+        torch.onnx.export(
+            model, example, path,
+            input_names=['input'],
+            output_names=['logits'],
+            dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+            opset_version=opset,
+            do_constant_folding=True
+        )
+    print(f"✅ ONNX model saved: {path}")
+
+class OnnxRuntimeModel:
+    """onnxruntime session with the call signature of a PyTorch model"""
+
+    def __init__(self, path, threads=None):
+        """
+        Args:
+            path: ONNX file
+            threads: Optional intra-op thread count
+        """
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("onnxruntime is required for the onnxruntime backend: pip install onnxruntime")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, inputs):
+        outputs = self.session.run(None, {self.input_name: inputs.detach().cpu().contiguous().numpy()})
+        return torch.from_numpy(outputs[0])
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+def load_backend_model(checkpoint_path, backend, threads=None):
+    """
+    Load an exported model for the given backend
+
+    Args:
+        checkpoint_path: FP32 checkpoint the export was made from
+        backend: 'torchscript' or 'onnxruntime'
+        threads: Optional intra-op thread count (onnxruntime)
+
+    Returns:
+        Callable model taking a (N, C, H, W) tensor and returning logits
+    """
+    path = backend_path(checkpoint_path, backend)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Exported {backend} model not found: {path}")
+
+    if backend == 'onnxruntime':
+        return OnnxRuntimeModel(path, threads=threads)
+
+    model = torch.jit.load(path, map_location='cpu')
+    model.eval()
+    return model
+
+def check_parity(reference, candidate, inputs, atol=PARITY_ATOL):
+    """
+    Compare an exported runtime against eager PyTorch
+
+    Args:
+        reference: Eager FP32 model
+        candidate: Exported model (TorchScript module or OnnxRuntimeModel)
+        inputs: Iterable of (N, C, H, W) input batches
+        atol: Maximum allowed absolute logit difference
+
+    Returns:
+        Dictionary with max_abs_diff, top1_agreement and passed
+    """
+    max_abs_diff = 0.0
+    agree = 0
+    total = 0
+
+    with torch.no_grad():
+        for batch in inputs:
+            expected = reference(batch).float()
+            actual = candidate(batch).float()
+            max_abs_diff = max(max_abs_diff, float((expected - actual).abs().max()))
+            agree += int((expected.argmax(dim=1) == actual.argmax(dim=1)).sum())
+            total += len(batch)
+
+    top1_agreement = agree / max(total, 1)
+    return {
+        'max_abs_diff': round(max_abs_diff, 6),
+        'top1_agreement': round(top1_agreement, 4),
+        'samples': total,
+        'passed': max_abs_diff <= atol and top1_agreement == 1.0
+    }
+
+def parity_inputs(data_dir=None, model_type='resnet50', max_images=64, input_size=224):
+    """Real images from data_dir if given, otherwise random batches"""
+    if data_dir and os.path.isdir(data_dir):
+        loader = create_image_loader(data_dir, model_type, batch_size=8, max_images=max_images)
+        return [images for images, _ in loader]
+
+    generator = torch.Generator().manual_seed(0)
+    return [torch.randn(batch_size, 3, input_size, input_size, generator=generator) for batch_size in (1, 4, 8)]
+
+def export_checkpoint(checkpoint_path, model_type, backends=('torchscript', 'onnxruntime'),
+                      num_classes=None, data_dir=None, threads=None):
+    """
+    Export an FP32 checkpoint, check parity and compare runtime latency
+
+    Args:
+        checkpoint_path: FP32 checkpoint
+        model_type: 'resnet50', 'lite', 'tiny', 'cnn' or 'cnn_pooled'
+        backends: Runtimes to export for ('torchscript', 'onnxruntime')
+        num_classes: Number of classes (read from the checkpoint if available)
+        data_dir: Optional image folder for the parity check
+        threads: Optional intra-op thread count for the benchmark
+
+    Returns:
+        Export report dictionary
+    """
+    if threads:
+        torch.set_num_threads(threads)
+
+    model, _ = load_fp32_model(checkpoint_path, model_type, num_classes)
+    inputs = parity_inputs(data_dir, model_type)
+
+    report = {
+        'checkpoint': checkpoint_path,
+        'model_type': model_type,
+        'backends': {
+            'eager': {
+                'latency_ms_batch1': round(measure_latency(model, batch_size=1), 2),
+                'latency_ms_batch8': round(measure_latency(model, batch_size=8), 2)
+            }
+        },
+        'timestamp': datetime.now().isoformat()
+    }
+
+    for backend in backends:
+        path = backend_path(checkpoint_path, backend)
+        try:
+            if backend == 'torchscript':
+                export_torchscript(model, path)
+            else:
+                export_onnx(model, path)
+            exported = load_backend_model(checkpoint_path, backend, threads=threads)
+        except Exception as e:
+            print(f"❌ {backend} export failed: {e}")
+            report['backends'][backend] = {'error': str(e)}
+            continue
+
+        parity = check_parity(model, exported, inputs)
+        report['backends'][backend] = {
+            'path': path,
+            'parity': parity,
+            'latency_ms_batch1': round(measure_latency(exported, batch_size=1), 2),
+            'latency_ms_batch8': round(measure_latency(exported, batch_size=8), 2)
+        }
+        status = "✅" if parity['passed'] else "⚠️"
+        print(f"{status} {backend} parity: max |diff| {parity['max_abs_diff']:.2e}, "
+              f"top-1 agreement {parity['top1_agreement']:.2%}")
+
+    print("\n" + "=" * 50)
+    print(f"{'Backend':12} | {'bs=1 ms':>8} | {'bs=8 ms':>8} | Parity")
+    print("-" * 50)
+    for name, r in report['backends'].items():
+        if 'error' in r:
+            print(f"{name:12} | {'-':>8} | {'-':>8} | failed")
+            continue
+        parity = 'ok' if name == 'eager' or r['parity']['passed'] else 'MISMATCH'
+        print(f"{name:12} | {r['latency_ms_batch1']:8.2f} | {r['latency_ms_batch8']:8.2f} | {parity}")
+    print("=" * 50)
+
+    stem, _ = os.path.splitext(checkpoint_path)
+    with open(f"{stem}_export.json", 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Export report saved: {stem}_export.json")
+
+    return report
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export crop disease models to TorchScript and ONNX')
+    parser.add_argument('--checkpoint', required=True, help='FP32 checkpoint path')
+    parser.add_argument('--model-type', choices=MODEL_TYPES, default='resnet50', help='Model architecture')
+    parser.add_argument('--backends', nargs='+', choices=['torchscript', 'onnxruntime'],
+                        default=['torchscript', 'onnxruntime'], help='Runtimes to export for')
+    parser.add_argument('--num-classes', type=int, default=None, help='Number of classes')
+    parser.add_argument('--data-dir', default=None, help='Image folder for the parity check (random inputs if omitted)')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads for the benchmark')
+
+    args = parser.parse_args()
+
+    export_checkpoint(args.checkpoint, args.model_type, args.backends, args.num_classes,
+                      args.data_dir, args.threads)
+
+if __name__ == "__main__":
+    main()
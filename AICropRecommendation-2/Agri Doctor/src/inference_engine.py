@@ -0,0 +1,336 @@
+"""
+Inference engine for crop disease detection
+Shared preprocessing, micro-batched forward passes and post-processing
+(argmax, confidence, top-k, probabilities) for all disease detection apps
+"""
+
+import os
+import time
+import queue
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+import torch
+
+from .image_decode import image_to_tensor, BILINEAR
+
+# Defaults, overridable through the environment
+DEFAULT_MAX_BATCH_SIZE = int(os.getenv('INFERENCE_MAX_BATCH_SIZE', '8'))
+DEFAULT_MAX_WAIT_MS = float(os.getenv('INFERENCE_MAX_WAIT_MS', '5'))
+DEFAULT_CHANNELS_LAST = os.getenv('INFERENCE_CHANNELS_LAST', 'true').lower() in ('1', 'true', 'yes')
+
+class MicroBatcher:
+    """Dynamic micro-batching around a classification model"""
+
+    def __init__(self, model, device='cpu', input_shape=(3, 224, 224),
+                 max_batch_size=None, max_wait_ms=None, channels_last=None):
+        """
+        Args:
+            model: Model in eval mode
+            device: Device the model runs on
+            input_shape: Shape of a single preprocessed input (C, H, W)
+            max_batch_size: Largest batch per forward pass (env INFERENCE_MAX_BATCH_SIZE)
+            max_wait_ms: Longest time the first request in a batch waits for
+                others to arrive (env INFERENCE_MAX_WAIT_MS)
+            channels_last: Feed batches in channels_last memory format, matching
+                models prepared by serving_prep (env INFERENCE_CHANNELS_LAST)
+        """
+        self.model = model
+        self.device = torch.device(device)
+        self.input_shape = tuple(input_shape)
+        self.max_batch_size = max(1, int(max_batch_size or DEFAULT_MAX_BATCH_SIZE))
+        self.max_wait = (DEFAULT_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self.channels_last = DEFAULT_CHANNELS_LAST if channels_last is None else channels_last
+
+        # Input buffer reused across batches; pinned so host-to-GPU copies can be async
+        self._buffer = torch.empty((self.max_batch_size, *self.input_shape), dtype=torch.float32)
+        if self.device.type == 'cuda':
+            self._buffer = self._buffer.pin_memory()
+
+        self._run_lock = threading.Lock()
+        # Guards _running together with enqueueing, so no request lands behind the stop sentinel
+        self._state_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._running = False
+
+        # Metrics
+        self._lock = threading.Lock()
+        self._histogram = Counter()
+        self._requests = 0
+        self._batches = 0
+        self._wait_ms_total = 0.0
+        self._forward_ms_total = 0.0
+
+    def start(self):
+        """Start the background batching thread"""
+        with self._state_lock:
+            if self._running:
+                return self
+            self._running = True
+        self._thread = threading.Thread(target=self._worker, name='micro-batcher', daemon=True)
+        self._thread.start()
+        print(f"✅ Micro-batcher started (max_batch_size={self.max_batch_size}, "
+              f"max_wait_ms={self.max_wait * 1000:.1f})")
+        return self
+
+    def stop(self):
+        """Stop the batching thread after the queued requests are served"""
+        with self._state_lock:
+            if not self._running:
+                return
+            self._running = False
+            self._queue.put(None)
+        self._thread.join(timeout=5)
+
+        if not self._thread.is_alive():
+            # Nothing is left to serve requests still queued; fail them instead of hanging
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None and not item[1].done():
+                    item[1].set_exception(RuntimeError("Micro-batcher stopped"))
+
+    def submit(self, input_tensor):
+        """
+        Queue a single preprocessed input
+
+        Args:
+            input_tensor: Tensor of shape (C, H, W) or (1, C, H, W)
+
+        Returns:
+            concurrent.futures.Future resolving to the model output row (on CPU)
+        """
+        if input_tensor.dim() == 4:
+            input_tensor = input_tensor[0]
+        if tuple(input_tensor.shape) != self.input_shape:
+            raise ValueError(f"Expected input of shape {self.input_shape}, got {tuple(input_tensor.shape)}")
+
+        future = Future()
+        with self._state_lock:
+            queued = self._running
+            if queued:
+                self._queue.put((input_tensor, future, time.perf_counter()))
+        if not queued:
+            # Not started (or stopped): run inline so callers still get a result
+            self._run_batch([(input_tensor, future, time.perf_counter())])
+        return future
+
+    def infer(self, input_tensor, timeout=None):
+        """Blocking inference for one input; returns the model output row"""
+        return self.submit(input_tensor).result(timeout=timeout)
+
+    async def infer_async(self, input_tensor):
+        """Awaitable inference for one input; frees the event loop while batched"""
+        return await asyncio.wrap_future(self.submit(input_tensor))
+
+    def infer_batch(self, input_batch):
+        """
+        Run an already stacked (N, C, H, W) batch as one forward pass
+
+        Bypasses the queue (the caller did the batching) but shares the model
+        lock with queued requests and shows up in the metrics.
+
+        Returns:
+            Model outputs (N, K) on CPU
+        """
+        size = input_batch.shape[0]
+        start = time.perf_counter()
+
+        with self._run_lock:
+            inputs = input_batch.to(self.device, non_blocking=True)
+            if self.channels_last:
+                inputs = inputs.contiguous(memory_format=torch.channels_last)
+            with torch.inference_mode():
+                outputs = self.model(inputs).float().cpu()
+
+        forward_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._histogram[size] += 1
+            self._requests += size
+            self._batches += 1
+            self._forward_ms_total += forward_ms
+        return outputs
+
+    def _worker(self):
+        while self._running or not self._queue.empty():
+            item = self._queue.get()
+            if item is None:
+                continue
+
+            batch = [item]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    break
+                batch.append(item)
+
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        size = len(batch)
+        start = time.perf_counter()
+
+        try:
+            with self._run_lock:
+                for i, (input_tensor, _, _) in enumerate(batch):
+                    self._buffer[i].copy_(input_tensor)
+
+                inputs = self._buffer[:size].to(self.device, non_blocking=True)
+                if self.channels_last:
+                    inputs = inputs.contiguous(memory_format=torch.channels_last)
+                with torch.inference_mode():
+                    outputs = self.model(inputs).float().cpu()
+
+            for i, (_, future, _) in enumerate(batch):
+                future.set_result(outputs[i])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+        forward_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._histogram[size] += 1
+            self._requests += size
+            self._batches += 1
+            self._forward_ms_total += forward_ms
+            self._wait_ms_total += sum((start - queued) * 1000 for _, _, queued in batch)
+
+    def metrics(self):
+        """
+        Batching metrics
+
+        Returns:
+            Dictionary with the batch-size histogram and average timings
+        """
+        with self._lock:
+            batches = max(self._batches, 1)
+            requests = max(self._requests, 1)
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'requests': self._requests,
+                'batches': self._batches,
+                'batch_size_histogram': {str(size): count for size, count in sorted(self._histogram.items())},
+                'avg_batch_size': round(self._requests / batches, 2),
+                'avg_queue_wait_ms': round(self._wait_ms_total / requests, 3),
+                'avg_forward_ms': round(self._forward_ms_total / batches, 3),
+                'queue_depth': self._queue.qsize()
+            }
+
+def build_preprocess(input_size=224, normalize=True, resample=BILINEAR):
+    """
+    Build the PIL image -> (C, H, W) tensor preprocessing used by the engine
+
+    Args:
+        input_size: Square input size
+        normalize: Apply ImageNet mean/std normalisation (ResNet models);
+            the legacy CNN is trained on raw [0, 1] tensors
+        resample: PIL resampling filter (bilinear matches torchvision Resize)
+
+    Returns:
+        Callable taking a PIL image and returning a float tensor
+    """
+    def preprocess(image):
+        return image_to_tensor(image, size=input_size, normalize=normalize, resample=resample)
+
+    return preprocess
+
+class InferenceEngine:
+    """Shared disease classification engine: preprocessing, batched forward pass and post-processing"""
+
+    def __init__(self, model, class_names, device='cpu', preprocess=None, input_size=224,
+                 top_k=3, **batcher_kwargs):
+        """
+        Args:
+            model: Classification model in eval mode
+            class_names: List of class names, or dict mapping index to class name
+            device: Device the model runs on
+            preprocess: Callable PIL image -> (C, H, W) tensor (defaults to
+                build_preprocess(input_size))
+            input_size: Square model input size
+            top_k: Number of top classes returned with each prediction
+            batcher_kwargs: Passed through to MicroBatcher
+        """
+        if isinstance(class_names, dict):
+            class_names = [class_names.get(i, 'Unknown') for i in range(max(class_names) + 1)]
+        self.model = model
+        self.class_names = list(class_names)
+        self.device = device
+        self.top_k = top_k
+        self.preprocess = preprocess or build_preprocess(input_size)
+        self.batcher = MicroBatcher(model, device=device, input_shape=(3, input_size, input_size),
+                                    **batcher_kwargs)
+
+    def start(self):
+        self.batcher.start()
+        return self
+
+    def stop(self):
+        self.batcher.stop()
+
+    def metrics(self):
+        return self.batcher.metrics()
+
+    def _postprocess(self, logits):
+        """Turn one row of model outputs into the prediction dict"""
+        probabilities = torch.softmax(logits.float(), dim=0)
+        k = min(self.top_k, len(probabilities))
+        top_probs, top_indices = torch.topk(probabilities, k)
+        index = int(top_indices[0])
+
+        return {
+            'index': index,
+            'class_name': self._name(index),
+            'confidence': float(top_probs[0]),
+            'top_k': [
+                {'index': int(i), 'class_name': self._name(int(i)), 'confidence': float(p)}
+                for p, i in zip(top_probs, top_indices)
+            ],
+            'probabilities': probabilities.tolist()
+        }
+
+    def _name(self, index):
+        return self.class_names[index] if index < len(self.class_names) else 'Unknown'
+
+    def predict_tensor(self, input_tensor):
+        """Blocking prediction for a preprocessed (C, H, W) tensor"""
+        return self._postprocess(self.batcher.infer(input_tensor))
+
+    async def predict_tensor_async(self, input_tensor):
+        """Awaitable prediction for a preprocessed (C, H, W) tensor"""
+        return self._postprocess(await self.batcher.infer_async(input_tensor))
+
+    def predict_tensor_batch(self, input_batch):
+        """Blocking predictions for a stacked (N, C, H, W) batch in one forward pass"""
+        return [self._postprocess(row) for row in self.batcher.infer_batch(input_batch)]
+
+    def predict(self, image):
+        """
+        Blocking prediction for a PIL image
+
+        Returns:
+            Dictionary with index, class_name, confidence, top_k and the full
+            probabilities list, all from a single forward pass
+        """
+        return self.predict_tensor(self.preprocess(image))
+
+    async def predict_async(self, image):
+        """Awaitable prediction for a PIL image (same result as predict)"""
+        return await self.predict_tensor_async(self.preprocess(image))
+
+    def class_probabilities(self, prediction):
+        """Map class names to probabilities for a prediction dict"""
+        return {
+            self._name(i): prob for i, prob in enumerate(prediction['probabilities'])
+        }
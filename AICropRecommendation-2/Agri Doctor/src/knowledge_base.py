@@ -0,0 +1,177 @@
+"""
+Shared disease knowledge base for crop disease detection APIs
+Loads knowledge_base/disease_info.json once, indexes it by class name and by
+(crop, disease), precomputes the truncated views used by the Lite app and
+swaps in a fresh index when the file changes on disk
+"""
+
+import os
+import re
+import json
+import time
+import threading
+
+# Defaults, overridable through the environment
+KNOWLEDGE_BASE_PATH = os.getenv(
+    'KNOWLEDGE_BASE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'knowledge_base', 'disease_info.json')
+)
+KNOWLEDGE_BASE_CHECK_INTERVAL_S = float(os.getenv('KNOWLEDGE_BASE_CHECK_INTERVAL_S', '2'))
+
+# Size of the truncated "lite" views
+LITE_LIST_ITEMS = 3
+LITE_DESCRIPTION_CHARS = 200
+
+# Fields returned with a prediction
+INFO_FIELDS = ('description', 'symptoms', 'solutions', 'prevention')
+
+def _normalize_class_name(class_name):
+    """Case- and underscore-insensitive key ('Tomato___Late_blight' == 'tomato_late_blight')"""
+    return re.sub(r'_+', '_', class_name.strip().lower())
+
+def _lite_view(entry):
+    return {
+        'symptoms': entry.get('symptoms', [])[:LITE_LIST_ITEMS],
+        'solutions': entry.get('solutions', [])[:LITE_LIST_ITEMS],
+        'prevention': entry.get('prevention', [])[:LITE_LIST_ITEMS],
+        'description': entry.get('description', 'No description available')[:LITE_DESCRIPTION_CHARS]
+    }
+
+class _Index:
+    """Immutable view of one version of the knowledge base file"""
+
+    def __init__(self, data, mtime):
+        self.data = data
+        self.mtime = mtime
+        self.by_class = {}
+        self.by_normalized_class = {}
+        self.by_crop_disease = {}
+        self.lite_by_class = {}
+        self.info_by_class = {}
+
+        for entry in data.get('diseases', []):
+            class_name = entry.get('class_name')
+            if class_name:
+                self.by_class[class_name] = entry
+                self.by_normalized_class[_normalize_class_name(class_name)] = entry
+                self.lite_by_class[class_name] = _lite_view(entry)
+                self.info_by_class[class_name] = {k: entry[k] for k in INFO_FIELDS if k in entry}
+            if 'crop' in entry and 'disease' in entry:
+                self.by_crop_disease[(entry['crop'].lower(), entry['disease'].lower())] = entry
+
+    def resolve(self, class_name):
+        """Exact class name, falling back to the normalized form"""
+        if class_name in self.by_class:
+            return class_name
+        entry = self.by_normalized_class.get(_normalize_class_name(class_name))
+        return entry.get('class_name') if entry else None
+
+class DiseaseKnowledgeBase:
+    """Indexed, hot-reloading disease knowledge base"""
+
+    def __init__(self, path=None, check_interval_s=None):
+        """
+        Args:
+            path: Knowledge base JSON file (env KNOWLEDGE_BASE_PATH)
+            check_interval_s: Minimum seconds between file change checks
+                (env KNOWLEDGE_BASE_CHECK_INTERVAL_S)
+        """
+        self.path = path or KNOWLEDGE_BASE_PATH
+        self.check_interval_s = KNOWLEDGE_BASE_CHECK_INTERVAL_S if check_interval_s is None else check_interval_s
+
+        self._lock = threading.Lock()
+        self._index = _Index({}, None)
+        self._last_check = 0.0
+        self._seen_mtime = None
+        self._reloads = 0
+        self.reload()
+
+    def reload(self):
+        """
+        Parse the file and swap in the new index
+
+        A missing or invalid file keeps the current index, so a half-written
+        edit never empties the live knowledge base.
+
+        Returns:
+            True if a new index was installed
+        """
+        with self._lock:
+            self._last_check = time.monotonic()
+            try:
+                mtime = os.path.getmtime(self.path)
+                self._seen_mtime = mtime
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                print(f"⚠️ Knowledge base not found at {self.path}")
+                return False
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Knowledge base reload failed, keeping the loaded version: {e}")
+                return False
+
+            # Readers only ever see a complete index: a single reference swap
+            self._index = _Index(data, mtime)
+            self._reloads += 1
+
+        print(f"✅ Knowledge base loaded: {len(self._index.by_class)} diseases from {self.path}")
+        return True
+
+    def _current(self):
+        """Current index, reloading first if the file changed"""
+        if time.monotonic() - self._last_check >= self.check_interval_s:
+            self._last_check = time.monotonic()
+            try:
+                # A version that failed to parse is not retried until it changes again
+                changed = os.path.getmtime(self.path) != self._seen_mtime
+            except OSError:
+                changed = False
+            if changed:
+                self.reload()
+        return self._index
+
+    @property
+    def loaded(self):
+        return self._index.mtime is not None
+
+    def get(self, class_name):
+        """Full entry for a predicted class name, or None (shared; do not modify)"""
+        index = self._current()
+        resolved = index.resolve(class_name)
+        return index.by_class.get(resolved) if resolved else None
+
+    def find(self, crop, disease):
+        """Full entry for a (crop, disease) pair, case-insensitive, or None"""
+        return self._current().by_crop_disease.get((crop.lower(), disease.lower()))
+
+    def info(self, class_name):
+        """Description, symptoms, solutions and prevention for a class, or {}"""
+        index = self._current()
+        resolved = index.resolve(class_name)
+        return index.info_by_class.get(resolved, {}) if resolved else {}
+
+    def lite(self, class_name):
+        """Truncated view (3 items per list, 200-char description), or None"""
+        index = self._current()
+        resolved = index.resolve(class_name)
+        return index.lite_by_class.get(resolved) if resolved else None
+
+    def stats(self):
+        index = self._index
+        return {
+            'path': self.path,
+            'loaded': index.mtime is not None,
+            'diseases': len(index.by_class),
+            'reloads': self._reloads
+        }
+
+_knowledge_bases = {}
+_knowledge_bases_lock = threading.Lock()
+
+def get_knowledge_base(path=None):
+    """Get or create the shared knowledge base for a file"""
+    path = os.path.abspath(path or KNOWLEDGE_BASE_PATH)
+    with _knowledge_bases_lock:
+        if path not in _knowledge_bases:
+            _knowledge_bases[path] = DiseaseKnowledgeBase(path)
+        return _knowledge_bases[path]
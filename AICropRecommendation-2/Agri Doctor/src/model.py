@@ -10,15 +10,28 @@ from torchvision.models import ResNet50_Weights
 # Import the lite version
 from .model_lite import CropDiseaseResNet50Lite, TinyDiseaseClassifier, create_memory_optimized_model
 
+# Backbone stages that can carry an early-exit head, with their output channels
+EXIT_LAYERS = {'layer2': 512, 'layer3': 1024}
+
+def _exit_head(in_channels, num_classes):
+    """Auxiliary classifier on a mid-level ResNet feature map"""
+    return nn.Sequential(
+        nn.AdaptiveAvgPool2d((1, 1)),
+        nn.Flatten(),
+        nn.Dropout(0.2),
+        nn.Linear(in_channels, num_classes)
+    )
+
 class CropDiseaseResNet50(nn.Module):
     """ResNet50 model for crop disease classification"""
     
-    def __init__(self, num_classes, pretrained=True, freeze_features=True):
+    def __init__(self, num_classes, pretrained=True, freeze_features=True, early_exits=False):
         """
         Args:
             num_classes: Number of disease classes
             pretrained: Use ImageNet pretrained weights
             freeze_features: Freeze feature extraction layers initially
+            early_exits: Add auxiliary classifier heads after layer2 and layer3
         """
         super(CropDiseaseResNet50, self).__init__()
         
@@ -51,10 +64,85 @@ class CropDiseaseResNet50(nn.Module):
         # Store number of classes
         self.num_classes = num_classes
         
+        # Optional early-exit heads; without them the state dict is unchanged,
+        # so existing checkpoints still load strictly
+        self.early_exits = False
+        self.exit_thresholds = {}
+        if early_exits:
+            self.add_early_exits()
+        
+    def add_early_exits(self):
+        """Attach early-exit heads after layer2 and layer3"""
+        self.exit_heads = nn.ModuleDict({
+            name: _exit_head(channels, self.num_classes) for name, channels in EXIT_LAYERS.items()
+        })
+        self.early_exits = True
+        
     def forward(self, x):
         """Forward pass"""
         return self.resnet(x)
     
+    def forward_exits(self, x):
+        """
+        Forward pass returning the logits of every exit (for joint training)
+        
+        Returns:
+            List of logits: one per early exit (EXIT_LAYERS order), then the final classifier
+        """
+        r = self.resnet
+        x = r.maxpool(r.relu(r.bn1(r.conv1(x))))
+        x = r.layer2(r.layer1(x))
+        outputs = [self.exit_heads['layer2'](x)]
+        x = r.layer3(x)
+        outputs.append(self.exit_heads['layer3'](x))
+        x = r.layer4(x)
+        outputs.append(r.fc(torch.flatten(r.avgpool(x), 1)))
+        return outputs
+    
+    def forward_early_exit(self, x, thresholds=None):
+        """
+        Inference that stops each sample at the first confident exit
+        
+        Args:
+            x: Input batch
+            thresholds: Dict mapping exit name to softmax confidence threshold
+                (defaults to the calibrated exit_thresholds)
+        
+        Returns:
+            Tuple of (logits, exit index per sample); index len(EXIT_LAYERS)
+            means the final classifier
+        """
+        thresholds = self.exit_thresholds if thresholds is None else thresholds
+        r = self.resnet
+        n = x.shape[0]
+        
+        out = r.maxpool(r.relu(r.bn1(r.conv1(x))))
+        stages = [('layer2', (r.layer1, r.layer2)), ('layer3', (r.layer3,))]
+        
+        logits = None
+        exit_index = torch.full((n,), len(stages), dtype=torch.long, device=x.device)
+        active = torch.arange(n, device=x.device)
+        
+        for i, (name, layers) in enumerate(stages):
+            for layer in layers:
+                out = layer(out)
+            exit_logits = self.exit_heads[name](out)
+            if logits is None:
+                logits = exit_logits.new_empty((n, exit_logits.shape[1]))
+            
+            confident = torch.softmax(exit_logits, dim=1).max(dim=1).values >= thresholds.get(name, float('inf'))
+            if confident.any():
+                logits[active[confident]] = exit_logits[confident]
+                exit_index[active[confident]] = i
+                keep = ~confident
+                out, active = out[keep], active[keep]
+                if active.numel() == 0:
+                    return logits, exit_index
+        
+        out = r.layer4(out)
+        logits[active] = r.fc(torch.flatten(r.avgpool(out), 1))
+        return logits, exit_index
+    
     def unfreeze_features(self):
         """Unfreeze all layers for fine-tuning"""
         for param in self.resnet.parameters():
@@ -74,13 +162,14 @@ class CropDiseaseResNet50(nn.Module):
         """Get classifier layer for Grad-CAM"""
         return self.resnet.fc
 
-def create_model(num_classes, pretrained=True, device='cpu'):
+def create_model(num_classes, pretrained=True, device='cpu', early_exits=False):
     """Create and initialize the model"""
     
     model = CropDiseaseResNet50(
         num_classes=num_classes,
         pretrained=pretrained,
-        freeze_features=True
+        freeze_features=True,
+        early_exits=early_exits
     )
     
     # Move to device
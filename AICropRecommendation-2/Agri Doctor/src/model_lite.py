@@ -48,40 +48,29 @@ class CropDiseaseResNet50Lite(nn.Module):
         self.memory_efficient = False
         
     def set_memory_efficient(self, enabled=True):
-        """Enable/disable memory efficient mode"""
+        """
+        Enable/disable gradient checkpointing of layer3 and layer4 for training
+
+        Checkpointing trades recomputation for activation memory in the
+        backward pass, so it only applies in training mode with gradients
+        enabled; eval and inference_mode forwards are unaffected.
+        """
         self.memory_efficient = enabled
-        
-        if enabled:
-            # Enable gradient checkpointing for memory efficiency
-            if hasattr(self.resnet, 'layer1'):
-                self._enable_checkpointing()
-    
-    def _enable_checkpointing(self):
-        """Enable gradient checkpointing for memory efficiency"""
-        try:
-            from torch.utils.checkpoint import checkpoint
-            
-            def checkpoint_wrapper(module):
-                def wrapper(*inputs):
-                    return checkpoint(module, *inputs, use_reentrant=False)
-                return wrapper
-            
-            # Apply checkpointing to memory-intensive layers
-            if hasattr(self.resnet, 'layer3'):
-                self.resnet.layer3 = checkpoint_wrapper(self.resnet.layer3)
-            if hasattr(self.resnet, 'layer4'):
-                self.resnet.layer4 = checkpoint_wrapper(self.resnet.layer4)
-                
-        except ImportError:
-            print("Gradient checkpointing not available")
     
     def forward(self, x):
-        """Forward pass with memory optimization"""
-        if self.memory_efficient:
-            # Use gradient checkpointing during training
-            return torch.utils.checkpoint.checkpoint(self.resnet, x, use_reentrant=False)
-        else:
+        """Forward pass, checkpointing layer3/layer4 while training if enabled"""
+        if not (self.memory_efficient and self.training and torch.is_grad_enabled()):
             return self.resnet(x)
+        
+        from torch.utils.checkpoint import checkpoint
+        
+        resnet = self.resnet
+        x = resnet.maxpool(resnet.relu(resnet.bn1(resnet.conv1(x))))
+        x = resnet.layer2(resnet.layer1(x))
+        x = checkpoint(resnet.layer3, x, use_reentrant=False)
+        x = checkpoint(resnet.layer4, x, use_reentrant=False)
+        x = torch.flatten(resnet.avgpool(x), 1)
+        return resnet.fc(x)
     
     def get_feature_extractor(self):
         """Get feature extractor for transfer learning"""
@@ -0,0 +1,255 @@
+"""
+Serving model selection for crop disease detection
+Picks the FP32 model or one of its INT8 variants (see quantize.py) and the
+inference runtime (see export.py) by config or by available RAM, and
+prepares it for serving
+"""
+
+import os
+
+import torch
+
+from .quantize import VARIANTS, QUANTIZED_ENGINE, variant_path
+from .export import BACKENDS, load_backend_model
+from .serving_prep import prepare_for_serving, set_inference_threads
+from .prune import apply_channel_config
+
+# Variant served by the apps: fp32, int8_dynamic or int8_static
+DISEASE_MODEL_VARIANT = os.getenv('DISEASE_MODEL_VARIANT', 'fp32')
+
+# Runtime for the fp32 variant: eager, torchscript or onnxruntime
+DISEASE_MODEL_BACKEND = os.getenv('DISEASE_MODEL_BACKEND', 'eager')
+
+# Available-RAM thresholds (MB) for the memory-budget loader used by the Lite app
+MEMORY_BUDGET_FP32_MB = int(os.getenv('MEMORY_BUDGET_FP32_MB', '1024'))
+MEMORY_BUDGET_INT8_MB = int(os.getenv('MEMORY_BUDGET_INT8_MB', '384'))
+TINY_MODEL_PATH = os.getenv('TINY_MODEL_PATH', 'models/crop_disease_tiny.pth')
+LITE_MODEL_PATH = os.getenv('LITE_MODEL_PATH', 'models/crop_disease_v3_model.pth')
+LITE_MODEL_VARIANT = os.getenv('LITE_MODEL_VARIANT', 'auto')
+
+def _load_variant(checkpoint_path, variant, device):
+    """Quantized TorchScript variant, or None to serve fp32"""
+    if variant not in VARIANTS:
+        print(f"⚠️ Unknown model variant '{variant}', expected one of {VARIANTS}. Using fp32")
+        return None
+
+    if variant == 'fp32':
+        return None
+
+    if torch.device(device).type != 'cpu':
+        print(f"⚠️ {variant} runs on CPU only, serving fp32 on {device}")
+        return None
+
+    path = variant_path(checkpoint_path, variant)
+    if not os.path.exists(path):
+        print(f"⚠️ {variant} model not found at {path}, serving fp32")
+        return None
+
+    try:
+        torch.backends.quantized.engine = QUANTIZED_ENGINE
+        model = torch.jit.load(path, map_location='cpu')
+        model.eval()
+        print(f"✅ Serving {variant} model from {path}")
+        return model
+    except Exception as e:
+        print(f"❌ Could not load {variant} model from {path}: {e}. Serving fp32")
+        return None
+
+def _load_backend(checkpoint_path, backend, device, threads):
+    """Exported fp32 model for the backend, or None to run eager PyTorch"""
+    if backend not in BACKENDS:
+        print(f"⚠️ Unknown backend '{backend}', expected one of {BACKENDS}. Using eager")
+        return None
+
+    if backend == 'eager':
+        return None
+
+    if torch.device(device).type != 'cpu':
+        print(f"⚠️ {backend} backend is CPU only, running eager on {device}")
+        return None
+
+    try:
+        model = load_backend_model(checkpoint_path, backend, threads=threads)
+        print(f"✅ Serving fp32 model with the {backend} backend")
+        return model
+    except Exception as e:
+        print(f"❌ Could not load {backend} backend: {e}. Running eager")
+        return None
+
+def load_serving_model(fp32_model, checkpoint_path, variant=None, device='cpu', backend=None):
+    """
+    Select the model used for serving predictions
+
+    Quantized variants and exported runtimes are files saved next to the FP32
+    checkpoint and only run on CPU; on other devices, or when a file is
+    missing, the eager FP32 model is served instead. A quantized variant takes
+    precedence over the backend setting. The eager model gets BatchNorm
+    folding and channels_last (see serving_prep.prepare_for_serving).
+
+    Args:
+        fp32_model: Loaded FP32 model (also used for explanations)
+        checkpoint_path: FP32 checkpoint path
+        variant: One of VARIANTS (defaults to env DISEASE_MODEL_VARIANT)
+        device: Device the apps run on
+        backend: One of BACKENDS (defaults to env DISEASE_MODEL_BACKEND)
+
+    Returns:
+        Tuple of (serving model, variant served, backend used)
+    """
+    variant = (variant or DISEASE_MODEL_VARIANT).lower()
+    backend = (backend or DISEASE_MODEL_BACKEND).lower()
+    threads = set_inference_threads()
+
+    model = _load_variant(checkpoint_path, variant, device)
+    if model is not None:
+        return model, variant, 'torchscript'
+
+    model = _load_backend(checkpoint_path, backend, device, threads)
+    if model is not None:
+        return model, 'fp32', backend
+
+    return prepare_for_serving(fp32_model, device=device), 'fp32', 'eager'
+
+def available_memory_mb():
+    """Available system RAM in MB as reported by psutil"""
+    import psutil
+    return psutil.virtual_memory().available / 1024 / 1024
+
+def _load_lite_fp32(checkpoint_path, num_classes):
+    """FP32 CropDiseaseResNet50Lite from a checkpoint; returns (model, class names or None)"""
+    from .model_lite import CropDiseaseResNet50Lite
+
+    if not os.path.exists(checkpoint_path):
+        print("Warning: No trained model found. Creating lite model.")
+        model = CropDiseaseResNet50Lite(num_classes=num_classes, pretrained=True)
+        return model, None
+
+    checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=True)
+    class_names = None
+    pruning = None
+    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
+        state_dict = checkpoint['model_state_dict']
+        class_names = checkpoint.get('class_names')
+        pruning = checkpoint.get('pruning')
+    else:
+        state_dict = checkpoint
+
+    model = CropDiseaseResNet50Lite(num_classes=len(class_names or []) or num_classes, pretrained=False)
+    if pruning:
+        # Pruned checkpoints (see prune.py) have narrower Bottleneck layers
+        apply_channel_config(model, pruning['channels'])
+        print(f"✅ Loading pruned Lite model ({pruning['ratio']:.0%} of inner channels removed)")
+
+    # Full ResNet50 checkpoints share the backbone but not the smaller head
+    own_state = model.state_dict()
+    skipped = [k for k, v in state_dict.items() if k in own_state and own_state[k].shape != v.shape]
+    if skipped:
+        print(f"⚠️ Skipping {len(skipped)} checkpoint tensors with mismatched shapes: {skipped}")
+    model.load_state_dict({k: v for k, v in state_dict.items() if k not in skipped}, strict=False)
+    del checkpoint, state_dict
+
+    return model, class_names
+
+def load_tiny_model(tiny_checkpoint_path, num_classes=None):
+    """TinyDiseaseClassifier from a checkpoint; returns (model, class names or None)"""
+    from .model_lite import TinyDiseaseClassifier
+
+    checkpoint = torch.load(tiny_checkpoint_path, map_location='cpu', weights_only=True)
+    class_names = None
+    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
+        state_dict = checkpoint['model_state_dict']
+        class_names = checkpoint.get('class_names')
+    else:
+        state_dict = checkpoint
+
+    model = TinyDiseaseClassifier(len(class_names or []) or num_classes)
+    model.load_state_dict(state_dict)
+    return model, class_names
+
+def choose_variant_for_memory(checkpoint_path, tiny_checkpoint_path=None, available_mb=None):
+    """
+    Pick the largest model variant that fits the available RAM
+
+    Args:
+        checkpoint_path: FP32 Lite checkpoint (INT8 variants live next to it)
+        tiny_checkpoint_path: TinyDiseaseClassifier checkpoint
+        available_mb: Available RAM (defaults to psutil's figure)
+
+    Returns:
+        Tuple of (variant, available MB); variant is 'fp32', 'int8_static',
+        'int8_dynamic' or 'tiny'
+    """
+    available_mb = available_memory_mb() if available_mb is None else available_mb
+    tiny_checkpoint_path = tiny_checkpoint_path or TINY_MODEL_PATH
+
+    int8_variants = [v for v in ('int8_static', 'int8_dynamic')
+                     if os.path.exists(variant_path(checkpoint_path, v))]
+    has_tiny = os.path.exists(tiny_checkpoint_path)
+
+    if available_mb >= MEMORY_BUDGET_FP32_MB:
+        return 'fp32', available_mb
+    if available_mb >= MEMORY_BUDGET_INT8_MB and int8_variants:
+        return int8_variants[0], available_mb
+    if has_tiny:
+        return 'tiny', available_mb
+    if int8_variants:
+        return int8_variants[0], available_mb
+    return 'fp32', available_mb
+
+def load_memory_budget_model(checkpoint_path, num_classes, device='cpu', variant=None,
+                             tiny_checkpoint_path=None):
+    """
+    Load the Lite serving model sized to the available RAM
+
+    With variant 'auto' the choice follows choose_variant_for_memory: FP32
+    CropDiseaseResNet50Lite with plenty of headroom, its INT8 variant with
+    less, and TinyDiseaseClassifier when memory is tight. A specific variant
+    forces that choice when its file exists.
+
+    Args:
+        checkpoint_path: FP32 Lite checkpoint
+        num_classes: Number of classes if the checkpoint does not list them
+        device: Device the app runs on
+        variant: 'auto', 'fp32', 'int8_static', 'int8_dynamic' or 'tiny'
+            (defaults to env LITE_MODEL_VARIANT)
+        tiny_checkpoint_path: TinyDiseaseClassifier checkpoint (env TINY_MODEL_PATH)
+
+    Returns:
+        Tuple of (model ready for serving, selection info dict with variant,
+        backend, available_mb and class_names from the checkpoint, if any)
+    """
+    tiny_checkpoint_path = tiny_checkpoint_path or TINY_MODEL_PATH
+    variant = (variant or LITE_MODEL_VARIANT).lower()
+    set_inference_threads()
+
+    auto_variant, available_mb = choose_variant_for_memory(checkpoint_path, tiny_checkpoint_path)
+    if variant == 'auto':
+        variant = auto_variant
+    if variant == 'tiny' and not os.path.exists(tiny_checkpoint_path):
+        print(f"⚠️ Tiny model not found at {tiny_checkpoint_path}, using {auto_variant}")
+        variant = auto_variant
+    if torch.device(device).type != 'cpu' and variant.startswith('int8'):
+        variant = 'fp32'
+
+    model = _load_variant(checkpoint_path, variant, device) if variant.startswith('int8') else None
+    class_names = None
+
+    if model is not None:
+        backend = 'torchscript'
+    elif variant == 'tiny':
+        model, class_names = load_tiny_model(tiny_checkpoint_path, num_classes)
+        model = prepare_for_serving(model, device=device)
+        backend = 'eager'
+    else:
+        variant = 'fp32'
+        model, class_names = _load_lite_fp32(checkpoint_path, num_classes)
+        model = prepare_for_serving(model, device=device)
+        backend = 'eager'
+
+    print(f"✅ Memory-budget loader selected {variant} ({available_mb:.0f} MB available)")
+    return model, {
+        'variant': variant,
+        'backend': backend,
+        'available_mb': round(available_mb, 1),
+        'class_names': class_names
+    }
@@ -0,0 +1,342 @@
+"""
+Structured channel pruning for the ResNet50 crop disease models
+Ranks the inner channels of every Bottleneck by L1 norm or Taylor importance,
+removes them to build a smaller dense model and fine-tunes it with Trainer;
+reports accuracy versus CPU latency across pruning ratios
+"""
+
+import os
+import copy
+import json
+from datetime import datetime
+
+import torch
+import torch.nn as nn
+from torchvision.models.resnet import Bottleneck
+
+IMPORTANCE_METHODS = ('l1', 'taylor')
+
+# Kept channel counts are rounded to this multiple for efficient CPU kernels
+CHANNEL_MULTIPLE = 8
+
+DEFAULT_RATIOS = (0.25, 0.5, 0.7)
+DEFAULT_TAYLOR_BATCHES = 20
+
+def pruned_path(checkpoint_path, model_type, ratio):
+    """Pruned checkpoint saved next to the source checkpoint"""
+    stem, ext = os.path.splitext(checkpoint_path)
+    return f"{stem}_{model_type}_pruned{int(round(ratio * 100))}{ext or '.pth'}"
+
+def bottleneck_blocks(model):
+    """(name, Bottleneck) pairs of a ResNet-based model"""
+    return [(name, module) for name, module in model.named_modules() if isinstance(module, Bottleneck)]
+
+def _conv_subset(conv, out_index=None, in_index=None):
+    """Copy of a Conv2d restricted to the given output/input channels"""
+    weight = conv.weight.data
+    if out_index is not None:
+        weight = weight[out_index]
+    if in_index is not None:
+        weight = weight[:, in_index]
+
+    new_conv = nn.Conv2d(
+        weight.shape[1], weight.shape[0], conv.kernel_size, stride=conv.stride,
+        padding=conv.padding, dilation=conv.dilation, bias=conv.bias is not None
+    )
+    new_conv.weight.data = weight.clone()
+    if conv.bias is not None:
+        bias = conv.bias.data
+        new_conv.bias.data = (bias[out_index] if out_index is not None else bias).clone()
+    return new_conv
+
+def _bn_subset(bn, index):
+    """Copy of a BatchNorm2d restricted to the given channels"""
+    new_bn = nn.BatchNorm2d(len(index), eps=bn.eps, momentum=bn.momentum)
+    new_bn.weight.data = bn.weight.data[index].clone()
+    new_bn.bias.data = bn.bias.data[index].clone()
+    new_bn.running_mean = bn.running_mean[index].clone()
+    new_bn.running_var = bn.running_var[index].clone()
+    return new_bn
+
+def _prune_block(block, keep1, keep2):
+    """
+    Keep the given conv1/conv2 output channels of a Bottleneck
+
+    The block's input and output widths (the residual path) are unchanged, so
+    the skip connections and downsample branches need no surgery.
+    """
+    block.conv1 = _conv_subset(block.conv1, out_index=keep1)
+    block.bn1 = _bn_subset(block.bn1, keep1)
+    block.conv2 = _conv_subset(block.conv2, out_index=keep2, in_index=keep1)
+    block.bn2 = _bn_subset(block.bn2, keep2)
+    block.conv3 = _conv_subset(block.conv3, in_index=keep2)
+
+def channel_config(model):
+    """Inner (conv1, conv2) widths of every Bottleneck, as stored in pruned checkpoints"""
+    return {name: [block.conv1.out_channels, block.conv2.out_channels] for name, block in bottleneck_blocks(model)}
+
+def apply_channel_config(model, config):
+    """
+    Reshape an unpruned model to a pruned checkpoint's channel widths so its
+    state dict loads strictly (weights are overwritten by the load)
+
+    Args:
+        model: Freshly built model of the same architecture
+        config: Dict from channel_config, saved as checkpoint['pruning']['channels']
+
+    Returns:
+        The reshaped model
+    """
+    blocks = dict(bottleneck_blocks(model))
+    for name, (width1, width2) in config.items():
+        _prune_block(blocks[name], torch.arange(width1), torch.arange(width2))
+    return model
+
+def _keep_count(channels, ratio):
+    keep = int(round(channels * (1 - ratio) / CHANNEL_MULTIPLE)) * CHANNEL_MULTIPLE
+    return min(channels, max(CHANNEL_MULTIPLE, keep))
+
+def l1_importance(model):
+    """L1 norm of every conv1/conv2 output filter"""
+    return {
+        name: [block.conv1.weight.detach().abs().sum(dim=(1, 2, 3)),
+               block.conv2.weight.detach().abs().sum(dim=(1, 2, 3))]
+        for name, block in bottleneck_blocks(model)
+    }
+
+def taylor_importance(model, data_loader, device='cpu', num_batches=DEFAULT_TAYLOR_BATCHES):
+    """
+    First-order Taylor importance |activation x gradient| of every bn1/bn2
+    output channel, accumulated over a few labelled batches
+
+    Returns:
+        Dict mapping block name to [conv1 importance, conv2 importance]
+    """
+    blocks = bottleneck_blocks(model)
+    scores = {name: [torch.zeros(block.bn1.num_features), torch.zeros(block.bn2.num_features)]
+              for name, block in blocks}
+    handles = []
+
+    def make_hook(name, position):
+        def forward_hook(module, inputs, output):
+            # Bottleneck applies an in-place ReLU next, so keep the BN output
+            activation = output.detach().clone()
+
+            def grad_hook(grad):
+                scores[name][position] += (activation * grad).sum(dim=(2, 3)).abs().sum(dim=0).cpu()
+            output.register_hook(grad_hook)
+        return forward_hook
+
+    for name, block in blocks:
+        handles.append(block.bn1.register_forward_hook(make_hook(name, 0)))
+        handles.append(block.bn2.register_forward_hook(make_hook(name, 1)))
+
+    criterion = nn.CrossEntropyLoss()
+    was_training = model.training
+    model.eval()
+    requires_grad = [p.requires_grad for p in model.parameters()]
+    for p in model.parameters():
+        p.requires_grad = True
+
+    try:
+        for i, (inputs, labels) in enumerate(data_loader):
+            if i >= num_batches:
+                break
+            model.zero_grad()
+            criterion(model(inputs.to(device)), labels.to(device)).backward()
+    finally:
+        for handle in handles:
+            handle.remove()
+        for p, flag in zip(model.parameters(), requires_grad):
+            p.requires_grad = flag
+        model.zero_grad()
+        model.train(was_training)
+
+    return scores
+
+def prune_model(model, ratio, importance):
+    """
+    Remove the least important inner channels of every Bottleneck
+
+    Args:
+        model: ResNet-based model (modified in place)
+        ratio: Fraction of inner channels to remove per layer (0-1)
+        importance: Dict from l1_importance or taylor_importance
+
+    Returns:
+        The pruned model
+    """
+    for name, block in bottleneck_blocks(model):
+        keep = []
+        for scores in importance[name]:
+            count = _keep_count(len(scores), ratio)
+            keep.append(torch.sort(torch.topk(scores, count).indices).values)
+        _prune_block(block, keep[0], keep[1])
+    return model
+
+def count_parameters(model):
+    return sum(p.numel() for p in model.parameters())
+
+def evaluate_pruned(model, eval_loader, latency_batch_sizes=(1, 8)):
+    """
+    Top-1 accuracy and CPU latency of a model as it would be served
+
+    Returns:
+        Dictionary with accuracy, parameter count, size and latency per batch size
+    """
+    from .quantize import collect_predictions, measure_latency, model_size_mb
+    from .serving_prep import fold_batchnorm
+
+    model = model.cpu().eval()
+    predictions, labels = collect_predictions(model, eval_loader)
+
+    # Latency is measured on a BN-folded copy, matching prepare_for_serving
+    served = copy.deepcopy(model)
+    fold_batchnorm(served)
+    return {
+        'accuracy': round(float((predictions == labels).float().mean()), 4),
+        'parameters': count_parameters(model),
+        'size_mb': round(model_size_mb(model), 2),
+        'latency_ms': {str(bs): round(measure_latency(served, batch_size=bs), 2) for bs in latency_batch_sizes}
+    }
+
+def prune_and_finetune(base_model, ratio, method, train_loader, val_loader, class_names, output_path,
+                       device='cpu', epochs=5, learning_rate=1e-4):
+    """
+    Prune a copy of the base model and fine-tune it with Trainer
+
+    Returns:
+        The fine-tuned model with the best validation weights
+    """
+    from .train import Trainer
+
+    model = copy.deepcopy(base_model).to(device)
+    if method == 'taylor':
+        importance = taylor_importance(model, train_loader, device)
+    else:
+        importance = l1_importance(model)
+    prune_model(model, ratio, importance)
+
+    # Every layer is fine-tuned: the pruned layers need to recover together
+    model.unfreeze_features()
+    trainer = Trainer(model, train_loader, val_loader, class_names, device)
+    trainer.train(
+        num_epochs=epochs,
+        learning_rate=learning_rate,
+        use_class_weights=False,
+        checkpoint_path=output_path,
+        fine_tune_epoch=epochs + 1
+    )
+
+    # Store what the serving loaders need to rebuild the pruned architecture
+    checkpoint = torch.load(output_path, map_location='cpu')
+    checkpoint['class_names'] = class_names
+    checkpoint['pruning'] = {
+        'ratio': ratio,
+        'importance': method,
+        'channels': channel_config(model)
+    }
+    torch.save(checkpoint, output_path)
+
+    model.load_state_dict(checkpoint['model_state_dict'])
+    return model
+
+def plot_pruning_curve(results, save_path='outputs/pruning_curve.png'):
+    """Plot accuracy against batch-1 CPU latency for each pruning ratio"""
+    import matplotlib.pyplot as plt
+
+    latencies = [r['latency_ms']['1'] for r in results]
+    accuracies = [r['accuracy'] for r in results]
+
+    plt.figure(figsize=(7, 5))
+    plt.plot(latencies, accuracies, 'o-')
+    for r, x, y in zip(results, latencies, accuracies):
+        plt.annotate(f"{r['ratio']:.0%}", (x, y), textcoords='offset points', xytext=(5, 5))
+    plt.xlabel('CPU latency, batch 1 (ms)')
+    plt.ylabel('Validation accuracy')
+    plt.title('Accuracy vs latency across pruning ratios')
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig(save_path, dpi=300, bbox_inches='tight')
+    plt.close()
+
+def main():
+    import argparse
+
+    from .dataset import create_data_loaders
+    from .quantize import load_fp32_model
+    from .model_loader import _load_lite_fp32
+    from .serving_prep import set_inference_threads
+
+    parser = argparse.ArgumentParser(description='Prune Bottleneck channels and report accuracy vs latency')
+    parser.add_argument('--checkpoint', default='models/crop_disease_v3_model.pth', help='FP32 checkpoint')
+    parser.add_argument('--model-type', default='lite', choices=('lite', 'resnet50'),
+                        help='lite starts from the ResNet50 backbone with the Lite head, as the Lite app does')
+    parser.add_argument('--data-dir', default='data', help='Dataset root with train/val/test')
+    parser.add_argument('--ratios', type=float, nargs='+', default=list(DEFAULT_RATIOS),
+                        help='Fractions of inner channels to remove')
+    parser.add_argument('--importance', default='l1', choices=IMPORTANCE_METHODS)
+    parser.add_argument('--epochs', type=int, default=5, help='Fine-tuning epochs per ratio')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--learning-rate', type=float, default=1e-4)
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads for the latency runs')
+    parser.add_argument('--output', default='outputs/pruning_curve.json', help='Report file')
+
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    print(f"Using device: {device}")
+    set_inference_threads(args.threads)
+
+    train_loader, val_loader, _, class_names = create_data_loaders(
+        data_dir=args.data_dir,
+        batch_size=args.batch_size,
+        num_workers=0 if device.type == 'cpu' else 2
+    )
+
+    if args.model_type == 'lite':
+        base_model, checkpoint_classes = _load_lite_fp32(args.checkpoint, len(class_names))
+        base_model.eval()
+    else:
+        base_model, checkpoint_classes = load_fp32_model(args.checkpoint, args.model_type, len(class_names))
+    if checkpoint_classes and list(checkpoint_classes) != class_names:
+        print("⚠️ Dataset classes differ from the checkpoint's class names")
+
+    results = [{'ratio': 0.0, 'checkpoint': args.checkpoint, **evaluate_pruned(base_model, val_loader)}]
+    print(f"Unpruned: accuracy {results[0]['accuracy']:.4f}, latency {results[0]['latency_ms']['1']:.2f}ms")
+
+    for ratio in sorted(args.ratios):
+        output_path = pruned_path(args.checkpoint, args.model_type, ratio)
+        print(f"\nPruning {ratio:.0%} of inner channels ({args.importance})")
+        model = prune_and_finetune(
+            base_model, ratio, args.importance, train_loader, val_loader, class_names, output_path,
+            device=device, epochs=args.epochs, learning_rate=args.learning_rate
+        )
+        result = {'ratio': ratio, 'checkpoint': output_path, **evaluate_pruned(model, val_loader)}
+        results.append(result)
+        print(f"Pruned {ratio:.0%}: accuracy {result['accuracy']:.4f}, "
+              f"latency {result['latency_ms']['1']:.2f}ms, {result['parameters']:,} parameters")
+
+    baseline_ms = results[0]['latency_ms']['1']
+    for result in results:
+        result['speedup'] = round(baseline_ms / result['latency_ms']['1'], 2)
+
+    report = {
+        'model_type': args.model_type,
+        'importance': args.importance,
+        'epochs': args.epochs,
+        'threads': torch.get_num_threads(),
+        'results': results,
+        'timestamp': datetime.now().isoformat()
+    }
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    plot_pruning_curve(results, os.path.splitext(args.output)[0] + '.png')
+    print(f"\nPruning report saved: {args.output}")
+    if args.model_type == 'lite':
+        print("Serve a pruned checkpoint from the Lite app with LITE_MODEL_PATH=<checkpoint>")
+
+if __name__ == "__main__":
+    main()
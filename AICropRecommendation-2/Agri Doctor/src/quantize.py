@@ -0,0 +1,364 @@
+"""
+INT8 quantization for crop disease detection models
+Builds dynamic (Linear) and static post-training quantized variants of the
+FP32 checkpoints, checks them against FP32 and benchmarks every variant
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import platform
+from datetime import datetime
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
+from torchvision import transforms
+
+from .dataset import CropDiseaseDataset, get_inference_transforms
+from .model import CropDiseaseResNet50
+from .model_lite import CropDiseaseResNet50Lite, TinyDiseaseClassifier
+from .prune import apply_channel_config
+
+MODEL_TYPES = ('resnet50', 'lite', 'tiny', 'cnn', 'cnn_pooled')
+VARIANTS = ('fp32', 'int8_dynamic', 'int8_static')
+
+# Legacy CNN defaults (39 PlantVillage classes, un-normalised inputs)
+CNN_NUM_CLASSES = 39
+
+DEFAULT_CALIBRATION_BATCHES = 32
+DEFAULT_BATCH_SIZE = 16
+
+# fbgemm on x86 servers, qnnpack on ARM hosts
+QUANTIZED_ENGINE = 'qnnpack' if platform.machine().lower() in ('arm64', 'aarch64') else 'fbgemm'
+
+def variant_path(checkpoint_path, variant):
+    """
+    Path of a quantized variant saved alongside the FP32 checkpoint
+
+    Args:
+        checkpoint_path: FP32 checkpoint path (e.g. models/crop_disease_v3_model.pth)
+        variant: One of VARIANTS
+
+    Returns:
+        Path of the variant (e.g. models/crop_disease_v3_model_int8_static.pt)
+    """
+    if variant == 'fp32':
+        return checkpoint_path
+    stem, _ = os.path.splitext(checkpoint_path)
+    return f"{stem}_{variant}.pt"
+
+def report_path(checkpoint_path):
+    """Path of the quantization report saved alongside the FP32 checkpoint"""
+    stem, _ = os.path.splitext(checkpoint_path)
+    return f"{stem}_quantization.json"
+
+def load_fp32_model(checkpoint_path, model_type, num_classes=None):
+    """
+    Load an FP32 disease model on CPU
+
+    Args:
+        checkpoint_path: Checkpoint file (state dict or dict with model_state_dict)
+        model_type: 'resnet50', 'lite', 'tiny', 'cnn' or 'cnn_pooled'
+        num_classes: Number of classes (read from the checkpoint if available)
+
+    Returns:
+        Tuple of (model in eval mode, class names or None)
+    """
+    if model_type not in MODEL_TYPES:
+        raise ValueError(f"Unknown model type: {model_type}. Expected one of {MODEL_TYPES}")
+
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    class_names = None
+    pruning = None
+    if isinstance(checkpoint, dict) and 'model_state_dict' in checkpoint:
+        state_dict = checkpoint['model_state_dict']
+        class_names = checkpoint.get('class_names')
+        pruning = checkpoint.get('pruning')
+    else:
+        state_dict = checkpoint
+
+    if num_classes is None:
+        num_classes = len(class_names) if class_names else CNN_NUM_CLASSES
+
+    if model_type in ('cnn', 'cnn_pooled'):
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import CNN
+        model = CNN.CNNPooled(num_classes) if model_type == 'cnn_pooled' else CNN.CNN(num_classes)
+        class_names = class_names or [CNN.idx_to_classes[i] for i in range(num_classes)]
+    elif model_type == 'lite':
+        model = CropDiseaseResNet50Lite(num_classes=num_classes, pretrained=False)
+    elif model_type == 'tiny':
+        model = TinyDiseaseClassifier(num_classes)
+    else:
+        model = CropDiseaseResNet50(num_classes=num_classes, pretrained=False)
+
+    if pruning:
+        apply_channel_config(model, pruning['channels'])
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model, class_names
+
+def get_eval_transform(model_type, input_size=224):
+    """Serving preprocessing for each model type"""
+    if model_type in ('cnn', 'cnn_pooled'):
+        # The legacy CNN is trained on raw [0, 1] tensors
+        return transforms.Compose([
+            transforms.Resize((input_size, input_size)),
+            transforms.ToTensor()
+        ])
+    return get_inference_transforms(input_size)
+
+def create_image_loader(data_dir, model_type, batch_size=DEFAULT_BATCH_SIZE, max_images=None):
+    """
+    Data loader over a held-out image folder (one sub-directory per class)
+
+    Args:
+        data_dir: Image folder
+        model_type: Model type, selects the preprocessing
+        batch_size: Batch size
+        max_images: Optional cap on the number of images
+
+    Returns:
+        DataLoader yielding (images, labels)
+    """
+    dataset = CropDiseaseDataset(data_dir, transform=get_eval_transform(model_type))
+    if max_images is not None and len(dataset) > max_images:
+        # Evenly spaced subset so every class is represented
+        step = len(dataset) / max_images
+        dataset = Subset(dataset, [int(i * step) for i in range(max_images)])
+    return DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=0)
+
+def quantize_dynamic(model):
+    """
+    Dynamic INT8 quantization of the Linear layers
+
+    Weights are stored as INT8 and activations are quantized on the fly, so
+    no calibration data is needed. Most of the gain is in the classifier heads
+    (the CNN's 50176x1024 Linear in particular).
+
+    Args:
+        model: FP32 model in eval mode
+
+    Returns:
+        Quantized model
+    """
+    torch.backends.quantized.engine = QUANTIZED_ENGINE
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+def quantize_static(model, calibration_loader, num_batches=DEFAULT_CALIBRATION_BATCHES, input_size=224):
+    """
+    Static post-training INT8 quantization with FX graph mode
+
+    prepare_fx fuses Conv+BN+ReLU (and Linear+BN) patterns before observers
+    are inserted. In the legacy CNN the order is Conv, ReLU, BN, so only
+    Conv+ReLU is fused and the BatchNorm runs as a quantized op.
+
+    The FP32 model is copied and left untouched.
+
+    Args:
+        model: FP32 model in eval mode
+        calibration_loader: Loader over held-out images used to set activation ranges
+        num_batches: Number of calibration batches
+        input_size: Square model input size
+
+    Returns:
+        Quantized model
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = QUANTIZED_ENGINE
+    example_inputs = (torch.randn(1, 3, input_size, input_size),)
+
+    prepared = prepare_fx(copy.deepcopy(model), get_default_qconfig_mapping(QUANTIZED_ENGINE), example_inputs)
+
+    print(f"Calibrating on up to {num_batches} batches...")
+    with torch.no_grad():
+        for batch_idx, (images, _) in enumerate(calibration_loader):
+            if batch_idx >= num_batches:
+                break
+            prepared(images)
+
+    return convert_fx(prepared)
+
+def collect_predictions(model, data_loader):
+    """
+    Run a model over a loader
+
+    Returns:
+        Tuple of (predicted labels, true labels) tensors
+    """
+    predictions, labels = [], []
+    with torch.inference_mode():
+        for images, targets in data_loader:
+            predictions.append(model(images).argmax(dim=1))
+            labels.append(targets)
+    return torch.cat(predictions), torch.cat(labels)
+
+def top1_agreement(reference_predictions, predictions):
+    """Fraction of images where two models predict the same top-1 class"""
+    return float((reference_predictions == predictions).float().mean())
+
+def measure_latency(model, batch_size=1, input_size=224, warmup=5, iterations=30):
+    """
+    Average forward-pass latency on CPU
+
+    Returns:
+        Latency in milliseconds per batch
+    """
+    inputs = torch.randn(batch_size, 3, input_size, input_size)
+    with torch.inference_mode():
+        for _ in range(warmup):
+            model(inputs)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model(inputs)
+    return (time.perf_counter() - start) / iterations * 1000
+
+def model_size_mb(model):
+    """Serialized size of a model in MB"""
+    import io
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024 / 1024
+
+def save_variant(model, path, input_size=224):
+    """
+    Save a quantized model as TorchScript so serving does not need to
+    repeat the FX prepare/convert steps
+    """
+    example = torch.randn(1, 3, input_size, input_size)
+    with torch.no_grad():
+        scripted = torch.jit.trace(model, example)
+    torch.jit.save(scripted, path)
+    print(f"✅ Saved {path}")
+
+def benchmark_variants(variants, eval_loader, threads=None):
+    """
+    Latency, size and accuracy of each variant
+
+    Args:
+        variants: Dictionary mapping variant name to model; must include 'fp32'
+        eval_loader: Labelled held-out images
+        threads: Optional torch intra-op thread count
+
+    Returns:
+        Dictionary mapping variant name to its metrics
+    """
+    if threads:
+        torch.set_num_threads(threads)
+
+    fp32_predictions, labels = collect_predictions(variants['fp32'], eval_loader)
+
+    results = {}
+    for name, model in variants.items():
+        predictions = fp32_predictions if name == 'fp32' else collect_predictions(model, eval_loader)[0]
+        results[name] = {
+            'accuracy': round(float((predictions == labels).float().mean()), 4),
+            'top1_agreement_vs_fp32': round(top1_agreement(fp32_predictions, predictions), 4),
+            'latency_ms_batch1': round(measure_latency(model, batch_size=1), 2),
+            'latency_ms_batch8': round(measure_latency(model, batch_size=8), 2),
+            'size_mb': round(model_size_mb(model), 2)
+        }
+
+    print("\n" + "=" * 72)
+    print(f"{'Variant':14} | {'Accuracy':>8} | {'Agree':>6} | {'bs=1 ms':>8} | {'bs=8 ms':>8} | {'Size MB':>8}")
+    print("-" * 72)
+    for name, r in results.items():
+        print(f"{name:14} | {r['accuracy']:8.4f} | {r['top1_agreement_vs_fp32']:6.4f} | "
+              f"{r['latency_ms_batch1']:8.2f} | {r['latency_ms_batch8']:8.2f} | {r['size_mb']:8.2f}")
+    print("=" * 72)
+
+    return results
+
+def quantize_checkpoint(checkpoint_path, model_type, calibration_dir, eval_dir=None,
+                        num_classes=None, calibration_batches=DEFAULT_CALIBRATION_BATCHES,
+                        max_eval_images=1000, min_agreement=0.98, threads=None):
+    """
+    Build, check, benchmark and save the INT8 variants of an FP32 checkpoint
+
+    Args:
+        checkpoint_path: FP32 checkpoint
+        model_type: 'resnet50', 'lite', 'tiny', 'cnn' or 'cnn_pooled'
+        calibration_dir: Held-out image folder used for static calibration
+        eval_dir: Labelled image folder for agreement/accuracy (defaults to calibration_dir)
+        num_classes: Number of classes (read from the checkpoint if available)
+        calibration_batches: Number of calibration batches
+        max_eval_images: Cap on evaluation images
+        min_agreement: Variants below this top-1 agreement with FP32 are not saved
+        threads: Optional torch intra-op thread count for the benchmark
+
+    Returns:
+        Quantization report dictionary
+    """
+    model, class_names = load_fp32_model(checkpoint_path, model_type, num_classes)
+
+    calibration_loader = create_image_loader(calibration_dir, model_type)
+    eval_loader = create_image_loader(eval_dir or calibration_dir, model_type, max_images=max_eval_images)
+
+    print("Building dynamic INT8 variant...")
+    dynamic = quantize_dynamic(model)
+
+    print("Building static INT8 variant...")
+    static = quantize_static(model, calibration_loader, num_batches=calibration_batches)
+
+    results = benchmark_variants({'fp32': model, 'int8_dynamic': dynamic, 'int8_static': static},
+                                 eval_loader, threads=threads)
+
+    saved = {}
+    for name, quantized in (('int8_dynamic', dynamic), ('int8_static', static)):
+        agreement = results[name]['top1_agreement_vs_fp32']
+        if agreement < min_agreement:
+            print(f"⚠️ {name} agreement {agreement:.4f} below {min_agreement}, not saving")
+            continue
+        path = variant_path(checkpoint_path, name)
+        save_variant(quantized, path)
+        saved[name] = path
+
+    report = {
+        'checkpoint': checkpoint_path,
+        'model_type': model_type,
+        'quantized_engine': QUANTIZED_ENGINE,
+        'calibration_dir': calibration_dir,
+        'eval_dir': eval_dir or calibration_dir,
+        'eval_images': len(eval_loader.dataset),
+        'min_agreement': min_agreement,
+        'class_names': class_names,
+        'variants': results,
+        'saved': saved,
+        'timestamp': datetime.now().isoformat()
+    }
+
+    with open(report_path(checkpoint_path), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Quantization report saved: {report_path(checkpoint_path)}")
+
+    return report
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Quantize crop disease models to INT8')
+    parser.add_argument('--checkpoint', required=True, help='FP32 checkpoint path')
+    parser.add_argument('--model-type', choices=MODEL_TYPES, default='resnet50', help='Model architecture')
+    parser.add_argument('--calibration-dir', default='data/val', help='Held-out image folder for calibration')
+    parser.add_argument('--eval-dir', default='data/test', help='Labelled image folder for agreement/accuracy')
+    parser.add_argument('--num-classes', type=int, default=None, help='Number of classes')
+    parser.add_argument('--calibration-batches', type=int, default=DEFAULT_CALIBRATION_BATCHES)
+    parser.add_argument('--max-eval-images', type=int, default=1000)
+    parser.add_argument('--min-agreement', type=float, default=0.98, help='Minimum top-1 agreement to save a variant')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads for the benchmark')
+
+    args = parser.parse_args()
+
+    quantize_checkpoint(
+        args.checkpoint, args.model_type, args.calibration_dir, args.eval_dir,
+        num_classes=args.num_classes, calibration_batches=args.calibration_batches,
+        max_eval_images=args.max_eval_images, min_agreement=args.min_agreement, threads=args.threads
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Compact response encoding for crop disease detection APIs
+Heatmaps as raw WebP/JPEG bytes or float16 attention maps with ETags, and
+brotli/gzip compression for JSON responses
+"""
+
+import io
+import os
+import hashlib
+from functools import lru_cache
+
+import numpy as np
+from fastapi import Request
+from fastapi.responses import Response
+from starlette.middleware.gzip import GZipMiddleware
+
+try:
+    from brotli_asgi import BrotliMiddleware
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+from PIL import features
+
+# Defaults, overridable through the environment
+HEATMAP_FORMAT = os.getenv('HEATMAP_FORMAT', 'webp').lower()
+HEATMAP_QUALITY = int(os.getenv('HEATMAP_QUALITY', '75'))
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+
+# Float16 attention maps: 2 bytes per cell, shape in the X-Attention-Shape header
+ATTENTION_MEDIA_TYPE = 'application/octet-stream'
+
+# Already-compressed bodies and event streams skip the compression middleware
+UNCOMPRESSED_PATH_SUFFIXES = ('/heatmap', '/attention')
+
+_MEDIA_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+@lru_cache(maxsize=None)
+def _heatmap_format():
+    if HEATMAP_FORMAT == 'webp' and not features.check('webp'):
+        print("⚠️ Pillow built without WebP support, heatmaps fall back to JPEG")
+        return 'jpeg'
+    return HEATMAP_FORMAT if HEATMAP_FORMAT in _MEDIA_TYPES else 'jpeg'
+
+def etag(data):
+    """Strong ETag for a response body"""
+    return f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+
+def encode_heatmap(image, quality=None):
+    """
+    Encode a heatmap overlay as WebP (env HEATMAP_FORMAT) or JPEG
+
+    Returns:
+        Dictionary with data, media_type and etag
+    """
+    fmt = _heatmap_format()
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt.upper(), quality=quality or HEATMAP_QUALITY)
+    data = buffer.getvalue()
+    return {'data': data, 'media_type': _MEDIA_TYPES[fmt], 'etag': etag(data)}
+
+def encode_attention(attention):
+    """
+    Encode a low-resolution attention map in [0, 1] as little-endian float16
+
+    Returns:
+        Dictionary with data, media_type, etag and the map shape (rows, cols)
+    """
+    attention = np.asarray(attention, dtype='<f2')
+    data = attention.tobytes()
+    return {'data': data, 'media_type': ATTENTION_MEDIA_TYPE, 'etag': etag(data),
+            'shape': list(attention.shape)}
+
+def artifact_response(request: Request, artifact, max_age):
+    """
+    Binary response for an encoded heatmap or attention map
+
+    Answers 304 when If-None-Match carries the artifact's ETag. The bytes of an
+    explanation id never change, so clients may cache them until it expires.
+    """
+    headers = {
+        'ETag': artifact['etag'],
+        'Cache-Control': f"private, max-age={max(int(max_age), 0)}, immutable"
+    }
+    if 'shape' in artifact:
+        headers['X-Attention-Shape'] = 'x'.join(str(n) for n in artifact['shape'])
+        headers['X-Attention-Dtype'] = 'float16'
+
+    if artifact['etag'] in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=headers)
+    return Response(content=artifact['data'], media_type=artifact['media_type'], headers=headers)
+
+class CompressionMiddleware:
+    """Brotli (when brotli-asgi is installed, else gzip) for JSON and other text responses"""
+
+    def __init__(self, app, minimum_size=None):
+        self.app = app
+        minimum_size = minimum_size or COMPRESSION_MIN_BYTES
+        if BROTLI_AVAILABLE:
+            # Clients that only accept gzip still get gzip
+            self.compressed_app = BrotliMiddleware(app, minimum_size=minimum_size, gzip_fallback=True)
+        else:
+            self.compressed_app = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self._skip(scope):
+            await self.compressed_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    @staticmethod
+    def _skip(scope):
+        if scope['path'].endswith(UNCOMPRESSED_PATH_SUFFIXES):
+            return True
+        # Buffering in the compressor would hold back server-sent events
+        accept = dict(scope['headers']).get(b'accept', b'')
+        return b'text/event-stream' in accept
@@ -0,0 +1,392 @@
+"""
+Prediction result cache for crop disease detection APIs
+Answers repeated uploads by SHA-256 of the bytes and resized/recompressed
+copies by perceptual hash (dHash), with an in-memory LRU, an optional shared
+SQLite tier and entries scoped to the serving model version
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# Defaults, overridable through the environment
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE', 'true').lower() in ('1', 'true', 'yes')
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '1024'))
+# Max Hamming distance between 64-bit dHashes for a near-duplicate hit (negative disables).
+# Off by default: a near hit returns another upload's diagnosis unchecked, and
+# similarly framed leaves on plain backgrounds can hash within a few bits of
+# each other. Enable only with a false-hit rate measured on real uploads.
+RESULT_CACHE_PHASH_DISTANCE = int(os.getenv('RESULT_CACHE_PHASH_DISTANCE', '-1'))
+# SQLite file shared by all workers on a host (empty keeps the cache in memory only)
+RESULT_CACHE_DB = os.getenv('RESULT_CACHE_DB', '')
+# Disk tier bounds: rows older than MAX_AGE_S and beyond MAX_ROWS (oldest
+# first, across all model versions sharing the file) are pruned
+RESULT_CACHE_DB_MAX_ROWS = int(os.getenv('RESULT_CACHE_DB_MAX_ROWS', '100000'))
+RESULT_CACHE_DB_MAX_AGE_S = float(os.getenv('RESULT_CACHE_DB_MAX_AGE_S', str(7 * 24 * 3600)))
+
+# Disk writes between prunes
+PRUNE_EVERY = 256
+
+DHASH_SIZE = 8
+
+def content_hash(image_bytes):
+    """SHA-256 of the uploaded bytes (exact duplicates)"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def dhash(image, hash_size=DHASH_SIZE):
+    """
+    64-bit difference hash of a PIL image
+
+    Compares adjacent pixels of a (hash_size + 1) x hash_size grayscale
+    thumbnail, so it survives resizing and JPEG recompression.
+    """
+    pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+def model_version(checkpoint_path, *parts):
+    """
+    Version string for cache scoping: checkpoint name, size and mtime plus
+    any serving options (variant, backend, cascade, ...)
+    """
+    try:
+        stat = os.stat(checkpoint_path)
+        fingerprint = f"{os.path.basename(checkpoint_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        fingerprint = f"{os.path.basename(checkpoint_path)}:untrained"
+    return ':'.join([fingerprint] + [str(p) for p in parts])
+
+class _DiskTier:
+    """
+    SQLite table of exact-match results shared between worker processes
+
+    Apps serving different models may share one file; rows are keyed by model
+    version, so each app only reads its own, and the table is bounded by age
+    and row count rather than cleared when another version starts.
+    """
+
+    def __init__(self, path, version, max_rows=None, max_age_s=None):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.version = version
+        self.max_rows = RESULT_CACHE_DB_MAX_ROWS if max_rows is None else max_rows
+        self.max_age_s = RESULT_CACHE_DB_MAX_AGE_S if max_age_s is None else max_age_s
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'sha TEXT NOT NULL, model_version TEXT NOT NULL, dhash TEXT, '
+                'prediction TEXT NOT NULL, inference_ms REAL, created REAL, '
+                'PRIMARY KEY (sha, model_version))'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS results_created ON results (created)')
+        self.prune()
+
+    def prune(self):
+        """Drop rows past max_age_s, then the oldest rows beyond max_rows"""
+        with self._lock, self._conn:
+            if self.max_age_s > 0:
+                self._conn.execute('DELETE FROM results WHERE created < ?', (time.time() - self.max_age_s,))
+            if self.max_rows > 0:
+                self._conn.execute(
+                    'DELETE FROM results WHERE rowid IN '
+                    '(SELECT rowid FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)',
+                    (self.max_rows,)
+                )
+
+    def get(self, sha):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT prediction, inference_ms, dhash FROM results WHERE sha = ? AND model_version = ?',
+                (sha, self.version)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1] or 0.0, int(row[2], 16) if row[2] else None
+
+    def put(self, sha, phash, prediction, inference_ms):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                (sha, self.version, format(phash, '016x') if phash is not None else None,
+                 json.dumps(prediction), inference_ms, time.time())
+            )
+            self._writes += 1
+            due = self._writes % PRUNE_EVERY == 0
+        if due:
+            self.prune()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ResultCache:
+    """Exact + near-duplicate prediction cache scoped to one model version"""
+
+    def __init__(self, version, max_entries=None, max_distance=None, db_path=None):
+        """
+        Args:
+            version: Serving model version (see model_version); entries of
+                other versions are never returned
+            max_entries: In-memory LRU size (env RESULT_CACHE_SIZE)
+            max_distance: dHash Hamming threshold, negative disables near
+                duplicates (env RESULT_CACHE_PHASH_DISTANCE)
+            db_path: Optional SQLite file for the shared tier (env RESULT_CACHE_DB)
+        """
+        self.version = version
+        self.max_entries = max_entries or RESULT_CACHE_SIZE
+        self.max_distance = RESULT_CACHE_PHASH_DISTANCE if max_distance is None else max_distance
+        db_path = RESULT_CACHE_DB if db_path is None else db_path
+
+        self._lock = threading.Lock()
+        # sha -> (prediction, inference_ms, dhash)
+        self._entries = OrderedDict()
+        self._disk = None
+        if db_path:
+            try:
+                self._disk = _DiskTier(db_path, version)
+            except sqlite3.Error as e:
+                print(f"⚠️ Result cache disk tier disabled ({db_path}): {e}")
+
+        self._counts = {'lookups': 0, 'exact_hits': 0, 'near_hits': 0, 'disk_hits': 0, 'misses': 0,
+                        'evictions': 0}
+        self._saved_ms = 0.0
+
+    def keys(self, image_bytes, image=None):
+        """Cache keys for an upload: (SHA-256, dHash or None)"""
+        phash = dhash(image) if image is not None and self.max_distance >= 0 else None
+        return content_hash(image_bytes), phash
+
+    def _insert(self, sha, entry):
+        self._entries[sha] = entry
+        self._entries.move_to_end(sha)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counts['evictions'] += 1
+
+    def _nearest(self, phash):
+        """Closest in-memory entry within max_distance, or None"""
+        best_sha, best_distance = None, self.max_distance + 1
+        for sha, (_, _, other) in self._entries.items():
+            if other is None:
+                continue
+            distance = hamming_distance(phash, other)
+            if distance < best_distance:
+                best_sha, best_distance = sha, distance
+                if distance == 0:
+                    break
+        return best_sha
+
+    def get(self, keys):
+        """
+        Look up a prediction
+
+        Returns:
+            Tuple of (prediction copy or None, hit kind: 'exact', 'near', 'disk' or None)
+        """
+        sha, phash = keys
+        with self._lock:
+            self._counts['lookups'] += 1
+            hit, entry = None, self._entries.get(sha)
+            if entry is not None:
+                hit = 'exact'
+                self._entries.move_to_end(sha)
+            elif phash is not None:
+                near_sha = self._nearest(phash)
+                if near_sha is not None:
+                    hit, entry = 'near', self._entries[near_sha]
+                    self._entries.move_to_end(near_sha)
+
+        if entry is None and self._disk is not None:
+            try:
+                entry = self._disk.get(sha)
+            except sqlite3.Error as e:
+                print(f"⚠️ Result cache disk lookup failed: {e}")
+            if entry is not None:
+                hit = 'disk'
+                with self._lock:
+                    self._insert(sha, entry)
+
+        with self._lock:
+            if entry is None:
+                self._counts['misses'] += 1
+                return None, None
+            self._counts[f'{hit}_hits'] += 1
+            self._saved_ms += entry[1]
+        return dict(entry[0]), hit
+
+    def put(self, keys, prediction, inference_ms):
+        """Store a prediction (JSON-serialisable dict) with the time it took"""
+        sha, phash = keys
+        entry = (dict(prediction), inference_ms, phash)
+        with self._lock:
+            self._insert(sha, entry)
+        if self._disk is not None:
+            try:
+                self._disk.put(sha, phash, entry[0], inference_ms)
+            except sqlite3.Error as e:
+                print(f"⚠️ Result cache disk write failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        """
+        Cache metrics
+
+        Returns:
+            Dictionary with hit counts, hit rate and inference time saved
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            hits = counts['exact_hits'] + counts['near_hits'] + counts['disk_hits']
+            return {
+                'model_version': self.version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'phash_max_distance': self.max_distance,
+                'disk_tier': self._disk.path if self._disk else None,
+                **counts,
+                'hit_rate': round(hits / max(counts['lookups'], 1), 4),
+                'saved_inference_ms': round(self._saved_ms, 1)
+            }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+
+class CachedEngine:
+    """Inference engine wrapper that consults a ResultCache before predicting"""
+
+    def __init__(self, engine, cache):
+        """
+        Args:
+            engine: InferenceEngine (or CascadeEngine) to wrap
+            cache: ResultCache for the engine's model version, or None to
+                pass every call through
+        """
+        self.engine = engine
+        self.cache = cache
+        self.preprocess = engine.preprocess
+        self.class_names = engine.class_names
+
+    def start(self):
+        self.engine.start()
+        return self
+
+    def stop(self):
+        self.engine.stop()
+        if self.cache is not None:
+            self.cache.close()
+
+    def _answer(self, prediction, hit):
+        prediction['cache'] = hit
+        return prediction
+
+    def predict(self, image, image_bytes=None):
+        """Blocking prediction; cached when the upload bytes are given"""
+        if image_bytes is None or self.cache is None:
+            return self.engine.predict(image)
+        keys = self.cache.keys(image_bytes, image)
+        prediction, hit = self.cache.get(keys)
+        if prediction is not None:
+            return self._answer(prediction, hit)
+
+        start = time.perf_counter()
+        prediction = self.engine.predict(image)
+        self.cache.put(keys, prediction, (time.perf_counter() - start) * 1000)
+        return self._answer(prediction, None)
+
+    async def predict_async(self, image, image_bytes=None):
+        """Awaitable prediction; cached when the upload bytes are given"""
+        if image_bytes is None or self.cache is None:
+            return await self.engine.predict_async(image)
+        keys = self.cache.keys(image_bytes, image)
+        prediction, hit = self.cache.get(keys)
+        if prediction is not None:
+            return self._answer(prediction, hit)
+
+        start = time.perf_counter()
+        prediction = await self.engine.predict_async(image)
+        self.cache.put(keys, prediction, (time.perf_counter() - start) * 1000)
+        return self._answer(prediction, None)
+
+    def cache_keys(self, image_bytes, image):
+        """Cache keys for an upload, or None when caching is off"""
+        return self.cache.keys(image_bytes, image) if self.cache is not None else None
+
+    def remember(self, image_bytes, image, prediction, inference_ms):
+        """Cache a prediction computed outside the engine (same model version)"""
+        if self.cache is not None:
+            self.cache.put(self.cache.keys(image_bytes, image), prediction, inference_ms)
+
+    def predict_tensor_batch(self, input_batch, cache_keys=None):
+        """
+        Blocking predictions for a stacked (N, C, H, W) batch
+
+        Args:
+            input_batch: Preprocessed images
+            cache_keys: Per-image keys from cache_keys (None entries are not cached);
+                only the misses go through the wrapped engine, in one batch
+        """
+        if self.cache is None or cache_keys is None:
+            return self.engine.predict_tensor_batch(input_batch)
+
+        predictions, misses = [None] * len(cache_keys), []
+        for i, keys in enumerate(cache_keys):
+            if keys is not None:
+                prediction, hit = self.cache.get(keys)
+                if prediction is not None:
+                    predictions[i] = self._answer(prediction, hit)
+                    continue
+            misses.append(i)
+
+        if misses:
+            start = time.perf_counter()
+            computed = self.engine.predict_tensor_batch(input_batch[misses])
+            per_image_ms = (time.perf_counter() - start) * 1000 / len(misses)
+            for i, prediction in zip(misses, computed):
+                if cache_keys[i] is not None:
+                    self.cache.put(cache_keys[i], prediction, per_image_ms)
+                predictions[i] = self._answer(prediction, None)
+        return predictions
+
+    def predict_tensor(self, input_tensor):
+        return self.engine.predict_tensor(input_tensor)
+
+    async def predict_tensor_async(self, input_tensor):
+        return await self.engine.predict_tensor_async(input_tensor)
+
+    def class_probabilities(self, prediction):
+        return self.engine.class_probabilities(prediction)
+
+    def metrics(self):
+        if self.cache is None:
+            return self.engine.metrics()
+        return {**self.engine.metrics(), 'result_cache': self.cache.metrics()}
+
+def build_cached_engine(engine, version):
+    """Wrap an engine in the result cache (a pass-through when env RESULT_CACHE is off)"""
+    if not RESULT_CACHE_ENABLED:
+        return CachedEngine(engine, None)
+    cache = ResultCache(version)
+    print(f"✅ Result cache enabled ({cache.max_entries} entries, dHash distance "
+          f"{cache.max_distance}, disk tier: {RESULT_CACHE_DB or 'off'})")
+    return CachedEngine(engine, cache)
@@ -3,23 +3,25 @@ Risk Level Assessment for Crop Disease Detection
 Calculates risk levels based on prediction confidence and disease severity
 """
 
-import json
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional
 
+from .knowledge_base import get_knowledge_base
+
 class RiskLevelCalculator:
     """Calculate risk levels for crop disease predictions"""
     
-    def __init__(self, knowledge_base_path='knowledge_base/disease_info.json'):
+    def __init__(self, knowledge_base_path=None):
         """
         Initialize risk calculator
         
         Args:
-            knowledge_base_path: Path to disease knowledge base
+            knowledge_base_path: Path to disease knowledge base (defaults to the
+                shared knowledge base, env KNOWLEDGE_BASE_PATH)
         """
-        self.knowledge_base_path = knowledge_base_path
-        self.disease_info = self._load_disease_info()
+        self.knowledge_base = get_knowledge_base(knowledge_base_path)
+        self.knowledge_base_path = self.knowledge_base.path
         
         # Disease severity mapping (based on agricultural impact)
         self.disease_severity = {
@@ -54,16 +56,6 @@ class RiskLevelCalculator:
             'low': 0.0
         }
     
-    def _load_disease_info(self):
-        """Load disease information from knowledge base"""
-        try:
-            with open(self.knowledge_base_path, 'r') as f:
-                data = json.load(f)
-            return {f"{d['crop']}___{d['disease']}": d for d in data['diseases']}
-        except FileNotFoundError:
-            print(f"Warning: Knowledge base not found at {self.knowledge_base_path}")
-            return {}
-    
     def calculate_base_risk(self, predicted_class: str, confidence: float) -> str:
         """
         Calculate base risk level using confidence and disease severity
@@ -268,7 +260,7 @@ class RiskLevelCalculator:
         
         # Add disease-specific recommendations
         if 'healthy' not in predicted_class.lower():
-            disease_info = self.disease_info.get(predicted_class, {})
+            disease_info = self.knowledge_base.get(predicted_class) or {}
             if 'solutions' in disease_info:
                 recommendations.extend(disease_info['solutions'][:3])  # Top 3 solutions
         
@@ -0,0 +1,205 @@
+"""
+Serving preparation for crop disease detection models
+Folds BatchNorm into the preceding Conv/Linear layers, switches to channels_last
+and sets per-worker thread counts; reports before/after latency per model
+"""
+
+import os
+import time
+from datetime import datetime
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
+
+from .inference_engine import DEFAULT_CHANNELS_LAST
+
+# Intra-op threads per worker process (0 keeps the torch default)
+INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', '0'))
+
+def set_inference_threads(threads=None):
+    """
+    Set the intra-op thread count for this worker
+
+    With several uvicorn workers on one host, keeping workers x threads at or
+    below the core count avoids oversubscription.
+
+    Args:
+        threads: Thread count (defaults to env INFERENCE_THREADS; 0 keeps the default)
+
+    Returns:
+        Thread count in effect
+    """
+    threads = INFERENCE_THREADS if threads is None else threads
+    if threads and threads > 0:
+        torch.set_num_threads(threads)
+    return torch.get_num_threads()
+
+def _fold_pair(parent, first_name, second_name):
+    """Fold parent.<second_name> (BatchNorm) into parent.<first_name>; True if folded"""
+    first = parent._modules.get(first_name)
+    second = parent._modules.get(second_name)
+
+    if isinstance(first, nn.Conv2d) and isinstance(second, nn.BatchNorm2d):
+        parent._modules[first_name] = fuse_conv_bn_eval(first, second)
+    elif isinstance(first, nn.Linear) and isinstance(second, nn.BatchNorm1d):
+        parent._modules[first_name] = fuse_linear_bn_eval(first, second)
+    else:
+        return False
+
+    parent._modules[second_name] = nn.Identity()
+    return True
+
+def fold_batchnorm(model):
+    """
+    Fold eval-mode BatchNorm layers into the Conv2d/Linear layer feeding them
+
+    Only Conv -> BN and Linear -> BN pairs are folded, where BN is an exact
+    affine transform of that layer's output:
+    - adjacent pairs inside nn.Sequential (TinyDiseaseClassifier features,
+      ResNet downsample branches, the ResNet50 Linear/BatchNorm1d head)
+    - torchvision ResNet stem and Bottleneck blocks (convN followed by bnN)
+
+    The legacy CNN orders its layers Conv -> ReLU -> BN. BN after the ReLU
+    cannot be folded into the preceding conv, and folding it into the next
+    conv is not exact because that conv zero-pads its (normalised) input, so
+    the CNN is left unchanged.
+
+    Args:
+        model: Model in eval mode (modified in place)
+
+    Returns:
+        Number of BatchNorm layers folded
+    """
+    model.eval()
+    folded = 0
+
+    for module in list(model.modules()):
+        if isinstance(module, nn.Sequential):
+            names = list(module._modules.keys())
+            for first_name, second_name in zip(names, names[1:]):
+                folded += _fold_pair(module, first_name, second_name)
+
+        # torchvision ResNet stem (conv1/bn1) and Bottleneck (conv1-3/bn1-3)
+        for i in (1, 2, 3):
+            if f'conv{i}' in module._modules and f'bn{i}' in module._modules:
+                folded += _fold_pair(module, f'conv{i}', f'bn{i}')
+
+    return folded
+
+def prepare_for_serving(model, device='cpu', fold_bn=True, channels_last=None, threads=None):
+    """
+    Prepare an eager FP32 model for serving
+
+    Folding is in place and keeps the module names, so Grad-CAM hooks on the
+    same model (e.g. resnet.layer4) still work.
+
+    Args:
+        model: FP32 model
+        device: Device the model runs on
+        fold_bn: Fold BatchNorm into the preceding layers
+        channels_last: Convert to channels_last (env INFERENCE_CHANNELS_LAST)
+        threads: Intra-op threads (env INFERENCE_THREADS)
+
+    Returns:
+        The prepared model
+    """
+    channels_last = DEFAULT_CHANNELS_LAST if channels_last is None else channels_last
+    threads = set_inference_threads(threads)
+
+    model.eval()
+    folded = fold_batchnorm(model) if fold_bn else 0
+
+    model.to(device)
+    if channels_last:
+        model.to(memory_format=torch.channels_last)
+
+    print(f"✅ Model prepared for serving (BatchNorm folded: {folded}, "
+          f"channels_last: {channels_last}, threads: {threads})")
+    return model
+
+def _latency_ms(model, inputs, context, warmup=5, iterations=30):
+    with context():
+        for _ in range(warmup):
+            model(inputs)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model(inputs)
+    return (time.perf_counter() - start) / iterations * 1000
+
+def benchmark_preparation(model, batch_sizes=(1, 8), input_size=224, threads=None):
+    """
+    Latency of the unprepared model under no_grad versus the prepared model
+    under inference_mode
+
+    Args:
+        model: FP32 model in eval mode (prepared in place after the baseline run)
+        batch_sizes: Batch sizes to time
+        input_size: Square model input size
+        threads: Intra-op threads for both runs
+
+    Returns:
+        Dictionary with latency per batch size and the maximum logit difference
+    """
+    set_inference_threads(threads)
+    model.eval()
+
+    inputs = {bs: torch.randn(bs, 3, input_size, input_size) for bs in batch_sizes}
+    with torch.no_grad():
+        reference = model(inputs[batch_sizes[0]])
+    before = {bs: _latency_ms(model, x, torch.no_grad) for bs, x in inputs.items()}
+
+    prepare_for_serving(model, threads=threads)
+    channels_last_inputs = {bs: x.contiguous(memory_format=torch.channels_last) for bs, x in inputs.items()}
+    with torch.inference_mode():
+        prepared = model(channels_last_inputs[batch_sizes[0]])
+    after = {bs: _latency_ms(model, x, torch.inference_mode) for bs, x in channels_last_inputs.items()}
+
+    return {
+        'threads': torch.get_num_threads(),
+        'max_abs_diff': round(float((reference - prepared).abs().max()), 6),
+        'latency_ms': {
+            str(bs): {
+                'before': round(before[bs], 2),
+                'after': round(after[bs], 2),
+                'speedup': round(before[bs] / after[bs], 2) if after[bs] > 0 else None
+            }
+            for bs in batch_sizes
+        }
+    }
+
+def main():
+    import argparse
+    import json
+
+    from .quantize import MODEL_TYPES, load_fp32_model
+
+    parser = argparse.ArgumentParser(description='Report latency before/after serving preparation')
+    parser.add_argument('--checkpoint', action='append', required=True,
+                        help='FP32 checkpoint (repeat together with --model-type for several models)')
+    parser.add_argument('--model-type', action='append', choices=MODEL_TYPES, required=True,
+                        help='Model architecture for each --checkpoint')
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads')
+    parser.add_argument('--output', default='outputs/serving_prep_report.json', help='Report file')
+
+    args = parser.parse_args()
+    if len(args.checkpoint) != len(args.model_type):
+        parser.error('Give one --model-type per --checkpoint')
+
+    report = {'models': {}, 'timestamp': datetime.now().isoformat()}
+    for checkpoint_path, model_type in zip(args.checkpoint, args.model_type):
+        model, _ = load_fp32_model(checkpoint_path, model_type)
+        result = benchmark_preparation(model, threads=args.threads)
+        report['models'][model_type] = {'checkpoint': checkpoint_path, **result}
+
+        print(f"\n{model_type} ({checkpoint_path}) - max |diff| {result['max_abs_diff']:.2e}")
+        for bs, r in result['latency_ms'].items():
+            print(f"  batch {bs}: {r['before']:.2f}ms -> {r['after']:.2f}ms ({r['speedup']}x)")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nServing preparation report saved: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Tiled inference over high-resolution field photos
+Splits a large image into overlapping model-sized tiles, classifies them in
+batched forward passes through the shared inference engine and reduces the
+tile predictions to a coarse disease-probability grid and one verdict
+"""
+
+import io
+import os
+import math
+import time
+import asyncio
+
+import torch
+from PIL import Image
+
+from .image_decode import decode_image, InvalidImage, BILINEAR
+from .batch_predict import get_decode_pool
+
+# Defaults, overridable through the environment
+TILE_SIZE = int(os.getenv('TILE_SIZE', '224'))
+TILE_OVERLAP = float(os.getenv('TILE_OVERLAP', '0.25'))
+# Tile budget per image: larger photos are downscaled until their grid fits
+TILE_MAX_TILES = int(os.getenv('TILE_MAX_TILES', '64'))
+TILE_BATCH_SIZE = int(os.getenv('TILE_BATCH_SIZE', '32'))
+# A tile counts as diseased at this disease probability (1 - healthy classes)
+TILE_DISEASE_THRESHOLD = float(os.getenv('TILE_DISEASE_THRESHOLD', '0.5'))
+# Share of diseased tiles needed for a disease verdict (at least one tile)
+TILE_MIN_DISEASED_FRACTION = float(os.getenv('TILE_MIN_DISEASED_FRACTION', '0.05'))
+
+def _spread(length, tile_size, count):
+    """count tile offsets spread evenly so the first and last touch the edges"""
+    if count <= 1:
+        return [max(length - tile_size, 0) // 2]
+    return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+def _positions(length, tile_size, stride):
+    if length <= tile_size:
+        return [0]
+    return _spread(length, tile_size, math.ceil((length - tile_size) / stride) + 1)
+
+def plan_tiles(width, height, tile_size=None, overlap=None, max_tiles=None):
+    """
+    Working resolution and tile offsets for an image
+
+    The image is used at full resolution when its grid fits the budget and
+    scaled down (never below one tile on the short side) until it does. Very
+    elongated images that still do not fit get fewer, less overlapping tiles
+    along the long side.
+
+    Returns:
+        Tuple of (scale, (working width, working height), x offsets, y offsets)
+    """
+    tile_size = tile_size or TILE_SIZE
+    overlap = TILE_OVERLAP if overlap is None else overlap
+    max_tiles = max(1, max_tiles or TILE_MAX_TILES)
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    min_scale = tile_size / min(width, height)
+    scale = max(1.0, min_scale)
+    while True:
+        size = (max(tile_size, round(width * scale)), max(tile_size, round(height * scale)))
+        xs, ys = _positions(size[0], tile_size, stride), _positions(size[1], tile_size, stride)
+        if len(xs) * len(ys) <= max_tiles or scale <= min_scale:
+            break
+        scale = max(scale * 0.85, min_scale)
+
+    if len(xs) * len(ys) > max_tiles:
+        if len(xs) >= len(ys):
+            xs = _spread(size[0], tile_size, max(1, max_tiles // len(ys)))
+        else:
+            ys = _spread(size[1], tile_size, max(1, max_tiles // len(xs)))
+    return scale, size, xs, ys
+
+def prepare_tiles(image_bytes, preprocess, tile_size=None, overlap=None, max_tiles=None):
+    """
+    Decode an upload at the planned working resolution and cut its tiles
+
+    Args:
+        image_bytes: Encoded image
+        preprocess: Engine preprocessing (PIL tile -> (C, H, W) tensor)
+
+    Returns:
+        Tuple of (stacked tiles (N, C, H, W), plan dict)
+
+    Raises:
+        ImageTooLarge, InvalidImage: As decode_image
+    """
+    tile_size = tile_size or TILE_SIZE
+    try:
+        # Header only: the size is known before any pixel data is decoded
+        original_size = Image.open(io.BytesIO(image_bytes)).size
+    except Exception as e:
+        raise InvalidImage(f"Could not decode image: {e}")
+
+    scale, size, xs, ys = plan_tiles(*original_size, tile_size, overlap, max_tiles)
+
+    # JPEG draft decoding stops at the working resolution instead of the full photo
+    image = decode_image(image_bytes, target_size=min(size))
+    if image.size != size:
+        image = image.resize(size, BILINEAR)
+
+    tiles = torch.stack([
+        preprocess(image.crop((x, y, x + tile_size, y + tile_size)))
+        for y in ys for x in xs
+    ])
+    plan = {
+        'original_size': list(original_size),
+        'working_size': list(size),
+        'scale': round(scale, 4),
+        'tile_size': tile_size,
+        'rows': len(ys),
+        'cols': len(xs)
+    }
+    return tiles, plan
+
+def aggregate_tiles(predictions, class_names, rows, cols, threshold=None, min_fraction=None):
+    """
+    Reduce tile predictions to a disease grid and a verdict
+
+    Args:
+        predictions: Engine prediction dicts in row-major tile order
+        class_names: Engine class names ('healthy' in the name marks healthy classes)
+
+    Returns:
+        Dictionary with the verdict (predicted_class, confidence, diseased),
+        the diseased-tile share, top classes and the per-tile grids
+    """
+    threshold = TILE_DISEASE_THRESHOLD if threshold is None else threshold
+    min_fraction = TILE_MIN_DISEASED_FRACTION if min_fraction is None else min_fraction
+
+    probabilities = torch.tensor([p['probabilities'] for p in predictions])
+    healthy = torch.tensor(['healthy' in name.lower() for name in class_names[:probabilities.shape[1]]])
+    disease_probability = 1 - probabilities[:, healthy].sum(dim=1)
+    diseased_tiles = disease_probability >= threshold
+    diseased_fraction = float(diseased_tiles.float().mean())
+
+    # Disease classes are ranked over the diseased tiles only, so a few
+    # lesion tiles are not averaged away by the healthy rest of the frame
+    diseased = bool(diseased_tiles.any()) and diseased_fraction >= min_fraction and bool((~healthy).any())
+    if diseased:
+        scores = probabilities[diseased_tiles].mean(dim=0).masked_fill(healthy, 0)
+    elif healthy.any():
+        scores = probabilities.mean(dim=0).masked_fill(~healthy, 0)
+    else:
+        scores = probabilities.mean(dim=0)
+
+    top_scores, top_indices = torch.topk(scores, min(3, len(scores)))
+    index = int(top_indices[0])
+    return {
+        'predicted_class': class_names[index],
+        'confidence': float(top_scores[0]),
+        'diseased': diseased,
+        'diseased_tile_fraction': round(diseased_fraction, 4),
+        'top_classes': [
+            {'class_name': class_names[int(i)], 'score': round(float(s), 4)}
+            for s, i in zip(top_scores, top_indices)
+        ],
+        'grid': {
+            'rows': rows,
+            'cols': cols,
+            'disease_probability': [
+                [round(float(v), 4) for v in row] for row in disease_probability.view(rows, cols)
+            ],
+            'top_class': [
+                [predictions[r * cols + c]['class_name'] for c in range(cols)] for r in range(rows)
+            ]
+        }
+    }
+
+async def predict_tiles(image_bytes, engine, max_tiles=None, overlap=None, batch_size=None):
+    """
+    Tiled prediction for one upload through the shared inference engine
+
+    Args:
+        image_bytes: Encoded image
+        engine: InferenceEngine, CascadeEngine or CachedEngine
+        max_tiles: Tile budget (capped at env TILE_MAX_TILES)
+        overlap: Fraction of a tile shared with its neighbour (env TILE_OVERLAP)
+        batch_size: Tiles per forward pass (env TILE_BATCH_SIZE)
+
+    Returns:
+        aggregate_tiles result plus the tiling plan and timings
+    """
+    max_tiles = min(max_tiles or TILE_MAX_TILES, TILE_MAX_TILES)
+    batch_size = max(1, batch_size or TILE_BATCH_SIZE)
+    loop = asyncio.get_running_loop()
+
+    start = time.perf_counter()
+    tiles, plan = await loop.run_in_executor(
+        get_decode_pool(), prepare_tiles, image_bytes, engine.preprocess, None, overlap, max_tiles
+    )
+    prepare_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    predictions = []
+    for offset in range(0, len(tiles), batch_size):
+        predictions.extend(await loop.run_in_executor(
+            None, engine.predict_tensor_batch, tiles[offset:offset + batch_size]
+        ))
+    inference_ms = (time.perf_counter() - start) * 1000
+
+    result = aggregate_tiles(predictions, engine.class_names, plan['rows'], plan['cols'])
+    result['tiling'] = {**plan, 'tiles': len(predictions), 'tile_budget': max_tiles}
+    result['timing_ms'] = {'decode_and_tile': round(prepare_ms, 1), 'inference': round(inference_ms, 1)}
+    return result
@@ -14,18 +14,25 @@ import matplotlib.pyplot as plt
 from sklearn.metrics import classification_report, confusion_matrix
 import numpy as np
 
-from dataset import create_data_loaders, get_class_weights
-from model import create_model, ModelCheckpoint, get_model_summary
+from .dataset import create_data_loaders, get_class_weights
+from .model import create_model, ModelCheckpoint, get_model_summary
 
 class Trainer:
     """Training class for crop disease detection model"""
     
-    def __init__(self, model, train_loader, val_loader, class_names, device='cpu'):
+    def __init__(self, model, train_loader, val_loader, class_names, device='cpu',
+                 exit_loss_weights=(0.3, 0.3, 1.0)):
+        """
+        Args:
+            exit_loss_weights: Loss weights for the layer2, layer3 and final exits
+                when the model has early-exit heads
+        """
         self.model = model
         self.train_loader = train_loader
         self.val_loader = val_loader
         self.class_names = class_names
         self.device = device
+        self.exit_loss_weights = exit_loss_weights
         
         # Training history
         self.history = {
@@ -36,6 +43,23 @@ class Trainer:
             'lr': []
         }
         
+    def compute_loss(self, inputs, labels, criterion):
+        """
+        Forward pass and loss; models with early-exit heads get the weighted
+        sum of every exit's loss
+        
+        Returns:
+            Tuple of (final classifier outputs, loss)
+        """
+        if not getattr(self.model, 'early_exits', False):
+            outputs = self.model(inputs)
+            return outputs, criterion(outputs, labels)
+        
+        exit_outputs = self.model.forward_exits(inputs)
+        loss = sum(weight * criterion(output, labels)
+                   for weight, output in zip(self.exit_loss_weights, exit_outputs))
+        return exit_outputs[-1], loss
+    
     def train_epoch(self, criterion, optimizer):
         """Train for one epoch"""
         self.model.train()
@@ -51,9 +75,8 @@ class Trainer:
             optimizer.zero_grad()
             
             # Forward pass
-            outputs = self.model(inputs)
+            outputs, loss = self.compute_loss(inputs, labels, criterion)
             _, preds = torch.max(outputs, 1)
-            loss = criterion(outputs, labels)
             
             # Backward pass
             loss.backward()
@@ -82,9 +105,8 @@ class Trainer:
                 labels = labels.to(self.device)
                 
                 # Forward pass
-                outputs = self.model(inputs)
+                outputs, loss = self.compute_loss(inputs, labels, criterion)
                 _, preds = torch.max(outputs, 1)
-                loss = criterion(outputs, labels)
                 
                 # Statistics
                 running_loss += loss.item() * inputs.size(0)
@@ -277,7 +299,8 @@ def main():
         'learning_rate': 1e-4,
         'weight_decay': 1e-4,
         'fine_tune_epoch': 10,
-        'checkpoint_path': 'models/crop_disease_resnet50.pth'
+        'checkpoint_path': 'models/crop_disease_resnet50.pth',
+        'early_exits': False  # Jointly train auxiliary heads after layer2/layer3
     }
     
     # Device setup
@@ -300,7 +323,7 @@ def main():
     
     # Create model
     print("Creating model...")
-    model = create_model(num_classes=len(class_names), device=device)
+    model = create_model(num_classes=len(class_names), device=device, early_exits=config['early_exits'])
     get_model_summary(model)
     
     # Create trainer
@@ -0,0 +1,27 @@
+"""
+Shared test setup for the crop disease detection package
+Run from the Agri Doctor directory: python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def tiny_model():
+    """Untrained TinyDiseaseClassifier in eval mode with non-trivial BatchNorm statistics"""
+    torch = pytest.importorskip('torch')
+    from src.model_lite import TinyDiseaseClassifier
+
+    torch.manual_seed(0)
+    model = TinyDiseaseClassifier(num_classes=5)
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.2, 0.2)
+    return model.eval()
@@ -0,0 +1,40 @@
+"""Cascade threshold calibration"""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from src.cascade import calibrate_threshold, cascade_unusable_reason
+
+def _outputs(confidences, predictions, labels, seconds_per_image):
+    return (torch.tensor(confidences), torch.tensor(predictions), torch.tensor(labels), seconds_per_image)
+
+def test_lowest_threshold_within_accuracy_target():
+    labels = [0, 1, 2, 3]
+    tiny = _outputs([0.9, 0.8, 0.6, 0.5], [0, 1, 9, 9], labels, 0.001)
+    full = _outputs([1.0] * 4, labels, labels, 0.010)
+
+    report = calibrate_threshold(tiny, full, max_accuracy_drop=0.01)
+
+    # Below 0.8 the wrong tiny answers at 0.6 / 0.5 would be accepted
+    assert report['threshold'] == pytest.approx(0.8)
+    assert report['escalation_rate'] == pytest.approx(0.5)
+    assert report['accuracy']['cascade'] == pytest.approx(1.0)
+    assert report['latency_saving'] == pytest.approx(0.4)
+    assert cascade_unusable_reason(report) is None
+
+def test_unreachable_target_is_not_served():
+    labels = [0, 1, 2, 3]
+    tiny = _outputs([0.99] * 4, [5, 5, 5, 5], labels, 0.001)
+    full = _outputs([1.0] * 4, labels, labels, 0.010)
+
+    report = calibrate_threshold(tiny, full)
+
+    assert report['threshold'] > 1
+    assert report['escalation_rate'] == pytest.approx(1.0)
+    assert cascade_unusable_reason(report) is not None
+
+def test_no_latency_saving_is_not_served():
+    report = {'threshold': 0.7, 'latency_saving': -0.05, 'max_accuracy_drop': 0.01}
+
+    assert cascade_unusable_reason(report) is not None
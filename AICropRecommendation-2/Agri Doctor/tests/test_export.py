@@ -0,0 +1,39 @@
+"""Parity of exported TorchScript and ONNX models with eager PyTorch"""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('torchvision')
+
+from src.export import export_torchscript, export_onnx, OnnxRuntimeModel, check_parity
+
+INPUT_SIZE = 64
+
+def _inputs():
+    torch.manual_seed(1)
+    return [torch.randn(4, 3, INPUT_SIZE, INPUT_SIZE) for _ in range(2)]
+
+def test_torchscript_export_matches_eager(tiny_model, tmp_path):
+    scripted = export_torchscript(tiny_model, str(tmp_path / 'tiny_torchscript.pt'), input_size=INPUT_SIZE)
+
+    report = check_parity(tiny_model, scripted, _inputs())
+
+    assert report['samples'] == 8
+    assert report['passed'], report
+
+def test_onnx_export_matches_eager(tiny_model, tmp_path):
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    path = str(tmp_path / 'tiny.onnx')
+    export_onnx(tiny_model, path, input_size=INPUT_SIZE)
+
+    report = check_parity(tiny_model, OnnxRuntimeModel(path), _inputs())
+
+    assert report['passed'], report
+
+def test_check_parity_flags_a_different_model(tiny_model):
+    other = type(tiny_model)(num_classes=5).eval()
+
+    report = check_parity(tiny_model, other, _inputs())
+
+    assert not report['passed']
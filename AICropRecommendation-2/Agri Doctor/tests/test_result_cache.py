@@ -0,0 +1,90 @@
+"""Result cache LRU, near-duplicate and model version scoping"""
+
+import pytest
+
+pytest.importorskip('PIL')
+
+from src.result_cache import ResultCache, _DiskTier, content_hash
+
+def _keys(name, phash=None):
+    return content_hash(name.encode()), phash
+
+def test_lru_evicts_least_recently_used():
+    cache = ResultCache('v1', max_entries=2, max_distance=-1, db_path='')
+    cache.put(_keys('a'), {'class_name': 'a'}, 10.0)
+    cache.put(_keys('b'), {'class_name': 'b'}, 10.0)
+
+    # Touch 'a' so 'b' is the oldest when 'c' arrives
+    assert cache.get(_keys('a')) == ({'class_name': 'a'}, 'exact')
+    cache.put(_keys('c'), {'class_name': 'c'}, 10.0)
+
+    assert cache.get(_keys('b')) == (None, None)
+    assert cache.get(_keys('a'))[1] == 'exact'
+    assert cache.get(_keys('c'))[1] == 'exact'
+    assert cache.metrics()['evictions'] == 1
+
+def test_returned_predictions_are_copies():
+    cache = ResultCache('v1', max_entries=4, max_distance=-1, db_path='')
+    cache.put(_keys('a'), {'class_name': 'a'}, 10.0)
+
+    cache.get(_keys('a'))[0]['class_name'] = 'changed'
+
+    assert cache.get(_keys('a'))[0] == {'class_name': 'a'}
+
+def test_near_duplicates_only_within_enabled_distance():
+    stored = 0b1011_0000
+    disabled = ResultCache('v1', max_entries=4, max_distance=-1, db_path='')
+    enabled = ResultCache('v1', max_entries=4, max_distance=2, db_path='')
+    for cache in (disabled, enabled):
+        cache.put(_keys('a', stored), {'class_name': 'a'}, 10.0)
+
+    assert disabled.get(_keys('b', stored ^ 0b11)) == (None, None)
+    assert enabled.get(_keys('b', stored ^ 0b11)) == ({'class_name': 'a'}, 'near')
+    assert enabled.get(_keys('c', stored ^ 0b111)) == (None, None)
+
+def test_disk_tier_is_scoped_to_model_version(tmp_path):
+    db_path = str(tmp_path / 'results.db')
+    first = ResultCache('v1', max_entries=4, max_distance=-1, db_path=db_path)
+    first.put(_keys('a'), {'class_name': 'a'}, 10.0)
+
+    # Another worker of the same version reads it from disk
+    same = ResultCache('v1', max_entries=4, max_distance=-1, db_path=db_path)
+    assert same.get(_keys('a')) == ({'class_name': 'a'}, 'disk')
+
+    # A different model version never sees the old results
+    newer = ResultCache('v2', max_entries=4, max_distance=-1, db_path=db_path)
+    assert newer.get(_keys('a')) == (None, None)
+    for cache in (first, same, newer):
+        cache.close()
+
+def test_versions_sharing_a_file_keep_their_entries(tmp_path):
+    db_path = str(tmp_path / 'results.db')
+    resnet = ResultCache('resnet:v1', max_entries=4, max_distance=-1, db_path=db_path)
+    resnet.put(_keys('a'), {'class_name': 'resnet'}, 10.0)
+    lite = ResultCache('lite:v1', max_entries=4, max_distance=-1, db_path=db_path)
+    lite.put(_keys('a'), {'class_name': 'lite'}, 10.0)
+    resnet.close()
+    lite.close()
+
+    # Restarting either app finds its own result still on disk
+    for version, name in (('resnet:v1', 'resnet'), ('lite:v1', 'lite')):
+        reopened = ResultCache(version, max_entries=4, max_distance=-1, db_path=db_path)
+        assert reopened.get(_keys('a')) == ({'class_name': name}, 'disk')
+        reopened.close()
+
+def test_disk_tier_prunes_by_age_and_row_count(tmp_path):
+    db_path = str(tmp_path / 'results.db')
+    tier = _DiskTier(db_path, 'v1', max_rows=2, max_age_s=0)
+    for i, name in enumerate('abc'):
+        tier.put(content_hash(name.encode()), None, {'class_name': name}, 10.0)
+        tier._conn.execute('UPDATE results SET created = ? WHERE sha = ?', (i, content_hash(name.encode())))
+    tier._conn.commit()
+
+    tier.prune()
+    assert tier.get(content_hash(b'a')) is None
+    assert tier.get(content_hash(b'c')) is not None
+
+    tier.max_rows, tier.max_age_s = 0, 60
+    tier.prune()
+    assert tier._conn.execute('SELECT COUNT(*) FROM results').fetchone()[0] == 0
+    tier.close()
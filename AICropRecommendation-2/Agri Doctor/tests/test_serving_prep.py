@@ -0,0 +1,53 @@
+"""BatchNorm folding keeps model outputs unchanged"""
+
+import copy
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from src.serving_prep import fold_batchnorm
+
+def _randomize_batchnorm(model):
+    for module in model.modules():
+        if isinstance(module, (torch.nn.BatchNorm1d, torch.nn.BatchNorm2d)):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.2, 0.2)
+    return model.eval()
+
+def test_fold_tiny_classifier_matches_unfolded(tiny_model):
+    reference = copy.deepcopy(tiny_model)
+    inputs = torch.randn(4, 3, 64, 64)
+
+    folded = fold_batchnorm(tiny_model)
+
+    assert folded == 3
+    assert not any(isinstance(m, torch.nn.BatchNorm2d) for m in tiny_model.modules())
+    with torch.no_grad():
+        assert torch.allclose(tiny_model(inputs), reference(inputs), atol=1e-4)
+
+def test_fold_resnet50_bottlenecks_matches_unfolded():
+    torchvision = pytest.importorskip('torchvision')
+    torch.manual_seed(0)
+    model = _randomize_batchnorm(torchvision.models.resnet50(weights=None))
+    reference = copy.deepcopy(model)
+    inputs = torch.randn(2, 3, 64, 64)
+
+    folded = fold_batchnorm(model)
+
+    # Stem, 16 Bottlenecks x 3 and 4 downsample branches
+    assert folded == 1 + 16 * 3 + 4
+    with torch.no_grad():
+        assert torch.allclose(model(inputs), reference(inputs), rtol=1e-3, atol=1e-3)
+
+def test_fold_leaves_conv_relu_bn_order_alone():
+    model = torch.nn.Sequential(
+        torch.nn.Conv2d(3, 8, 3, padding=1),
+        torch.nn.ReLU(),
+        torch.nn.BatchNorm2d(8)
+    ).eval()
+
+    assert fold_batchnorm(model) == 0
+    assert isinstance(model[2], torch.nn.BatchNorm2d)
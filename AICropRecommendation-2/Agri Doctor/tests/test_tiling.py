@@ -0,0 +1,63 @@
+"""Tile planning and tile aggregation"""
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('PIL')
+
+from src.tiling import plan_tiles, aggregate_tiles
+
+CLASS_NAMES = ['Tomato___Early_blight', 'Tomato___Late_blight', 'Tomato___healthy']
+HEALTHY = [0.02, 0.03, 0.95]
+EARLY_BLIGHT = [0.85, 0.10, 0.05]
+
+def _check_offsets(offsets, length, tile_size):
+    assert offsets[0] == 0
+    assert offsets[-1] == length - tile_size
+    assert offsets == sorted(offsets)
+
+@pytest.mark.parametrize('width,height', [(1000, 750), (4000, 3000), (6000, 800), (300, 5000)])
+def test_plan_covers_image_within_budget(width, height):
+    scale, (w, h), xs, ys = plan_tiles(width, height, tile_size=224, overlap=0.25, max_tiles=64)
+
+    assert len(xs) * len(ys) <= 64
+    assert min(w, h) >= 224
+    _check_offsets(xs, w, 224)
+    _check_offsets(ys, h, 224)
+    # Neighbouring tiles never leave a gap
+    assert all(b - a <= 224 for a, b in zip(xs, xs[1:]))
+    assert all(b - a <= 224 for a, b in zip(ys, ys[1:]))
+
+def test_plan_keeps_full_resolution_when_it_fits():
+    scale, size, xs, ys = plan_tiles(448, 448, tile_size=224, overlap=0.0, max_tiles=64)
+
+    assert scale == 1.0
+    assert size == (448, 448)
+    assert (xs, ys) == ([0, 224], [0, 224])
+
+def test_plan_upscales_images_smaller_than_a_tile():
+    scale, size, xs, ys = plan_tiles(112, 300, tile_size=224, overlap=0.25, max_tiles=64)
+
+    assert scale == pytest.approx(2.0)
+    assert size[0] == 224
+    assert xs == [0]
+
+def _predictions(rows):
+    return [{'probabilities': p, 'class_name': CLASS_NAMES[max(range(3), key=p.__getitem__)]} for p in rows]
+
+def test_one_lesion_tile_gives_a_disease_verdict():
+    result = aggregate_tiles(_predictions([HEALTHY, HEALTHY, EARLY_BLIGHT, HEALTHY]), CLASS_NAMES,
+                             rows=2, cols=2, threshold=0.5, min_fraction=0.05)
+
+    assert result['diseased']
+    assert result['predicted_class'] == 'Tomato___Early_blight'
+    assert result['diseased_tile_fraction'] == pytest.approx(0.25)
+    assert result['grid']['disease_probability'][1][0] == pytest.approx(0.95)
+    assert result['grid']['top_class'][1][0] == 'Tomato___Early_blight'
+
+def test_too_few_lesion_tiles_stay_healthy():
+    result = aggregate_tiles(_predictions([HEALTHY, HEALTHY, EARLY_BLIGHT, HEALTHY]), CLASS_NAMES,
+                             rows=2, cols=2, threshold=0.5, min_fraction=0.5)
+
+    assert not result['diseased']
+    assert result['predicted_class'] == 'Tomato___healthy'
@@ -5,10 +5,13 @@ Provides REST API interface for the AI prediction system
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Tuple, Dict, Any
 import sys
 import os
+import json
 from datetime import datetime
 import traceback
 import logging
@@ -18,7 +21,8 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 # Import prediction functions
 try:
-    from src.predict import predict_from_dict, load_all_models
+    from src.predict import predict_from_dict, predict_stages, load_all_models
+    from src.counterfactual import find_counterfactual
     MODELS_LOADED = True
     print("✅ Successfully imported prediction modules")
 except ImportError as e:
@@ -34,6 +38,9 @@ except ImportError as e:
     DATABASE_AVAILABLE = False
     print(f"❌ Failed to import database manager: {e}")
 
+# Models loaded once at startup and shared by the endpoints
+crop_models = {}
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -64,7 +71,7 @@ class PredictionRequest(BaseModel):
     temperature: float = Field(..., ge=-10, le=60, description="Temperature (°C)")
     humidity: float = Field(..., ge=0, le=100, description="Humidity (%)")
     ph: float = Field(..., ge=0, le=14, description="Soil pH level")
-    rainfall: float = Field(..., ge=0, le=10000, description="Rainfall (mm)")
+    rainfall: Optional[float] = Field(default=None, ge=0, le=10000, description="Rainfall (mm); filled from climate normals when omitted")
     
     # Farm details
     area_ha: float = Field(..., ge=0.01, le=10000, description="Farm area (hectares)")
@@ -114,18 +121,37 @@ class PredictionResponse(BaseModel):
     season_analysis: Optional[SeasonAnalysis] = None
     fertilizer_recommendation: Optional[FertilizerRecommendation] = None
     why: Optional[List[str]] = None
+    climate_context: Optional[Dict[str, Any]] = None
     model_version: str
     timestamp: str
     recommendation_id: Optional[str] = None
     saved_to_database: bool = False
 
+class CounterfactualRequest(BaseModel):
+    # Current soil and climate conditions
+    N: float = Field(..., ge=0, le=300, description="Nitrogen content (kg/ha)")
+    P: float = Field(..., ge=0, le=200, description="Phosphorus content (kg/ha)")
+    K: float = Field(..., ge=0, le=300, description="Potassium content (kg/ha)")
+    temperature: float = Field(..., ge=-10, le=60, description="Temperature (°C)")
+    humidity: float = Field(..., ge=0, le=100, description="Humidity (%)")
+    ph: float = Field(..., ge=0, le=14, description="Soil pH level")
+    rainfall: Optional[float] = Field(default=None, ge=0, le=10000, description="Rainfall (mm); filled from climate normals when omitted")
+    area_ha: float = Field(default=1.0, ge=0.01, le=10000, description="Farm area (hectares)")
+    region: str = Field(default="default", description="Geographical region")
+    season: Optional[str] = Field(default="", description="Growing season")
+    location_lat: Optional[float] = Field(default=None, description="Farm latitude")
+    location_lng: Optional[float] = Field(default=None, description="Farm longitude")
+    
+    # Crop the farmer wants to grow
+    target_crop: str = Field(..., description="Target crop to make recommended")
+
 # Initialize models and database on startup
 @app.on_event("startup")
 async def startup_event():
     """Load AI models and initialize database on server startup"""
     if MODELS_LOADED:
         try:
-            load_all_models()
+            crop_models.update(load_all_models())
             logger.info("✅ AI models loaded successfully")
         except Exception as e:
             logger.error(f"❌ Failed to load AI models: {e}")
@@ -161,6 +187,67 @@ async def health_check():
         "timestamp": datetime.now().isoformat()
     }
 
+def request_to_input(request: PredictionRequest) -> Dict[str, Any]:
+    """Convert a prediction request to the predict_from_dict input schema"""
+    return {
+        "N": request.N,
+        "P": request.P,
+        "K": request.K,
+        "temperature": request.temperature,
+        "humidity": request.humidity,
+        "ph": request.ph,
+        "rainfall": request.rainfall,
+        "area_ha": request.area_ha,
+        "region": request.region,
+        "previous_crop": request.previous_crop,
+        "season": request.season,
+        "planting_date": request.planting_date,
+        "location_lat": request.location_lat,
+        "location_lng": request.location_lng
+    }
+
+def _json_default(value):
+    """Serialise numpy scalars/arrays in streamed payloads"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+def save_recommendation(request: PredictionRequest, input_data: Dict[str, Any], result: Dict[str, Any]) -> Optional[str]:
+    """
+    Save a prediction to the database when the request asks for it
+    
+    Returns:
+        The recommendation ID, or None when not requested or the save failed
+    """
+    if not (request.save_to_database and request.user_id and DATABASE_AVAILABLE):
+        return None
+    try:
+        db_manager = get_crop_db_manager()
+        
+        # Prepare farm details
+        farm_details = {
+            'farm_name': request.farm_name,
+            'area_ha': request.area_ha
+        } if request.farm_name else None
+        
+        recommendation_id = db_manager.save_crop_recommendation(
+            user_id=request.user_id,
+            input_data=input_data,
+            prediction_result=result,
+            location_lat=request.location_lat,
+            location_lng=request.location_lng,
+            farm_details=farm_details
+        )
+        
+        if recommendation_id:
+            logger.info(f"✅ Recommendation saved to database with ID: {recommendation_id}")
+            return recommendation_id
+        logger.warning("⚠️ Failed to save recommendation to database")
+            
+    except Exception as e:
+        logger.error(f"❌ Database save error: {e}")
+    return None
+
 # Main prediction endpoint
 @app.post("/predict", response_model=PredictionResponse)
 async def predict_crop(request: PredictionRequest):
@@ -187,25 +274,12 @@ async def predict_crop(request: PredictionRequest):
             )
         
         # Convert request to dictionary format
-        input_data = {
-            "N": request.N,
-            "P": request.P,
-            "K": request.K,
-            "temperature": request.temperature,
-            "humidity": request.humidity,
-            "ph": request.ph,
-            "rainfall": request.rainfall,
-            "area_ha": request.area_ha,
-            "region": request.region,
-            "previous_crop": request.previous_crop,
-            "season": request.season,
-            "planting_date": request.planting_date
-        }
+        input_data = request_to_input(request)
         
         logger.info(f"🔄 Processing prediction request: {input_data}")
         
         # Make prediction using the AI model
-        result = predict_from_dict(input_data)
+        result = predict_from_dict(input_data, models=crop_models or None)
         
         # Check for errors in the result
         if 'error' in result:
@@ -256,37 +330,12 @@ async def predict_crop(request: PredictionRequest):
         if result.get("why"):
             response_data["why"] = [str(item) for item in result["why"]] if isinstance(result["why"], list) else [str(result["why"])]
         
-        # Save to database if requested and user_id provided
-        recommendation_id = None
-        saved_to_database = False
+        if result.get("climate_context"):
+            response_data["climate_context"] = result["climate_context"]
         
-        if request.save_to_database and request.user_id and DATABASE_AVAILABLE:
-            try:
-                db_manager = get_crop_db_manager()
-                
-                # Prepare farm details
-                farm_details = {
-                    'farm_name': request.farm_name,
-                    'area_ha': request.area_ha
-                } if request.farm_name else None
-                
-                recommendation_id = db_manager.save_crop_recommendation(
-                    user_id=request.user_id,
-                    input_data=input_data,
-                    prediction_result=result,
-                    location_lat=request.location_lat,
-                    location_lng=request.location_lng,
-                    farm_details=farm_details
-                )
-                
-                if recommendation_id:
-                    saved_to_database = True
-                    logger.info(f"✅ Recommendation saved to database with ID: {recommendation_id}")
-                else:
-                    logger.warning("⚠️ Failed to save recommendation to database")
-                    
-            except Exception as e:
-                logger.error(f"❌ Database save error: {e}")
+        # Save to database if requested and user_id provided
+        recommendation_id = save_recommendation(request, input_data, result)
+        saved_to_database = recommendation_id is not None
         
         # Add database-related fields to response
         response_data["recommendation_id"] = recommendation_id
@@ -309,6 +358,82 @@ async def predict_crop(request: PredictionRequest):
             detail=f"Internal server error during prediction: {str(e)}"
         )
 
+# Streaming prediction endpoint
+@app.post("/predict/stream")
+async def predict_crop_stream(request: PredictionRequest, format: str = "sse"):
+    """
+    Stream pipeline stages as they complete: crop, season, fertilizer, profit,
+    explanation and finally complete (the full /predict result, with
+    recommendation_id and saved_to_database as in /predict)
+    
+    format=sse sends Server-Sent Events, format=ndjson sends one JSON object per line
+    """
+    if not MODELS_LOADED:
+        raise HTTPException(status_code=503, detail="AI models not available")
+    if format not in ("sse", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'sse' or 'ndjson'")
+    
+    input_data = request_to_input(request)
+    logger.info(f"🔄 Streaming prediction request: {input_data}")
+    
+    def encode(stage: str, payload: Dict[str, Any]) -> str:
+        data = json.dumps(payload, default=_json_default)
+        if format == "sse":
+            return f"event: {stage}\ndata: {data}\n\n"
+        return json.dumps({"stage": stage, "data": payload}, default=_json_default) + "\n"
+    
+    def event_stream():
+        # Sync generator; Starlette iterates it in a worker thread so the
+        # event loop stays free while slower stages run
+        try:
+            for stage, payload in predict_stages(input_data, crop_models or None):
+                if stage == "complete":
+                    recommendation_id = save_recommendation(request, input_data, payload)
+                    payload = {
+                        **payload,
+                        "recommendation_id": recommendation_id,
+                        "saved_to_database": recommendation_id is not None
+                    }
+                yield encode(stage, payload)
+            logger.info("✅ Streaming prediction complete")
+        except Exception as e:
+            logger.error(f"❌ Streaming prediction error: {str(e)}")
+            yield encode("error", {"error": str(e)})
+    
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        event_stream(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Counterfactual soil amendment search
+@app.post("/counterfactual")
+async def counterfactual_search(request: CounterfactualRequest):
+    """
+    Find the cheapest N/P/K/pH amendment under which the target crop is recommended
+    """
+    if not MODELS_LOADED:
+        raise HTTPException(status_code=503, detail="AI models not available")
+    
+    input_data = request.dict(exclude={"target_crop"})
+    
+    try:
+        logger.info(f"🔄 Counterfactual search for {request.target_crop}: {input_data}")
+        # CPU-bound search over ~10^5 candidates: keep it off the event loop
+        result = await run_in_threadpool(find_counterfactual, input_data, request.target_crop, models=crop_models or None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Counterfactual search error: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Internal server error during counterfactual search: {str(e)}")
+    
+    if 'error' in result:
+        raise HTTPException(status_code=400, detail=result['error'])
+    
+    return result
+
 # Get model information
 @app.get("/models/info")
 async def get_model_info():
@@ -327,6 +452,10 @@ async def get_model_info():
                 "profit_estimation",
                 "previous_crop_analysis",
                 "season_detection",
+                "region_resolution",
+                "climate_normals",
+                "counterfactual_amendments",
+                "streaming_predictions",
                 "fertilizer_recommendation",
                 "database_storage",
                 "user_history",
@@ -0,0 +1,353 @@
+"""
+Climate normals module for crop AI project
+Builds monthly/seasonal rainfall normals, percentiles and SPI drought indices per
+IMD sub-division from the 1901-2017 sub-divisional rainfall dataset
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+import sys
+sys.path.append(os.path.dirname(__file__))
+from preprocess import load_raw, standardize_column_names
+from season_detection import SEASON_DEFINITIONS
+from region_resolver import SUBDIVISIONS
+
+MONTH_COLUMNS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun',
+                 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+
+# Seasons stored in the index; agricultural seasons follow the sub-division's
+# region in SEASON_DEFINITIONS
+SEASONS = ['kharif', 'rabi', 'zaid', 'annual']
+
+PERCENTILES = [10, 25, 50, 75, 90]
+
+# SPI levels for which the equivalent rainfall amount is precomputed
+SPI_LEVELS = [-2.0, -1.5, -1.0, 1.0, 1.5, 2.0]
+SPI_CATEGORIES = ['extremely_dry', 'severely_dry', 'moderately_dry', 'near_normal',
+                  'moderately_wet', 'very_wet', 'extremely_wet']
+
+NORMALS_FILE = 'climate_normals_v1.npz'
+
+SUBDIVISION_REGIONS = {name: region for name, _, _, region in SUBDIVISIONS}
+
+_normals_cache = None
+
+def _normals_path() -> str:
+    models_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'models')
+    return os.path.join(models_dir, NORMALS_FILE)
+
+def _season_months(subdivision: str, season: str) -> List[int]:
+    """Months (1-12) making up a season for the sub-division's region"""
+    if season == 'annual':
+        return list(range(1, 13))
+    region = SUBDIVISION_REGIONS.get(subdivision, 'default')
+    return SEASON_DEFINITIONS.get(region, SEASON_DEFINITIONS['default'])[season]
+
+def seasonal_totals(df: pd.DataFrame, subdivision: str, season: str) -> np.ndarray:
+    """
+    Per-year rainfall totals for one sub-division and season
+
+    Seasons that wrap the calendar year (e.g. rabi, Nov-Mar) take the
+    months before the wrap from the row of the previous year (year - 1);
+    years without that row are dropped, so gaps in the dataset never pair
+    unrelated years.
+
+    Args:
+        df: Rows of the rainfall dataset for one sub-division
+        subdivision: Sub-division name
+        season: Season name
+
+    Returns:
+        Array of seasonal totals (mm) in year order, NaN-free
+    """
+    months = _season_months(subdivision, season)
+    df = df.drop_duplicates('year').sort_values('year')
+
+    wraps = months != sorted(months)
+    if wraps:
+        # Months before the wrap (e.g. 11, 12 for rabi) belong to the previous year
+        wrap_at = next(i for i in range(1, len(months)) if months[i] < months[i - 1])
+        previous_year = [MONTH_COLUMNS[m - 1] for m in months[:wrap_at]]
+        current_year = [MONTH_COLUMNS[m - 1] for m in months[wrap_at:]]
+        previous = df[previous_year].sum(axis=1, skipna=False)
+        previous.index = df['year'].to_numpy() + 1
+        current = df[current_year].sum(axis=1, skipna=False)
+        current.index = df['year'].to_numpy()
+        totals = (previous + current).dropna().to_numpy(dtype=float)
+    else:
+        totals = df[[MONTH_COLUMNS[m - 1] for m in months]].sum(axis=1, skipna=False).to_numpy(dtype=float)
+
+    return totals[np.isfinite(totals)]
+
+def fit_spi_gamma(totals: np.ndarray) -> np.ndarray:
+    """
+    Fit the SPI gamma distribution using Thom's maximum likelihood approximation
+
+    Returns:
+        Array of (alpha, beta, probability_of_zero)
+    """
+    if len(totals) == 0:
+        return np.array([np.nan, np.nan, np.nan])
+
+    positive = totals[totals > 0]
+    q_zero = 1.0 - len(positive) / len(totals)
+    if len(positive) < 2:
+        return np.array([np.nan, np.nan, q_zero])
+
+    mean = positive.mean()
+    a = np.log(mean) - np.mean(np.log(positive))
+    if a <= 0:
+        return np.array([np.nan, np.nan, q_zero])
+
+    alpha = (1 + np.sqrt(1 + 4 * a / 3)) / (4 * a)
+    beta = mean / alpha
+    return np.array([alpha, beta, q_zero])
+
+def _spi_from_gamma(rainfall, params) -> np.ndarray:
+    """Standardised Precipitation Index of rainfall under fitted gamma params"""
+    from scipy.special import gammainc, ndtri
+
+    alpha, beta, q_zero = params[..., 0], params[..., 1], params[..., 2]
+    rainfall = np.maximum(np.asarray(rainfall, dtype=float), 0.0)
+    cumulative = q_zero + (1 - q_zero) * gammainc(alpha, rainfall / beta)
+    cumulative = np.clip(cumulative, 1e-6, 1 - 1e-6)
+    return ndtri(cumulative)
+
+def _rainfall_at_spi(params: np.ndarray) -> np.ndarray:
+    """Rainfall amounts corresponding to SPI_LEVELS under fitted gamma params"""
+    from scipy.special import gammaincinv, ndtr
+
+    alpha, beta, q_zero = params
+    thresholds = []
+    for level in SPI_LEVELS:
+        cumulative = ndtr(level)
+        if not np.isfinite(alpha) or cumulative <= q_zero:
+            thresholds.append(0.0 if np.isfinite(alpha) else np.nan)
+            continue
+        gamma_cdf = (cumulative - q_zero) / (1 - q_zero)
+        thresholds.append(float(gammaincinv(alpha, gamma_cdf) * beta))
+    return np.array(thresholds)
+
+def build_climate_normals(save: bool = True) -> Dict[str, np.ndarray]:
+    """
+    Offline build step: compute the climate normals index from the raw dataset
+
+    Args:
+        save: Write the index to models/climate_normals_v1.npz
+
+    Returns:
+        Dictionary of arrays making up the index
+    """
+    print("Building climate normals from sub-divisional rainfall data...")
+
+    datasets = load_raw()
+    if 'rainfall' not in datasets:
+        raise ValueError("Sub-divisional rainfall data not found!")
+
+    df = standardize_column_names(datasets['rainfall'].copy())
+    df['subdivision'] = df['subdivision'].astype(str).str.strip().str.upper()
+    for col in MONTH_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    subdivisions = sorted(df['subdivision'].unique())
+    n_sub, n_season = len(subdivisions), len(SEASONS)
+
+    monthly_mean = np.full((n_sub, 12), np.nan)
+    monthly_std = np.full((n_sub, 12), np.nan)
+    seasonal_mean = np.full((n_sub, n_season), np.nan)
+    seasonal_std = np.full((n_sub, n_season), np.nan)
+    seasonal_percentiles = np.full((n_sub, n_season, len(PERCENTILES)), np.nan)
+    spi_params = np.full((n_sub, n_season, 3), np.nan)
+    spi_thresholds = np.full((n_sub, n_season, len(SPI_LEVELS)), np.nan)
+
+    for i, subdivision in enumerate(subdivisions):
+        sub_df = df[df['subdivision'] == subdivision].sort_values('year')
+
+        monthly_mean[i] = sub_df[MONTH_COLUMNS].mean().to_numpy()
+        monthly_std[i] = sub_df[MONTH_COLUMNS].std().to_numpy()
+
+        for j, season in enumerate(SEASONS):
+            totals = seasonal_totals(sub_df, subdivision, season)
+            if len(totals) == 0:
+                continue
+            seasonal_mean[i, j] = totals.mean()
+            seasonal_std[i, j] = totals.std()
+            seasonal_percentiles[i, j] = np.percentile(totals, PERCENTILES)
+            spi_params[i, j] = fit_spi_gamma(totals)
+            spi_thresholds[i, j] = _rainfall_at_spi(spi_params[i, j])
+
+    index = {
+        'subdivisions': np.array(subdivisions),
+        'seasons': np.array(SEASONS),
+        'percentiles': np.array(PERCENTILES),
+        'spi_levels': np.array(SPI_LEVELS),
+        'years': np.array([int(df['year'].min()), int(df['year'].max())]),
+        'monthly_mean': monthly_mean,
+        'monthly_std': monthly_std,
+        'seasonal_mean': seasonal_mean,
+        'seasonal_std': seasonal_std,
+        'seasonal_percentiles': seasonal_percentiles,
+        'spi_params': spi_params,
+        'spi_thresholds': spi_thresholds
+    }
+
+    if save:
+        path = _normals_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path, **index)
+        print(f"Climate normals saved: {path} ({n_sub} sub-divisions)")
+
+    return index
+
+class ClimateNormals:
+    """O(1) lookups into the precomputed climate normals index"""
+
+    def __init__(self, index: Dict[str, np.ndarray]):
+        self.index = index
+        self.subdivision_rows = {str(name): i for i, name in enumerate(index['subdivisions'])}
+        self.season_columns = {str(name): j for j, name in enumerate(index['seasons'])}
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'ClimateNormals':
+        with np.load(path or _normals_path()) as data:
+            return cls({key: data[key] for key in data.files})
+
+    def _position(self, subdivision: str, season: str):
+        row = self.subdivision_rows.get(str(subdivision).strip().upper())
+        col = self.season_columns.get(str(season).strip().lower())
+        return row, col
+
+    def lookup(self, subdivision: str, season: str) -> Optional[Dict]:
+        """
+        Climate normals for one sub-division and season
+
+        Returns:
+            Dictionary of normals, or None if the sub-division/season is unknown
+        """
+        row, col = self._position(subdivision, season)
+        if row is None or col is None or not np.isfinite(self.index['seasonal_mean'][row, col]):
+            return None
+
+        percentiles = self.index['seasonal_percentiles'][row, col]
+        return {
+            'subdivision': str(self.index['subdivisions'][row]),
+            'season': str(self.index['seasons'][col]),
+            'normal_rainfall_mm': round(float(self.index['seasonal_mean'][row, col]), 1),
+            'std_rainfall_mm': round(float(self.index['seasonal_std'][row, col]), 1),
+            'percentiles_mm': {
+                f"p{int(p)}": round(float(v), 1)
+                for p, v in zip(self.index['percentiles'], percentiles)
+            },
+            'monthly_normals_mm': [round(float(v), 1) for v in self.index['monthly_mean'][row]],
+            'drought_threshold_mm': round(float(self.index['spi_thresholds'][row, col, SPI_LEVELS.index(-1.0)]), 1),
+            'period': f"{self.index['years'][0]}-{self.index['years'][1]}"
+        }
+
+    def lookup_batch(self, subdivisions, seasons) -> Dict[str, np.ndarray]:
+        """
+        Vectorised join of climate context for many rows
+
+        Args:
+            subdivisions: Array-like of sub-division names
+            seasons: Array-like of season names (same length)
+
+        Returns:
+            Dictionary of arrays (NaN where no normal is available)
+        """
+        rows = np.array([self.subdivision_rows.get(str(s).strip().upper(), -1) for s in subdivisions])
+        cols = np.array([self.season_columns.get(str(s).strip().lower(), -1) for s in seasons])
+        valid = (rows >= 0) & (cols >= 0)
+        safe_rows, safe_cols = np.where(valid, rows, 0), np.where(valid, cols, 0)
+
+        def take(array):
+            values = array[safe_rows, safe_cols].astype(float)
+            values[~valid] = np.nan
+            return values
+
+        result = {
+            'normal_rainfall_mm': take(self.index['seasonal_mean']),
+            'std_rainfall_mm': take(self.index['seasonal_std']),
+            'drought_threshold_mm': take(self.index['spi_thresholds'][:, :, SPI_LEVELS.index(-1.0)])
+        }
+        for k, p in enumerate(self.index['percentiles']):
+            result[f"p{int(p)}_mm"] = take(self.index['seasonal_percentiles'][:, :, k])
+        return result
+
+    def spi(self, subdivision: str, season: str, rainfall: float) -> Optional[float]:
+        """Standardised Precipitation Index of a seasonal rainfall amount"""
+        row, col = self._position(subdivision, season)
+        if row is None or col is None:
+            return None
+        params = self.index['spi_params'][row, col]
+        if not np.all(np.isfinite(params[:2])):
+            return None
+        return float(_spi_from_gamma(rainfall, params))
+
+    def spi_category(self, subdivision: str, season: str, rainfall: float) -> Optional[str]:
+        """Drought/wetness category from the precomputed SPI rainfall thresholds"""
+        row, col = self._position(subdivision, season)
+        if row is None or col is None:
+            return None
+        thresholds = self.index['spi_thresholds'][row, col]
+        if not np.all(np.isfinite(thresholds)):
+            return None
+        return SPI_CATEGORIES[int(np.searchsorted(thresholds, rainfall, side='right'))]
+
+    def check_rainfall(self, subdivision: str, season: str, rainfall: float) -> Optional[Dict]:
+        """
+        Sanity-check a rainfall value against the sub-division's seasonal normals
+
+        Returns:
+            Dictionary with status, SPI category and the normal, or None if unknown
+        """
+        normals = self.lookup(subdivision, season)
+        if normals is None:
+            return None
+
+        p10 = normals['percentiles_mm']['p10']
+        p90 = normals['percentiles_mm']['p90']
+        if rainfall < p10:
+            status = 'below_normal'
+        elif rainfall > p90:
+            status = 'above_normal'
+        else:
+            status = 'normal'
+
+        return {
+            'status': status,
+            'spi_category': self.spi_category(subdivision, season, rainfall),
+            'normal_rainfall_mm': normals['normal_rainfall_mm'],
+            'p10_p90_mm': [p10, p90]
+        }
+
+def get_climate_normals() -> Optional[ClimateNormals]:
+    """
+    Load the climate normals index once per process
+
+    Returns:
+        ClimateNormals instance, or None if the index has not been built
+    """
+    global _normals_cache
+
+    if _normals_cache is None:
+        path = _normals_path()
+        if not os.path.exists(path):
+            print("⚠️ Climate normals not built. Run: python src/climate_normals.py")
+            return None
+        _normals_cache = ClimateNormals.load(path)
+
+    return _normals_cache
+
+if __name__ == "__main__":
+    # Run the offline build step and show a sample lookup
+    build_climate_normals()
+
+    normals = get_climate_normals()
+    if normals is not None:
+        sample = normals.lookup('PUNJAB', 'kharif')
+        print(f"PUNJAB kharif normals: {sample}")
+        if sample:
+            print(f"Check 300mm: {normals.check_rainfall('PUNJAB', 'kharif', 300)}")
@@ -0,0 +1,313 @@
+"""
+Counterfactual soil amendment search for crop AI project
+Finds the cheapest N/P/K/pH change under which the crop model recommends a target crop,
+evaluating candidate amendments in batched predict_proba calls
+"""
+
+import os
+import json
+import numpy as np
+from typing import Dict, Any, Optional
+
+import sys
+sys.path.append(os.path.dirname(__file__))
+from predict import (validate_input_schema, load_all_models, scale_crop_features,
+                     get_crop_classes, CROP_FEATURES)
+
+# Fertilizer products used to supply each nutrient and their nutrient fraction.
+# P and K are on the oxide basis of the fertilizer grade (kg P2O5, K2O per ha).
+# DAP (18-46-0) also supplies N, which is credited against the urea requirement,
+# so an amendment adding P adds at least that much N.
+NUTRIENT_SOURCES = {
+    'N': {'fertilizer': 'Urea', 'nutrient_fraction': 0.46, 'default_cost_per_kg': 15},
+    'P': {'fertilizer': 'DAP', 'nutrient_fraction': 0.46, 'n_fraction': 0.18, 'default_cost_per_kg': 30},
+    'K': {'fertilizer': 'MOP', 'nutrient_fraction': 0.60, 'default_cost_per_kg': 20}
+}
+
+NUTRIENT_BASIS = {
+    'N': 'kg N/ha, including the N supplied by DAP',
+    'P': 'kg P2O5/ha (DAP 18-46-0 grade)',
+    'K': 'kg K2O/ha (MOP 0-0-60 grade)'
+}
+
+# pH amendments: product, kg/ha needed per 1.0 pH unit change and cost per kg
+PH_AMENDMENTS = {
+    'raise': {'amendment': 'Agricultural lime', 'kg_per_ha_per_unit': 2500, 'cost_per_kg': 4},
+    'lower': {'amendment': 'Elemental sulphur', 'kg_per_ha_per_unit': 400, 'cost_per_kg': 25}
+}
+
+# Coarse search grid: nutrient additions (kg/ha) and pH changes
+COARSE_NUTRIENT_STEP = 10
+COARSE_PH_STEP = 0.25
+MAX_PH_CHANGE = 2.0
+
+# Local refinement around the best coarse candidate
+REFINE_NUTRIENT_STEP = 2
+REFINE_PH_STEP = 0.05
+
+# Upper bounds of the validated input ranges (see validate_input_schema)
+NUTRIENT_LIMITS = {'N': 200, 'P': 150, 'K': 200}
+PH_LIMITS = (3.5, 9.0)
+
+# Candidates evaluated per predict_proba call
+BATCH_SIZE = 8192
+
+def load_fertilizer_prices() -> Dict[str, float]:
+    """
+    Per-kg fertilizer prices from the fertilizer lookup table
+
+    Returns:
+        Dictionary mapping fertilizer name to cost per kg
+    """
+    prices = {source['fertilizer']: source['default_cost_per_kg'] for source in NUTRIENT_SOURCES.values()}
+
+    lookup_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'models', 'fertilizer_lookup_v1.json')
+    if os.path.exists(lookup_file):
+        try:
+            with open(lookup_file, 'r') as f:
+                lookup = json.load(f)
+            for crop_info in lookup.values():
+                for condition in crop_info.get('conditions', {}).values():
+                    prices[condition['fertilizer']] = condition['cost_per_kg']
+        except Exception as e:
+            print(f"⚠️ Could not read fertilizer prices: {e}")
+
+    return prices
+
+def dap_nitrogen(p_added: np.ndarray) -> np.ndarray:
+    """N (kg/ha) supplied by the DAP applied for a P2O5 addition"""
+    dap = NUTRIENT_SOURCES['P']
+    return p_added / dap['nutrient_fraction'] * dap['n_fraction']
+
+def with_dap_nitrogen(deltas: np.ndarray) -> np.ndarray:
+    """Raise each N addition to at least the N its DAP supplies"""
+    deltas = np.array(deltas, dtype=float)
+    deltas[:, 0] = np.maximum(deltas[:, 0], dap_nitrogen(deltas[:, 1]))
+    return deltas
+
+def product_amounts(deltas: np.ndarray) -> np.ndarray:
+    """
+    Fertilizer product needed for N, P, K additions
+
+    Args:
+        deltas: Array of shape (n, 3+) with N, P, K additions (kg/ha)
+
+    Returns:
+        Array of shape (n, 3) with Urea, DAP and MOP (kg/ha); urea only covers
+        the N not already supplied by DAP
+    """
+    dap = deltas[:, 1] / NUTRIENT_SOURCES['P']['nutrient_fraction']
+    urea = np.maximum(deltas[:, 0] - dap_nitrogen(deltas[:, 1]), 0) / NUTRIENT_SOURCES['N']['nutrient_fraction']
+    mop = deltas[:, 2] / NUTRIENT_SOURCES['K']['nutrient_fraction']
+    return np.stack([urea, dap, mop], axis=1)
+
+def amendment_costs(deltas: np.ndarray, prices: Dict[str, float]) -> np.ndarray:
+    """
+    Cost per hectare of candidate amendments
+
+    Args:
+        deltas: Array of shape (n, 4) with N, P, K additions (kg/ha) and pH change
+        prices: Fertilizer prices from load_fertilizer_prices
+
+    Returns:
+        Array of costs (Rs/ha)
+    """
+    amounts = product_amounts(deltas)
+    cost = np.zeros(len(deltas))
+    for i, nutrient in enumerate(['N', 'P', 'K']):
+        cost += amounts[:, i] * prices[NUTRIENT_SOURCES[nutrient]['fertilizer']]
+
+    ph_delta = deltas[:, 3]
+    for direction, mask in (('raise', ph_delta > 0), ('lower', ph_delta < 0)):
+        amendment = PH_AMENDMENTS[direction]
+        cost[mask] += np.abs(ph_delta[mask]) * amendment['kg_per_ha_per_unit'] * amendment['cost_per_kg']
+
+    return cost
+
+def _candidate_grid(soil: np.ndarray, nutrient_ranges, ph_range) -> np.ndarray:
+    """Cartesian product of amendment deltas, clipped to the valid input ranges"""
+    n, p, k, ph = np.meshgrid(*nutrient_ranges, ph_range, indexing='ij')
+    # N additions below what the DAP supplies collapse onto the same candidate
+    deltas = np.unique(with_dap_nitrogen(np.stack([n.ravel(), p.ravel(), k.ravel(), ph.ravel()], axis=1)), axis=0)
+
+    # Drop candidates that push inputs outside the validated ranges
+    new_values = soil + deltas
+    limits = np.array([NUTRIENT_LIMITS['N'], NUTRIENT_LIMITS['P'], NUTRIENT_LIMITS['K']])
+    valid = (
+        (deltas[:, :3] >= 0).all(axis=1) &
+        ((deltas[:, :3] == 0) | (new_values[:, :3] <= limits)).all(axis=1) &
+        ((deltas[:, 3] == 0) | ((new_values[:, 3] >= PH_LIMITS[0]) & (new_values[:, 3] <= PH_LIMITS[1])))
+    )
+    return deltas[valid]
+
+def _target_probability(base: np.ndarray, deltas: np.ndarray, models: Dict, target_idx: int):
+    """Target class probability and whether it is the argmax, for each candidate"""
+    X = np.repeat(base[None, :], len(deltas), axis=0)
+    X[:, :3] += deltas[:, :3]
+    X[:, CROP_FEATURES.index('ph')] += deltas[:, 3]
+
+    proba = models['crop_model'].predict_proba(scale_crop_features(X, models))
+    return proba[:, target_idx], np.argmax(proba, axis=1) == target_idx
+
+def _cheapest_success(base: np.ndarray, deltas: np.ndarray, costs: np.ndarray, models: Dict, target_idx: int):
+    """
+    Evaluate candidates in ascending cost order, one batch at a time, stopping at
+    the first batch that contains a success
+
+    Returns:
+        Tuple of (best delta or None, its target probability, best target probability seen, evaluated count)
+    """
+    order = np.argsort(costs, kind='stable')
+    best_probability_seen = 0.0
+    evaluated = 0
+
+    for start in range(0, len(order), BATCH_SIZE):
+        batch = order[start:start + BATCH_SIZE]
+        probability, success = _target_probability(base, deltas[batch], models, target_idx)
+        evaluated += len(batch)
+        best_probability_seen = max(best_probability_seen, float(probability.max()))
+
+        if success.any():
+            first = int(np.argmax(success))
+            return deltas[batch[first]], float(probability[first]), best_probability_seen, evaluated
+
+    return None, 0.0, best_probability_seen, evaluated
+
+def find_counterfactual(input_dict: Dict[str, Any], target_crop: str,
+                        models: Optional[Dict] = None) -> Dict[str, Any]:
+    """
+    Search for the cheapest soil amendment that makes target_crop the recommendation
+
+    Args:
+        input_dict: Prediction inputs (same schema as predict_from_dict)
+        target_crop: Crop the farmer wants to grow
+        models: Loaded models (loaded if not given)
+
+    Returns:
+        Dictionary with the amendments, their cost and the resulting confidence
+    """
+    validated_input = validate_input_schema(input_dict)
+    models = models or load_all_models()
+
+    if 'crop_model' not in models or not hasattr(models['crop_model'], 'predict_proba'):
+        return {'error': 'Crop model not available for counterfactual search'}
+
+    classes = get_crop_classes(models)
+    target_crop = target_crop.strip().lower()
+    if target_crop not in classes:
+        return {'error': f"Unknown target crop: {target_crop}", 'supported_crops': classes}
+    target_idx = classes.index(target_crop)
+
+    base = np.array([validated_input[f.lower()] for f in CROP_FEATURES], dtype=float)
+    # Controllable inputs in delta order: N, P, K, pH
+    soil = base[[CROP_FEATURES.index(f) for f in ['N', 'P', 'K', 'ph']]]
+    current_probability, current_success = _target_probability(base, np.zeros((1, 4)), models, target_idx)
+
+    area_ha = float(validated_input['area_ha'])
+    prices = load_fertilizer_prices()
+
+    result = {
+        'target_crop': target_crop,
+        'current_inputs': {'N': float(soil[0]), 'P': float(soil[1]), 'K': float(soil[2]), 'ph': float(soil[3])},
+        'current_target_probability': round(float(current_probability[0]), 3),
+        'area_ha': area_ha
+    }
+
+    if current_success[0]:
+        result.update({
+            'achievable': True,
+            'already_recommended': True,
+            'amendments': [],
+            'total_cost': 0,
+            'candidates_evaluated': 1
+        })
+        return result
+
+    # 1. Coarse vectorised grid over all controllable inputs
+    coarse = _candidate_grid(
+        soil,
+        [np.arange(0, max(NUTRIENT_LIMITS[n] - soil[i], 0) + COARSE_NUTRIENT_STEP, COARSE_NUTRIENT_STEP)
+         for i, n in enumerate(['N', 'P', 'K'])],
+        np.arange(-MAX_PH_CHANGE, MAX_PH_CHANGE + COARSE_PH_STEP / 2, COARSE_PH_STEP)
+    )
+    best, probability, best_probability_seen, evaluated = _cheapest_success(
+        base, coarse, amendment_costs(coarse, prices), models, target_idx
+    )
+
+    if best is None:
+        result.update({
+            'achievable': False,
+            'best_target_probability': round(best_probability_seen, 3),
+            'candidates_evaluated': evaluated,
+            'message': f"No N/P/K/pH amendment within range makes {target_crop} the top recommendation"
+        })
+        return result
+
+    # 2. Local refinement around the best coarse candidate
+    def local_range(center, step, coarse_step):
+        return np.round(np.arange(center - coarse_step, center + coarse_step + step / 2, step), 4)
+
+    refine = _candidate_grid(
+        soil,
+        [local_range(best[i], REFINE_NUTRIENT_STEP, COARSE_NUTRIENT_STEP) for i in range(3)],
+        local_range(best[3], REFINE_PH_STEP, COARSE_PH_STEP)
+    )
+    refined, refined_probability, _, refine_evaluated = _cheapest_success(
+        base, refine, amendment_costs(refine, prices), models, target_idx
+    )
+    evaluated += refine_evaluated
+    if refined is not None and amendment_costs(refined[None, :], prices)[0] <= amendment_costs(best[None, :], prices)[0]:
+        best, probability = refined, refined_probability
+
+    # Describe the amendments; N from DAP is reported on the P amendment
+    amendments = []
+    amounts = product_amounts(best[None, :])[0]
+    n_from_dap = float(dap_nitrogen(best[1:2])[0])
+    for i, nutrient in enumerate(['N', 'P', 'K']):
+        if amounts[i] > 0:
+            source = NUTRIENT_SOURCES[nutrient]
+            entry = {
+                'input': nutrient,
+                'change': round(float(best[i] - (n_from_dap if nutrient == 'N' else 0)), 1),
+                'product': source['fertilizer'],
+                'product_kg_per_ha': round(float(amounts[i]), 1),
+                'cost': int(amounts[i] * prices[source['fertilizer']] * area_ha)
+            }
+            if nutrient == 'P':
+                entry['also_supplies'] = {'N': round(n_from_dap, 1)}
+            amendments.append(entry)
+    if best[3] != 0:
+        amendment = PH_AMENDMENTS['raise' if best[3] > 0 else 'lower']
+        product_kg_per_ha = abs(best[3]) * amendment['kg_per_ha_per_unit']
+        amendments.append({
+            'input': 'ph',
+            'change': round(float(best[3]), 2),
+            'product': amendment['amendment'],
+            'product_kg_per_ha': round(float(product_kg_per_ha), 1),
+            'cost': int(product_kg_per_ha * amendment['cost_per_kg'] * area_ha)
+        })
+
+    result.update({
+        'achievable': True,
+        'already_recommended': False,
+        'amendments': amendments,
+        'new_inputs': {
+            'N': round(float(soil[0] + best[0]), 1),
+            'P': round(float(soil[1] + best[1]), 1),
+            'K': round(float(soil[2] + best[2]), 1),
+            'ph': round(float(soil[3] + best[3]), 2)
+        },
+        'target_probability': round(probability, 3),
+        'total_cost': int(amendment_costs(best[None, :], prices)[0] * area_ha),
+        'nutrient_basis': NUTRIENT_BASIS,
+        'candidates_evaluated': evaluated
+    })
+
+    return result
+
+if __name__ == "__main__":
+    sample_input = {
+        'N': 60, 'P': 45, 'K': 50, 'temperature': 25, 'humidity': 70,
+        'ph': 6.5, 'rainfall': 800, 'area_ha': 2.0
+    }
+    print(json.dumps(find_counterfactual(sample_input, 'cotton'), indent=2))
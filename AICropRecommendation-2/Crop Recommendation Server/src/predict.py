@@ -11,7 +11,7 @@ import joblib
 import yaml
 import argparse
 from datetime import datetime
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, Iterator
 
 # Import our modules
 import sys
@@ -75,6 +75,17 @@ except ImportError as e:
             "Consult local agronomist for final decisions"
         ]
 
+# Crop model input features in training order
+CROP_FEATURES = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+
+# Class-index to crop mapping used when no label encoder is available
+FALLBACK_CROP_NAMES = [
+    'apple', 'banana', 'blackgram', 'chickpea', 'coconut', 'coffee', 'cotton',
+    'grapes', 'jute', 'kidneybeans', 'lentil', 'maize', 'mango', 'mothbeans',
+    'mungbean', 'muskmelon', 'orange', 'papaya', 'pigeonpeas', 'pomegranate',
+    'rice', 'watermelon'
+]
+
 def load_all_models():
     """
     Load all trained models and preprocessing artifacts
@@ -207,7 +218,8 @@ def validate_input_schema(input_dict: Dict[str, Any]) -> Dict[str, Any]:
     """
     Validate and standardize enhanced input schema with previous crop and season support
     """
-    required_fields = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+    # Rainfall may be omitted and filled in from the sub-division's climate normals
+    required_fields = ['N', 'P', 'K', 'temperature', 'humidity', 'ph']
     
     # Check required fields
     for field in required_fields:
@@ -227,21 +239,36 @@ def validate_input_schema(input_dict: Dict[str, Any]) -> Dict[str, Any]:
     
     validated_input = {}
     for field, (min_val, max_val) in validations.items():
+        if field == 'rainfall' and input_dict.get('rainfall') in (None, ''):
+            continue
         value = float(input_dict[field])
         if not (min_val <= value <= max_val):
             print(f"Warning: {field} value {value} outside expected range [{min_val}, {max_val}]")
         validated_input[field.lower()] = value
     
     # Enhanced optional fields
-    optional_fields = ['area_ha', 'region', 'previous_crop', 'season', 'planting_date']
+    optional_fields = ['area_ha', 'region', 'previous_crop', 'season', 'planting_date',
+                       'location_lat', 'location_lng']
     for field in optional_fields:
-        if field in input_dict:
+        if field in input_dict and input_dict[field] not in (None, ''):
             validated_input[field] = input_dict[field]
     
     # Default values for new fields
     if 'area_ha' not in validated_input:
         validated_input['area_ha'] = 1.0
     
+    # Resolve region and sub-division from farm coordinates when available
+    validated_input['subdivision'] = ''
+    try:
+        from region_resolver import resolve_region
+        resolved = resolve_region(validated_input.get('location_lat'), validated_input.get('location_lng'))
+        if resolved:
+            validated_input['subdivision'] = resolved['subdivision']
+            if validated_input.get('region', 'default') == 'default':
+                validated_input['region'] = resolved['region']
+    except Exception as e:
+        print(f"⚠️ Region resolution failed: {e}")
+    
     if 'region' not in validated_input:
         validated_input['region'] = 'default'
     
@@ -260,6 +287,32 @@ def validate_input_schema(input_dict: Dict[str, Any]) -> Dict[str, Any]:
         except:
             validated_input['season'] = 'kharif'  # Default season
     
+    # Fill in or sanity-check rainfall against the sub-division's climate normals
+    validated_input['climate_context'] = None
+    normals = None
+    if validated_input['subdivision']:
+        try:
+            from climate_normals import get_climate_normals
+            normals = get_climate_normals()
+        except Exception as e:
+            print(f"⚠️ Climate normals unavailable: {e}")
+    
+    if normals is not None:
+        season_normal = normals.lookup(validated_input['subdivision'], validated_input['season'])
+        if season_normal:
+            if 'rainfall' not in validated_input:
+                validated_input['rainfall'] = season_normal['normal_rainfall_mm']
+                season_normal['rainfall_source'] = 'climate_normal'
+            else:
+                season_normal['rainfall_source'] = 'user'
+                season_normal['rainfall_check'] = normals.check_rainfall(
+                    validated_input['subdivision'], validated_input['season'], validated_input['rainfall']
+                )
+            validated_input['climate_context'] = season_normal
+    
+    if 'rainfall' not in validated_input:
+        raise ValueError("Missing required field: rainfall (no climate normal available for this location)")
+    
     return validated_input
 
 def preprocess_input(input_dict: Dict[str, Any], models: Dict) -> Tuple[np.ndarray, list, Dict]:
@@ -274,11 +327,12 @@ def preprocess_input(input_dict: Dict[str, Any], models: Dict) -> Tuple[np.ndarr
         'original_npk': (input_dict['n'], input_dict['p'], input_dict['k']),
         'previous_crop': input_dict.get('previous_crop', ''),
         'season': input_dict.get('season', 'kharif'),
-        'region': input_dict.get('region', 'default')
+        'region': input_dict.get('region', 'default'),
+        'subdivision': input_dict.get('subdivision', '')
     }
     
     # Use the exact feature order from training data
-    feature_list = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+    feature_list = list(CROP_FEATURES)
     
     # Map input keys to correct feature names (handle case sensitivity)
     feature_mapping = {
@@ -366,14 +420,8 @@ def predict_crop(X: np.ndarray, models: Dict) -> Dict[str, Any]:
             print(f"✅ Used crop encoder: {crop_name}")
         else:
             # Ultimate fallback - use class index to map to known crops
-            crop_names = [
-                'apple', 'banana', 'blackgram', 'chickpea', 'coconut', 'coffee', 'cotton',
-                'grapes', 'jute', 'kidneybeans', 'lentil', 'maize', 'mango', 'mothbeans',
-                'mungbean', 'muskmelon', 'orange', 'papaya', 'pigeonpeas', 'pomegranate',
-                'rice', 'watermelon'
-            ]
-            if 0 <= predicted_class < len(crop_names):
-                crop_name = crop_names[predicted_class]
+            if 0 <= predicted_class < len(FALLBACK_CROP_NAMES):
+                crop_name = FALLBACK_CROP_NAMES[predicted_class]
                 print(f"⚠️ Used fallback crop mapping: {crop_name}")
         
         print(f"🌾 Predicted: {crop_name} (class: {predicted_class}, confidence: {confidence:.3f})")
@@ -396,190 +444,290 @@ def predict_crop(X: np.ndarray, models: Dict) -> Dict[str, Any]:
             'error': str(e)
         }
 
-def predict_from_dict(input_dict: Dict[str, Any]) -> Dict[str, Any]:
+def scale_crop_features(X: np.ndarray, models: Dict) -> np.ndarray:
     """
-    Enhanced main prediction function with previous crop and season analysis
+    Apply the crop model scaler to raw feature rows (CROP_FEATURES order), as
+    preprocess_input does for a single request
     """
-    try:
-        # Validate input with enhanced schema
-        validated_input = validate_input_schema(input_dict)
-        
-        # Load models
-        models = load_all_models()
-        
-        # Enhanced preprocessing with previous crop and season support
-        X, feature_names, preprocessing_info = preprocess_input(validated_input, models)
-        
-        # 1. Crop Recommendation
-        crop_result = predict_crop(X, models)
-        recommended_crop = crop_result['recommended_crop']
-        confidence = crop_result['confidence']
-        
-        # 2. Season compatibility check
-        season_compatibility = None
-        try:
-            from season_detection import check_crop_season_compatibility
-            season = preprocessing_info.get('season', 'kharif')
-            season_compatibility = check_crop_season_compatibility(recommended_crop, season)
-        except:
-            season_compatibility = ('moderate', f"Season compatibility for {recommended_crop} needs evaluation")
-        
-        # 3. Use adjusted NPK for fertilizer recommendation if available
-        npk_for_fertilizer = preprocessing_info.get('adjusted_npk', 
-                                                   (validated_input['n'], validated_input['p'], validated_input['k']))
-        
-        # Use dynamic fertilizer prediction
-        try:
-            if DYNAMIC_RECOMMENDATIONS_AVAILABLE:
-                from dynamic_recommendations import get_dynamic_fertilizer_prediction
-                fertilizer_result = get_dynamic_fertilizer_prediction(
-                    crop=recommended_crop,
-                    n=npk_for_fertilizer[0],
-                    p=npk_for_fertilizer[1],
-                    k=npk_for_fertilizer[2],
-                    ph=validated_input['ph']
-                )
-            else:
-                fertilizer_result = predict_fertilizer(
-                    crop=recommended_crop,
-                    n=npk_for_fertilizer[0],
-                    p=npk_for_fertilizer[1],
-                    k=npk_for_fertilizer[2],
-                    ph=validated_input['ph'],
-                    use_ml=True,
-                    ml_model=models.get('fertilizer_model'),
-                    encoders=models.get('fertilizer_encoders')
-                )
-        except Exception as e:
-            print(f"⚠️ Fertilizer prediction failed: {e}")
-            fertilizer_result = {
-                'fertilizer': 'NPK 15-15-15',
-                'dosage_kg_per_ha': 130,
-                'total_cost': 3000,
-                'method': 'error_fallback'
-            }
-        
-        # 4. Profit Estimation with adjusted NPK
-        fertilizer_cost = fertilizer_result.get('total_cost', 3000)
-        
+    if 'scaler' in models:
+        return models['scaler'].transform(X)
+    return X
+
+def get_crop_classes(models: Dict) -> list:
+    """
+    Crop names indexed by model class, using the same encoder priority as predict_crop
+    """
+    encoders = models.get('encoders', {})
+    for encoder in (models.get('crop_label_encoder'), encoders.get('label'), encoders.get('crop')):
+        if encoder is not None and hasattr(encoder, 'classes_'):
+            return [str(name) for name in encoder.classes_]
+    return list(FALLBACK_CROP_NAMES)
+
+def predict_crop_fast(X: np.ndarray, models: Dict) -> Dict[str, Any]:
+    """
+    Answer from the precomputed recommendation grid when the neighbourhood is
+    unambiguous, otherwise fall back to the exact crop model
+
+    A grid answer's confidence is the mean of its neighbours' precomputed
+    confidences, not a probability from the model for this input. The grid is
+    skipped when it was built from other crop model files.
+    """
+    if 'crop_model' in models and os.getenv('USE_RECOMMENDATION_GRID', 'true').lower() == 'true':
         try:
-            if DYNAMIC_RECOMMENDATIONS_AVAILABLE:
-                from dynamic_recommendations import get_dynamic_profit_prediction
-                profit_result = get_dynamic_profit_prediction(
-                    crop=recommended_crop,
-                    n=npk_for_fertilizer[0],
-                    p=npk_for_fertilizer[1],
-                    k=npk_for_fertilizer[2],
-                    ph=validated_input['ph'],
-                    temperature=validated_input['temperature'],
-                    humidity=validated_input['humidity'],
-                    rainfall=validated_input['rainfall'],
-                    fertilizer_cost=fertilizer_cost,
-                    area_ha=validated_input['area_ha']
-                )
-            else:
-                profit_result = predict_profit(
-                    crop=recommended_crop,
-                    n=npk_for_fertilizer[0],
-                    p=npk_for_fertilizer[1],
-                    k=npk_for_fertilizer[2],
-                    ph=validated_input['ph'],
-                    temperature=validated_input['temperature'],
-                    humidity=validated_input['humidity'],
-                    rainfall=validated_input['rainfall'],
-                    fertilizer_cost=fertilizer_cost,
-                    area_ha=validated_input['area_ha'],
-                    model=models.get('yield_model'),
-                    crop_encoder=models.get('profit_crop_encoder')
-                )
+            from recommendation_grid import get_recommendation_grid
+            grid = get_recommendation_grid(get_crop_classes(models), scaled='scaler' in models)
+            if grid is not None:
+                result = grid.lookup(X)
+                if result is not None:
+                    print(f"⚡ Grid lookup: {result['recommended_crop']} (confidence: {result['confidence']:.3f})")
+                    return result
         except Exception as e:
-            print(f"⚠️ Profit prediction failed: {e}")
-            profit_result = {
-                'predicted_yield_quintals_per_ha': 45,
-                'gross_revenue': 180000,
-                'total_investment': 75000,
-                'net_profit': 105000,
-                'roi_percent': 140.0,
-                'method': 'error_fallback'
-            }
-        
-        # 5. Generate Enhanced Explanations
-        enhanced_explanations = []
-        
-        # Previous crop analysis
-        previous_crop = preprocessing_info.get('previous_crop', '')
-        if previous_crop:
-            try:
-                from nutrient_impact_lookup import get_previous_crop_explanation
-                prev_crop_explanation = get_previous_crop_explanation(previous_crop)
-                enhanced_explanations.append(prev_crop_explanation)
-            except:
-                enhanced_explanations.append(f"Previous crop {previous_crop} considered in soil analysis")
-        
-        # Season analysis
-        season = preprocessing_info.get('season', 'kharif')
-        if season_compatibility:
-            suitability, explanation = season_compatibility
-            enhanced_explanations.append(f"Season analysis: {explanation}")
-        
-        # NPK adjustment explanation
-        if 'npk_deltas' in preprocessing_info:
-            n_delta, p_delta, k_delta = preprocessing_info['npk_deltas']
-            if any(abs(delta) > 0.1 for delta in [n_delta, p_delta, k_delta]):
-                enhanced_explanations.append(
-                    f"Soil nutrients adjusted based on previous crop: N{n_delta:+.0f}, P{p_delta:+.0f}, K{k_delta:+.0f}"
-                )
-        
-        # Traditional ML explanations
-        try:
-            crop_explanations = explain_prediction(
-                'crop', models.get('crop_model'), X, feature_names
+            print(f"⚠️ Recommendation grid lookup failed: {e}")
+    
+    return predict_crop(X, models)
+
+def predict_stages(input_dict: Dict[str, Any], models: Optional[Dict] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Run the prediction pipeline stage by stage, yielding (stage, payload) as each finishes
+    
+    Stages in order: crop, season, fertilizer, profit, explanation, complete.
+    The 'complete' payload is the full predict_from_dict response.
+    """
+    # Validate input with enhanced schema
+    validated_input = validate_input_schema(input_dict)
+    
+    # Load models unless the caller already holds them
+    if models is None:
+        models = load_all_models()
+    
+    # Enhanced preprocessing with previous crop and season support
+    X, feature_names, preprocessing_info = preprocess_input(validated_input, models)
+    
+    # 1. Crop Recommendation
+    crop_result = predict_crop_fast(X, models)
+    recommended_crop = crop_result['recommended_crop']
+    confidence = crop_result['confidence']
+    
+    yield 'crop', {
+        'recommended_crop': recommended_crop,
+        'confidence': round(confidence, 3),
+        'method': crop_result.get('method', 'unknown'),
+        'region': preprocessing_info.get('region', 'default'),
+        'subdivision': preprocessing_info.get('subdivision', ''),
+        'climate_context': validated_input.get('climate_context')
+    }
+    
+    # 2. Season compatibility check
+    season = preprocessing_info.get('season', 'kharif')
+    season_compatibility = None
+    try:
+        from season_detection import check_crop_season_compatibility
+        season_compatibility = check_crop_season_compatibility(recommended_crop, season)
+    except:
+        season_compatibility = ('moderate', f"Season compatibility for {recommended_crop} needs evaluation")
+    
+    previous_crop = preprocessing_info.get('previous_crop', '')
+    season_analysis = {
+        'detected_season': season,
+        'season_suitability': season_compatibility[0] if season_compatibility else 'unknown',
+        'season_explanation': season_compatibility[1] if season_compatibility else 'Season compatibility unknown'
+    }
+    previous_crop_analysis = {
+        'previous_crop': previous_crop,
+        'original_npk': preprocessing_info.get('original_npk', (0, 0, 0)),
+        'adjusted_npk': preprocessing_info.get('adjusted_npk', preprocessing_info.get('original_npk', (0, 0, 0))),
+        'nutrient_impact': preprocessing_info.get('npk_deltas', (0, 0, 0))
+    }
+    
+    yield 'season', {
+        'season_analysis': season_analysis,
+        'previous_crop_analysis': previous_crop_analysis
+    }
+    
+    # 3. Use adjusted NPK for fertilizer recommendation if available
+    npk_for_fertilizer = preprocessing_info.get('adjusted_npk', 
+                                               (validated_input['n'], validated_input['p'], validated_input['k']))
+    
+    # Use dynamic fertilizer prediction
+    try:
+        if DYNAMIC_RECOMMENDATIONS_AVAILABLE:
+            from dynamic_recommendations import get_dynamic_fertilizer_prediction
+            fertilizer_result = get_dynamic_fertilizer_prediction(
+                crop=recommended_crop,
+                n=npk_for_fertilizer[0],
+                p=npk_for_fertilizer[1],
+                k=npk_for_fertilizer[2],
+                ph=validated_input['ph']
             )
-            enhanced_explanations.extend(crop_explanations[:2])
-        except:
-            enhanced_explanations.append(f"Recommended {recommended_crop} based on enhanced soil and climate analysis")
-        
-        # Create comprehensive enhanced response
-        response = {
-            'recommended_crop': recommended_crop,
-            'confidence': round(confidence, 3),
-            'method': crop_result.get('method', 'unknown'),  # Add method from crop prediction
-            'why': enhanced_explanations[:4],  # Top 4 enhanced reasons
-            'expected_yield_t_per_acre': round(profit_result['predicted_yield_quintals_per_ha'] * 0.1, 2),
-            'yield_interval_p10_p90': [
-                round(profit_result['predicted_yield_quintals_per_ha'] * 0.8 * 0.1, 2),
-                round(profit_result['predicted_yield_quintals_per_ha'] * 1.2 * 0.1, 2)
-            ],
-            'profit_breakdown': {
-                'gross': int(profit_result['gross_revenue']),
-                'investment': int(profit_result['total_investment']),
-                'net': int(profit_result['net_profit']),
-                'roi': round(profit_result['roi_percent'], 1)
-            },
-            'fertilizer_recommendation': {
-                'type': fertilizer_result.get('fertilizer', 'NPK 15-15-15'),
-                'dosage_kg_per_ha': fertilizer_result.get('dosage_kg_per_ha', 130),
-                'cost': int(fertilizer_result.get('total_cost', 3000))
-            },
-            # Enhanced fields
-            'previous_crop_analysis': {
-                'previous_crop': previous_crop,
-                'original_npk': preprocessing_info.get('original_npk', (0, 0, 0)),
-                'adjusted_npk': preprocessing_info.get('adjusted_npk', preprocessing_info.get('original_npk', (0, 0, 0))),
-                'nutrient_impact': preprocessing_info.get('npk_deltas', (0, 0, 0))
-            },
-            'season_analysis': {
-                'detected_season': season,
-                'season_suitability': season_compatibility[0] if season_compatibility else 'unknown',
-                'season_explanation': season_compatibility[1] if season_compatibility else 'Season compatibility unknown'
-            },
-            'model_version': 'crop_model_v2_enhanced',
-            'timestamp': datetime.now().isoformat(),
-            'area_analyzed_ha': validated_input['area_ha'],
-            'region': preprocessing_info.get('region', 'default')
+        else:
+            fertilizer_result = predict_fertilizer(
+                crop=recommended_crop,
+                n=npk_for_fertilizer[0],
+                p=npk_for_fertilizer[1],
+                k=npk_for_fertilizer[2],
+                ph=validated_input['ph'],
+                use_ml=True,
+                ml_model=models.get('fertilizer_model'),
+                encoders=models.get('fertilizer_encoders')
+            )
+    except Exception as e:
+        print(f"⚠️ Fertilizer prediction failed: {e}")
+        fertilizer_result = {
+            'fertilizer': 'NPK 15-15-15',
+            'dosage_kg_per_ha': 130,
+            'total_cost': 3000,
+            'method': 'error_fallback'
         }
-        
-        return response
+    
+    fertilizer_recommendation = {
+        'type': fertilizer_result.get('fertilizer', 'NPK 15-15-15'),
+        'dosage_kg_per_ha': fertilizer_result.get('dosage_kg_per_ha', 130),
+        'cost': int(fertilizer_result.get('total_cost', 3000))
+    }
+    
+    yield 'fertilizer', {'fertilizer_recommendation': fertilizer_recommendation}
+    
+    # 4. Profit Estimation with adjusted NPK
+    fertilizer_cost = fertilizer_result.get('total_cost', 3000)
+    
+    try:
+        if DYNAMIC_RECOMMENDATIONS_AVAILABLE:
+            from dynamic_recommendations import get_dynamic_profit_prediction
+            profit_result = get_dynamic_profit_prediction(
+                crop=recommended_crop,
+                n=npk_for_fertilizer[0],
+                p=npk_for_fertilizer[1],
+                k=npk_for_fertilizer[2],
+                ph=validated_input['ph'],
+                temperature=validated_input['temperature'],
+                humidity=validated_input['humidity'],
+                rainfall=validated_input['rainfall'],
+                fertilizer_cost=fertilizer_cost,
+                area_ha=validated_input['area_ha']
+            )
+        else:
+            profit_result = predict_profit(
+                crop=recommended_crop,
+                n=npk_for_fertilizer[0],
+                p=npk_for_fertilizer[1],
+                k=npk_for_fertilizer[2],
+                ph=validated_input['ph'],
+                temperature=validated_input['temperature'],
+                humidity=validated_input['humidity'],
+                rainfall=validated_input['rainfall'],
+                fertilizer_cost=fertilizer_cost,
+                area_ha=validated_input['area_ha'],
+                model=models.get('yield_model'),
+                crop_encoder=models.get('profit_crop_encoder')
+            )
+    except Exception as e:
+        print(f"⚠️ Profit prediction failed: {e}")
+        profit_result = {
+            'predicted_yield_quintals_per_ha': 45,
+            'gross_revenue': 180000,
+            'total_investment': 75000,
+            'net_profit': 105000,
+            'roi_percent': 140.0,
+            'method': 'error_fallback'
+        }
+    
+    profit_summary = {
+        'expected_yield_t_per_acre': round(profit_result['predicted_yield_quintals_per_ha'] * 0.1, 2),
+        'yield_interval_p10_p90': [
+            round(profit_result['predicted_yield_quintals_per_ha'] * 0.8 * 0.1, 2),
+            round(profit_result['predicted_yield_quintals_per_ha'] * 1.2 * 0.1, 2)
+        ],
+        'profit_breakdown': {
+            'gross': int(profit_result['gross_revenue']),
+            'investment': int(profit_result['total_investment']),
+            'net': int(profit_result['net_profit']),
+            'roi': round(profit_result['roi_percent'], 1)
+        }
+    }
+    
+    yield 'profit', profit_summary
+    
+    # 5. Generate Enhanced Explanations
+    enhanced_explanations = []
+    
+    # Previous crop analysis
+    if previous_crop:
+        try:
+            from nutrient_impact_lookup import get_previous_crop_explanation
+            prev_crop_explanation = get_previous_crop_explanation(previous_crop)
+            enhanced_explanations.append(prev_crop_explanation)
+        except:
+            enhanced_explanations.append(f"Previous crop {previous_crop} considered in soil analysis")
+    
+    # Season analysis
+    if season_compatibility:
+        suitability, explanation = season_compatibility
+        enhanced_explanations.append(f"Season analysis: {explanation}")
+    
+    # NPK adjustment explanation
+    if 'npk_deltas' in preprocessing_info:
+        n_delta, p_delta, k_delta = preprocessing_info['npk_deltas']
+        if any(abs(delta) > 0.1 for delta in [n_delta, p_delta, k_delta]):
+            enhanced_explanations.append(
+                f"Soil nutrients adjusted based on previous crop: N{n_delta:+.0f}, P{p_delta:+.0f}, K{k_delta:+.0f}"
+            )
+    
+    # Climate normal context for the farm's sub-division
+    climate_context = validated_input.get('climate_context')
+    if climate_context:
+        if climate_context.get('rainfall_source') == 'climate_normal':
+            enhanced_explanations.append(
+                f"Rainfall estimated from {climate_context['period']} {season} normal for "
+                f"{climate_context['subdivision'].title()}: {climate_context['normal_rainfall_mm']:.0f}mm"
+            )
+        elif climate_context.get('rainfall_check') and climate_context['rainfall_check']['status'] != 'normal':
+            p10, p90 = climate_context['rainfall_check']['p10_p90_mm']
+            enhanced_explanations.append(
+                f"Rainfall {validated_input['rainfall']:.0f}mm is {climate_context['rainfall_check']['status'].replace('_', ' ')} "
+                f"for {climate_context['subdivision'].title()} ({season} p10-p90: {p10:.0f}-{p90:.0f}mm)"
+            )
+    
+    # Traditional ML explanations
+    try:
+        crop_explanations = explain_prediction(
+            'crop', models.get('crop_model'), X, feature_names
+        )
+        enhanced_explanations.extend(crop_explanations[:2])
+    except:
+        enhanced_explanations.append(f"Recommended {recommended_crop} based on enhanced soil and climate analysis")
+    
+    yield 'explanation', {'why': enhanced_explanations[:4]}  # Top 4 enhanced reasons
+    
+    # Create comprehensive enhanced response
+    response = {
+        'recommended_crop': recommended_crop,
+        'confidence': round(confidence, 3),
+        'method': crop_result.get('method', 'unknown'),  # Add method from crop prediction
+        'why': enhanced_explanations[:4],  # Top 4 enhanced reasons
+        **profit_summary,
+        'fertilizer_recommendation': fertilizer_recommendation,
+        # Enhanced fields
+        'previous_crop_analysis': previous_crop_analysis,
+        'season_analysis': season_analysis,
+        'model_version': 'crop_model_v2_enhanced',
+        'timestamp': datetime.now().isoformat(),
+        'area_analyzed_ha': validated_input['area_ha'],
+        'region': preprocessing_info.get('region', 'default'),
+        'subdivision': preprocessing_info.get('subdivision', ''),
+        'climate_context': climate_context
+    }
+    
+    yield 'complete', response
+
+def predict_from_dict(input_dict: Dict[str, Any], models: Optional[Dict] = None) -> Dict[str, Any]:
+    """
+    Enhanced main prediction function with previous crop and season analysis
+    """
+    try:
+        for stage, payload in predict_stages(input_dict, models):
+            if stage == 'complete':
+                return payload
+        raise RuntimeError("Prediction pipeline finished without a result")
         
     except Exception as e:
         # Enhanced error response
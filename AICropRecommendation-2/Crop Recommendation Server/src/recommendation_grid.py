@@ -0,0 +1,334 @@
+"""
+Recommendation grid module for crop AI project
+Precomputes crop model predictions over samples of the input space and answers
+requests with a KD-tree neighbourhood lookup, falling back to the exact model.
+A grid is only used with the crop model, scaler and class list it was built from.
+"""
+
+import os
+import json
+import time
+import hashlib
+import numpy as np
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+import sys
+sys.path.append(os.path.dirname(__file__))
+from preprocess import load_raw, clean_crop_data
+from predict import load_all_models, scale_crop_features, get_crop_classes, CROP_FEATURES
+
+GRID_FILE = 'recommendation_grid_v1.npz'
+EVAL_FILE = 'recommendation_grid_eval_v1.json'
+
+# Number of precomputed points and the jitter applied to resampled training
+# rows (fraction of each feature's standard deviation)
+DEFAULT_GRID_SIZE = 200000
+DEFAULT_JITTER = 0.25
+
+# Neighbours that must agree for a grid answer
+DEFAULT_NEIGHBOURS = 5
+
+# Neighbourhood radius is set to this percentile of the k-th neighbour
+# distance seen for fresh samples during the build
+RADIUS_PERCENTILE = 90
+
+# Model files whose contents a grid is tied to
+FINGERPRINT_FILES = ('crop_model_v1.pkl', 'scaler_v1.pkl')
+
+_grid_cache = {}
+
+def _models_dir() -> str:
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'models')
+
+def model_fingerprint(classes, models_dir: Optional[str] = None) -> str:
+    """
+    Hash of the crop model and scaler files plus the crop class list
+
+    Args:
+        classes: Crop names indexed by model class
+        models_dir: Directory holding FINGERPRINT_FILES (defaults to models/)
+
+    Returns:
+        Hex digest; missing files hash as absent
+    """
+    models_dir = models_dir or _models_dir()
+    digest = hashlib.sha256()
+    for name in FINGERPRINT_FILES:
+        digest.update(name.encode())
+        path = os.path.join(models_dir, name)
+        if not os.path.exists(path):
+            digest.update(b'absent')
+            continue
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(json.dumps([str(c) for c in classes]).encode())
+    return digest.hexdigest()
+
+def sample_input_space(n_samples: int, jitter: float = DEFAULT_JITTER, seed: int = 42) -> np.ndarray:
+    """
+    Sample raw crop-model inputs from the training distribution
+
+    Training rows are resampled with replacement and perturbed with Gaussian
+    noise so the grid also covers the neighbourhood of each row.
+
+    Args:
+        n_samples: Number of points to generate
+        jitter: Noise scale as a fraction of each feature's standard deviation
+        seed: Random seed
+
+    Returns:
+        Array of shape (n_samples, 7) in CROP_FEATURES order
+    """
+    datasets = load_raw()
+    if 'crop' not in datasets:
+        raise ValueError("Crop recommendation data not found!")
+
+    df = clean_crop_data(datasets['crop'])
+    train = df[[f.lower() for f in CROP_FEATURES]].dropna().to_numpy(dtype=float)
+
+    rng = np.random.default_rng(seed)
+    rows = train[rng.integers(0, len(train), n_samples)]
+    noise = rng.normal(0.0, 1.0, rows.shape) * train.std(axis=0) * jitter
+    samples = rows + noise
+
+    # Keep samples inside the observed range of each feature
+    return np.clip(samples, train.min(axis=0), train.max(axis=0))
+
+def _predict_proba_batched(X: np.ndarray, models: Dict, batch_size: int = 20000) -> np.ndarray:
+    model = models['crop_model']
+    return np.vstack([
+        model.predict_proba(X[start:start + batch_size])
+        for start in range(0, len(X), batch_size)
+    ])
+
+class RecommendationGrid:
+    """KD-tree lookup over precomputed crop model predictions"""
+
+    def __init__(self, data: Dict[str, np.ndarray]):
+        from sklearn.neighbors import KDTree
+
+        self.points = data['points']
+        self.labels = data['labels']
+        self.confidences = data['confidences']
+        self.classes = [str(c) for c in data['classes']]
+        self.center = data['center']
+        self.spread = data['spread']
+        self.neighbours = int(data['neighbours'])
+        self.radius = float(data['radius'])
+        self.scaled = bool(data['scaled'])
+        # Grids saved before fingerprints were recorded match no model
+        self.fingerprint = str(data['fingerprint']) if 'fingerprint' in data else None
+        self.tree = KDTree((self.points - self.center) / self.spread)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'RecommendationGrid':
+        with np.load(path or os.path.join(_models_dir(), GRID_FILE)) as data:
+            return cls({key: data[key] for key in data.files})
+
+    def lookup_batch(self, X: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Grid answers for many model-space rows
+
+        Returns:
+            Dictionary with 'hit' mask, 'labels' and 'confidences'; labels and
+            confidences are only meaningful where hit is True. A confidence is
+            the mean of the neighbours' precomputed top-class probabilities,
+            not a model probability for the query itself
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        distances, indices = self.tree.query((X - self.center) / self.spread, k=self.neighbours)
+
+        neighbour_labels = self.labels[indices]
+        agree = np.all(neighbour_labels == neighbour_labels[:, :1], axis=1)
+        close = distances[:, -1] <= self.radius
+
+        return {
+            'hit': agree & close,
+            'labels': neighbour_labels[:, 0],
+            'confidences': self.confidences[indices].astype(float).mean(axis=1)
+        }
+
+    def lookup(self, X: np.ndarray) -> Optional[Dict[str, Any]]:
+        """
+        Grid answer for a single preprocessed row
+
+        Returns:
+            predict_crop-style result, or None if the neighbourhood is ambiguous.
+            'confidence' is the mean over the agreeing neighbours (see
+            lookup_batch) and 'confidence_basis' says so
+        """
+        result = self.lookup_batch(X)
+        if not result['hit'][0]:
+            return None
+
+        predicted_class = int(result['labels'][0])
+        return {
+            'recommended_crop': self.classes[predicted_class],
+            'confidence': float(result['confidences'][0]),
+            'method': 'precomputed_grid',
+            'confidence_basis': f'mean of {self.neighbours} precomputed neighbours',
+            'predicted_class': predicted_class
+        }
+
+def build_recommendation_grid(n_samples: int = DEFAULT_GRID_SIZE, jitter: float = DEFAULT_JITTER,
+                              neighbours: int = DEFAULT_NEIGHBOURS, save: bool = True) -> RecommendationGrid:
+    """
+    Offline build step: evaluate the crop model over sampled inputs
+
+    Args:
+        n_samples: Number of grid points
+        jitter: Noise scale for resampled training rows
+        neighbours: Neighbours that must agree for a grid answer
+        save: Write the grid to models/recommendation_grid_v1.npz
+
+    Returns:
+        RecommendationGrid instance
+    """
+    from sklearn.neighbors import KDTree
+
+    models = load_all_models()
+    if 'crop_model' not in models or not hasattr(models['crop_model'], 'predict_proba'):
+        raise ValueError("Crop model with predict_proba is required to build the grid")
+
+    print(f"Building recommendation grid with {n_samples} points...")
+    X = scale_crop_features(sample_input_space(n_samples, jitter), models)
+    proba = _predict_proba_batched(X, models)
+
+    center = X.mean(axis=0)
+    spread = X.std(axis=0)
+    spread[spread == 0] = 1.0
+
+    # Calibrate the neighbourhood radius on fresh samples
+    calibration = (scale_crop_features(sample_input_space(2000, jitter, seed=7), models) - center) / spread
+    distances, _ = KDTree((X - center) / spread).query(calibration, k=neighbours)
+    radius = float(np.percentile(distances[:, -1], RADIUS_PERCENTILE))
+
+    data = {
+        'points': X.astype(np.float32),
+        'labels': np.argmax(proba, axis=1).astype(np.uint8),
+        'confidences': proba.max(axis=1).astype(np.float16),
+        'classes': np.array(get_crop_classes(models)),
+        'center': center,
+        'spread': spread,
+        'neighbours': np.array(neighbours),
+        'radius': np.array(radius),
+        'scaled': np.array('scaler' in models),
+        'fingerprint': np.array(model_fingerprint(get_crop_classes(models)))
+    }
+
+    if save:
+        path = os.path.join(_models_dir(), GRID_FILE)
+        np.savez_compressed(path, **data)
+        print(f"Recommendation grid saved: {path} (radius: {radius:.3f})")
+
+    return RecommendationGrid(data)
+
+def evaluate_grid(grid: RecommendationGrid, models: Optional[Dict] = None,
+                  n_queries: int = 2000, save: bool = True) -> Dict[str, Any]:
+    """
+    Report agreement with the exact model and lookup latency
+
+    Args:
+        grid: RecommendationGrid to evaluate
+        models: Loaded models (loaded if not given)
+        n_queries: Number of fresh query points
+        save: Write the report to models/recommendation_grid_eval_v1.json
+
+    Returns:
+        Evaluation report dictionary
+    """
+    models = models or load_all_models()
+    X = scale_crop_features(sample_input_space(n_queries, seed=123), models)
+
+    exact_labels = np.argmax(_predict_proba_batched(X, models), axis=1)
+    result = grid.lookup_batch(X)
+    hits = result['hit']
+
+    agreement = float(np.mean(result['labels'][hits] == exact_labels[hits])) if hits.any() else 0.0
+
+    # Single-request latency, which is what the API sees
+    n_timed = min(200, n_queries)
+    start = time.perf_counter()
+    for i in range(n_timed):
+        grid.lookup_batch(X[i:i + 1])
+    grid_latency_ms = (time.perf_counter() - start) / n_timed * 1000
+
+    start = time.perf_counter()
+    for i in range(n_timed):
+        models['crop_model'].predict_proba(X[i:i + 1])
+    model_latency_ms = (time.perf_counter() - start) / n_timed * 1000
+
+    report = {
+        'grid_points': int(len(grid.points)),
+        'neighbours': grid.neighbours,
+        'radius': round(grid.radius, 4),
+        'queries': int(n_queries),
+        'hit_rate': round(float(hits.mean()), 4),
+        'agreement_on_hits': round(agreement, 4),
+        'overall_accuracy_vs_model': round(float(hits.mean()) * agreement + (1 - float(hits.mean())), 4),
+        'grid_latency_ms': round(grid_latency_ms, 4),
+        'model_latency_ms': round(model_latency_ms, 4),
+        'speedup_on_hits': round(model_latency_ms / grid_latency_ms, 1) if grid_latency_ms > 0 else None,
+        'timestamp': datetime.now().isoformat()
+    }
+
+    print(f"Grid hit rate: {report['hit_rate']:.1%}, agreement on hits: {report['agreement_on_hits']:.1%}")
+    print(f"Latency: grid {report['grid_latency_ms']:.3f}ms vs model {report['model_latency_ms']:.3f}ms")
+
+    if save:
+        path = os.path.join(_models_dir(), EVAL_FILE)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Grid evaluation saved: {path}")
+
+    return report
+
+def get_recommendation_grid(classes, scaled: bool = True) -> Optional[RecommendationGrid]:
+    """
+    Load the recommendation grid once per process
+
+    Args:
+        classes: Crop names of the serving model (get_crop_classes)
+        scaled: Whether serving inputs are scaled; a grid built in the other
+            space is not used
+
+    Returns:
+        RecommendationGrid instance, or None if it is missing, incompatible or
+        was built from other model files (rebuild it after retraining)
+    """
+    if 'grid' not in _grid_cache:
+        path = os.path.join(_models_dir(), GRID_FILE)
+        grid = RecommendationGrid.load(path) if os.path.exists(path) else None
+        if grid is not None:
+            fingerprint = model_fingerprint(classes)
+            if grid.fingerprint != fingerprint:
+                print("⚠️ Recommendation grid was built from a different crop model, using the exact model "
+                      "(rebuild with python src/recommendation_grid.py)")
+                grid = None
+            else:
+                print(f"✅ Loaded recommendation grid ({len(grid.points)} points)")
+        _grid_cache['grid'] = grid
+
+    grid = _grid_cache['grid']
+    if grid is None or grid.scaled != scaled:
+        return None
+    return grid
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build the precomputed crop recommendation grid')
+    parser.add_argument('--samples', type=int, default=DEFAULT_GRID_SIZE, help='Number of grid points')
+    parser.add_argument('--jitter', type=float, default=DEFAULT_JITTER, help='Noise scale for resampled rows')
+    parser.add_argument('--neighbours', type=int, default=DEFAULT_NEIGHBOURS, help='Neighbours that must agree')
+    parser.add_argument('--queries', type=int, default=2000, help='Evaluation queries')
+
+    args = parser.parse_args()
+
+    grid = build_recommendation_grid(args.samples, args.jitter, args.neighbours)
+    evaluate_grid(grid, n_queries=args.queries)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Region Resolver Module
+Maps farm coordinates to agro-climatic region and IMD meteorological sub-division
+using a precomputed lat/lng grid index (O(1) lookups, no network calls).
+Cells are assigned to the nearest sub-division centroid inside a coarse outline
+of India, so points near internal sub-division borders may resolve to the
+neighbouring sub-division; points in neighbouring countries resolve to none.
+"""
+
+import os
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+# IMD meteorological sub-divisions (names as they appear in the
+# 'Sub Divisional Monthly Rainfall from 1901 to 2017.csv' dataset),
+# approximate centroid (lat, lng) and the SEASON_DEFINITIONS region they belong to
+SUBDIVISIONS = [
+    ('ANDAMAN & NICOBAR ISLANDS', 11.7, 92.7, 'east_india'),
+    ('ARUNACHAL PRADESH', 28.1, 94.5, 'east_india'),
+    ('ASSAM & MEGHALAYA', 26.0, 92.5, 'east_india'),
+    ('NAGA MANI MIZO TRIPURA', 24.5, 93.5, 'east_india'),
+    ('SUB HIMALAYAN WEST BENGAL & SIKKIM', 26.9, 88.5, 'east_india'),
+    ('GANGETIC WEST BENGAL', 23.0, 87.8, 'east_india'),
+    ('ORISSA', 20.5, 84.5, 'east_india'),
+    ('JHARKHAND', 23.6, 85.5, 'east_india'),
+    ('BIHAR', 25.8, 85.8, 'east_india'),
+    ('EAST UTTAR PRADESH', 26.5, 82.5, 'north_india'),
+    ('WEST UTTAR PRADESH', 28.0, 78.5, 'north_india'),
+    ('UTTARAKHAND', 30.1, 79.2, 'north_india'),
+    ('HARYANA DELHI & CHANDIGARH', 29.2, 76.4, 'north_india'),
+    ('PUNJAB', 30.9, 75.4, 'north_india'),
+    ('HIMACHAL PRADESH', 31.9, 77.2, 'north_india'),
+    ('JAMMU & KASHMIR', 33.9, 75.5, 'north_india'),
+    ('WEST RAJASTHAN', 27.0, 72.0, 'west_india'),
+    ('EAST RAJASTHAN', 25.8, 75.8, 'west_india'),
+    ('WEST MADHYA PRADESH', 23.2, 76.5, 'north_india'),
+    ('EAST MADHYA PRADESH', 23.5, 80.5, 'north_india'),
+    ('GUJARAT REGION', 22.8, 72.8, 'west_india'),
+    ('SAURASHTRA & KUTCH', 22.3, 70.5, 'west_india'),
+    ('KONKAN & GOA', 17.5, 73.4, 'west_india'),
+    ('MADHYA MAHARASHTRA', 18.8, 74.5, 'west_india'),
+    ('MATATHWADA', 19.2, 76.3, 'west_india'),
+    ('VIDARBHA', 20.6, 78.8, 'west_india'),
+    ('CHHATTISGARH', 21.3, 82.0, 'east_india'),
+    ('COASTAL ANDHRA PRADESH', 16.5, 81.0, 'south_india'),
+    ('TELANGANA', 17.8, 79.0, 'south_india'),
+    ('RAYALSEEMA', 14.8, 78.3, 'south_india'),
+    ('TAMIL NADU', 11.0, 78.4, 'south_india'),
+    ('COASTAL KARNATAKA', 13.8, 74.8, 'south_india'),
+    ('NORTH INTERIOR KARNATAKA', 16.0, 76.2, 'south_india'),
+    ('SOUTH INTERIOR KARNATAKA', 13.0, 76.5, 'south_india'),
+    ('KERALA', 10.3, 76.4, 'south_india'),
+    ('LAKSHADWEEP', 10.6, 72.6, 'south_india'),
+]
+
+# Grid covering India (degrees)
+GRID_LAT_RANGE = (6.0, 37.5)
+GRID_LNG_RANGE = (68.0, 97.5)
+GRID_RESOLUTION = 0.1
+
+# Cells further than this (degrees) from every sub-division centroid are
+# treated as outside the covered area
+MAX_CENTROID_DISTANCE = 3.5
+
+# Coarse national outline (lat, lng), clockwise from the Kutch coast, accurate
+# to a few tenths of a degree; cells outside it and the island boxes are unknown
+INDIA_OUTLINE = [
+    # Gujarat / Rajasthan - Pakistan
+    (23.6, 68.2), (24.3, 68.8), (24.3, 70.9), (24.8, 71.1), (25.7, 70.2), (26.6, 70.0),
+    (27.8, 70.4), (28.0, 71.0), (29.0, 72.9), (30.0, 73.4),
+    # Punjab / Jammu & Kashmir - Pakistan
+    (30.4, 73.9), (30.9, 74.5), (31.6, 74.6), (32.5, 74.7), (33.0, 74.0), (33.8, 73.6),
+    (34.6, 73.5), (35.4, 73.3), (36.0, 72.6), (36.9, 73.6), (37.1, 74.6),
+    # Ladakh / Himachal / Uttarakhand - China
+    (36.0, 76.0), (35.6, 77.8), (35.5, 79.0), (34.3, 79.5), (32.8, 79.4), (32.0, 78.8),
+    (31.3, 79.0), (30.9, 79.9), (30.2, 81.0),
+    # Nepal
+    (28.95, 80.1), (28.55, 80.6), (28.0, 81.6), (27.5, 82.8), (27.48, 83.45), (27.0, 84.85),
+    (26.62, 86.14), (26.42, 87.27), (26.55, 88.13),
+    # Sikkim, Bhutan, Arunachal - China
+    (27.1, 88.0), (27.9, 88.1), (28.1, 88.6), (27.2, 88.9), (26.8, 89.1), (26.7, 90.5), (26.8, 92.1),
+    (27.8, 91.7), (28.5, 93.5), (29.4, 95.5), (29.0, 96.4), (28.2, 97.4),
+    # Myanmar
+    (27.3, 97.0), (26.0, 95.3), (25.0, 94.7), (24.2, 94.2), (23.6, 93.4), (22.2, 93.2),
+    (21.9, 92.6),
+    # Around Bangladesh
+    (22.6, 92.3), (22.95, 91.6), (23.2, 91.3), (23.8, 91.1), (24.2, 91.5), (24.4, 92.1),
+    (25.0, 92.4), (25.2, 92.0), (25.2, 91.0), (25.2, 90.0),
+    (25.9, 89.8), (26.4, 89.6), (26.2, 88.9), (26.3, 88.4), (25.6, 88.45), (25.0, 88.4), (24.6, 88.1), (24.3, 88.1),
+    (23.6, 88.6), (22.9, 88.9), (21.6, 89.1),
+    # East coast
+    (21.5, 87.5), (20.2, 86.5), (19.3, 84.8), (17.7, 83.3), (16.3, 81.3), (15.6, 80.2),
+    (13.6, 80.35), (13.1, 80.35), (12.0, 79.9), (10.3, 79.9), (9.3, 79.1), (8.0, 77.55),
+    # West coast
+    (8.5, 76.9), (8.9, 76.55), (10.5, 76.0), (12.8, 74.8), (14.8, 74.1), (16.9, 73.3), (19.0, 72.8),
+    (20.7, 72.9), (21.7, 72.6), (20.7, 71.0), (20.85, 70.3), (21.6, 69.55), (22.3, 68.95), (23.0, 68.5),
+]
+# Andaman & Nicobar and Lakshadweep: ((lat_min, lat_max), (lng_min, lng_max))
+ISLAND_BOXES = [((6.7, 13.7), (92.2, 94.0)), ((8.0, 12.5), (71.6, 74.0))]
+
+# Grid cell value for "no sub-division"
+UNKNOWN_CELL = 255
+
+GRID_FILE = 'region_grid_v2.npz'
+
+_grid_cache = None
+
+def _grid_path() -> str:
+    models_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'models')
+    return os.path.join(models_dir, GRID_FILE)
+
+def inside_outline(lats, lngs) -> np.ndarray:
+    """
+    Whether coordinates fall inside INDIA_OUTLINE or an island box (even-odd rule)
+
+    Args:
+        lats: Array of latitudes
+        lngs: Array of longitudes (broadcast against lats)
+
+    Returns:
+        Boolean array of the broadcast shape
+    """
+    lats, lngs = np.broadcast_arrays(np.asarray(lats, dtype=float), np.asarray(lngs, dtype=float))
+    inside = np.zeros(lats.shape, dtype=bool)
+
+    vertices = np.array(INDIA_OUTLINE)
+    for (lat1, lng1), (lat2, lng2) in zip(vertices, np.roll(vertices, 1, axis=0)):
+        crosses = (lat1 > lats) != (lat2 > lats)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            edge_lng = lng1 + (lats - lat1) * (lng2 - lng1) / (lat2 - lat1)
+        inside ^= crosses & (lngs < edge_lng)
+
+    for (lat_min, lat_max), (lng_min, lng_max) in ISLAND_BOXES:
+        inside |= (lats >= lat_min) & (lats <= lat_max) & (lngs >= lng_min) & (lngs <= lng_max)
+    return inside
+
+def build_region_grid(resolution: float = GRID_RESOLUTION, save: bool = True) -> Dict:
+    """
+    Precompute the sub-division index for every grid cell
+
+    Each cell is assigned to the nearest sub-division centroid (longitude
+    distances scaled by cos(latitude)); cells outside the national outline or
+    too far from any centroid are marked unknown. No sub-division boundary
+    data is bundled, so the split between neighbouring sub-divisions follows
+    the centroids rather than the IMD boundaries.
+
+    Args:
+        resolution: Cell size in degrees
+        save: Write the grid to models/region_grid_v2.npz
+
+    Returns:
+        Dictionary with the grid and its metadata
+    """
+    lat_min, lat_max = GRID_LAT_RANGE
+    lng_min, lng_max = GRID_LNG_RANGE
+    n_lat = int(round((lat_max - lat_min) / resolution))
+    n_lng = int(round((lng_max - lng_min) / resolution))
+
+    # Cell centres
+    lats = lat_min + (np.arange(n_lat) + 0.5) * resolution
+    lngs = lng_min + (np.arange(n_lng) + 0.5) * resolution
+
+    centroid_lat = np.array([s[1] for s in SUBDIVISIONS])
+    centroid_lng = np.array([s[2] for s in SUBDIVISIONS])
+
+    cell_lat = lats[:, None, None]
+    cell_lng = lngs[None, :, None]
+    d_lat = cell_lat - centroid_lat[None, None, :]
+    d_lng = (cell_lng - centroid_lng[None, None, :]) * np.cos(np.radians(cell_lat))
+    distance = np.sqrt(d_lat ** 2 + d_lng ** 2)
+
+    grid = np.argmin(distance, axis=2).astype(np.uint8)
+    grid[np.min(distance, axis=2) > MAX_CENTROID_DISTANCE] = UNKNOWN_CELL
+    grid[~inside_outline(lats[:, None], lngs[None, :])] = UNKNOWN_CELL
+
+    index = {
+        'grid': grid,
+        'origin': np.array([lat_min, lng_min]),
+        'resolution': float(resolution),
+        'subdivisions': np.array([s[0] for s in SUBDIVISIONS]),
+        'regions': np.array([s[3] for s in SUBDIVISIONS])
+    }
+
+    if save:
+        path = _grid_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(
+            path,
+            grid=index['grid'],
+            origin=index['origin'],
+            resolution=np.array(index['resolution']),
+            subdivisions=index['subdivisions'],
+            regions=index['regions']
+        )
+        print(f"Region grid saved: {path} ({n_lat}x{n_lng} cells)")
+
+    return index
+
+def load_region_grid() -> Dict:
+    """
+    Load the region grid once per process, building it if the file is missing
+    """
+    global _grid_cache
+
+    if _grid_cache is not None:
+        return _grid_cache
+
+    path = _grid_path()
+    if os.path.exists(path):
+        with np.load(path) as data:
+            _grid_cache = {
+                'grid': data['grid'],
+                'origin': data['origin'],
+                'resolution': float(data['resolution']),
+                'subdivisions': data['subdivisions'],
+                'regions': data['regions']
+            }
+    else:
+        print("⚠️ Region grid not found, building it in memory")
+        _grid_cache = build_region_grid(save=False)
+
+    return _grid_cache
+
+def resolve_regions(lats, lngs) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorised lookup of region and sub-division for many coordinates
+
+    Args:
+        lats: Array-like of latitudes
+        lngs: Array-like of longitudes
+
+    Returns:
+        Tuple of (regions, subdivisions) arrays; 'default' / '' where the
+        coordinate is outside the covered area or missing
+    """
+    index = load_region_grid()
+    grid = index['grid']
+    lat_min, lng_min = index['origin']
+    resolution = index['resolution']
+
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+
+    rows = np.floor((lats - lat_min) / resolution)
+    cols = np.floor((lngs - lng_min) / resolution)
+    inside = (
+        np.isfinite(rows) & np.isfinite(cols) &
+        (rows >= 0) & (rows < grid.shape[0]) &
+        (cols >= 0) & (cols < grid.shape[1])
+    )
+
+    cells = np.full(lats.shape, UNKNOWN_CELL, dtype=np.int64)
+    cells[inside] = grid[rows[inside].astype(np.int64), cols[inside].astype(np.int64)]
+    known = cells != UNKNOWN_CELL
+
+    regions = np.full(lats.shape, 'default', dtype=object)
+    subdivisions = np.full(lats.shape, '', dtype=object)
+    regions[known] = index['regions'][cells[known]]
+    subdivisions[known] = index['subdivisions'][cells[known]]
+
+    return regions, subdivisions
+
+def resolve_region(lat: Optional[float], lng: Optional[float]) -> Optional[Dict[str, str]]:
+    """
+    Resolve a single coordinate to its region and sub-division
+
+    Args:
+        lat: Latitude in degrees
+        lng: Longitude in degrees
+
+    Returns:
+        Dictionary with 'region' and 'subdivision', or None if the
+        coordinate is missing or outside the covered area
+    """
+    if lat is None or lng is None:
+        return None
+
+    try:
+        regions, subdivisions = resolve_regions([float(lat)], [float(lng)])
+    except (TypeError, ValueError):
+        return None
+
+    if not subdivisions[0]:
+        return None
+
+    return {
+        'region': str(regions[0]),
+        'subdivision': str(subdivisions[0])
+    }
+
+if __name__ == "__main__":
+    # Build the bundled grid and run a few sanity lookups
+    build_region_grid()
+
+    test_points = [
+        ('Ludhiana', 30.90, 75.85),
+        ('Nagpur', 21.15, 79.09),
+        ('Coimbatore', 11.02, 76.96),
+        ('Kolkata', 22.57, 88.36),
+        ('Lahore', 31.55, 74.34),
+        ('Kathmandu', 27.70, 85.30),
+        ('Dhaka', 23.81, 90.41),
+        ('Indian Ocean', 0.0, 80.0)
+    ]
+    for name, lat, lng in test_points:
+        print(f"{name}: {resolve_region(lat, lng)}")
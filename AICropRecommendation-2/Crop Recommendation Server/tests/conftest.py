@@ -0,0 +1,10 @@
+"""
+Shared test setup for the crop recommendation server
+Run from the Crop Recommendation Server directory: python -m pytest
+"""
+
+import os
+import sys
+
+# Modules under src/ import each other by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
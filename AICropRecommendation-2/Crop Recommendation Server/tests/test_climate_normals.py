@@ -0,0 +1,42 @@
+"""Seasonal rainfall totals per sub-division"""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+pytest.importorskip('sklearn')
+pytest.importorskip('joblib')
+pytest.importorskip('yaml')
+
+from climate_normals import seasonal_totals, MONTH_COLUMNS
+
+def _rainfall(years, nan_years=()):
+    """One row per year; every month holds the year so totals identify their sources"""
+    rows = []
+    for year in years:
+        row = {'subdivision': 'PUNJAB', 'year': year}
+        row.update({month: float('nan') if year in nan_years else float(year) for month in MONTH_COLUMNS})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def test_non_wrapping_season_sums_each_year():
+    # North India kharif is June to October
+    totals = seasonal_totals(_rainfall([2000, 2001, 2003]), 'PUNJAB', 'kharif')
+
+    assert totals.tolist() == [5 * 2000.0, 5 * 2001.0, 5 * 2003.0]
+
+def test_wrapping_season_joins_previous_year_by_year():
+    # Rabi is November to March: Nov-Dec of year - 1 plus Jan-Mar of year
+    totals = seasonal_totals(_rainfall([2000, 2001, 2003, 2004]), 'PUNJAB', 'rabi')
+
+    # 2000 has no 1999 row and 2003 no 2002 row, so neither is paired with a
+    # neighbouring row from an unrelated year
+    assert totals.tolist() == [2 * 2000.0 + 3 * 2001.0, 2 * 2003.0 + 3 * 2004.0]
+
+def test_wrapping_season_ignores_row_order_and_missing_values():
+    df = _rainfall([2003, 2001, 2002, 2000], nan_years=(2002,)).sample(frac=1.0, random_state=0)
+
+    totals = seasonal_totals(df, 'PUNJAB', 'rabi')
+
+    # 2002 and 2003 (whose Nov-Dec come from 2002) are dropped
+    assert totals.tolist() == [2 * 2000.0 + 3 * 2001.0]
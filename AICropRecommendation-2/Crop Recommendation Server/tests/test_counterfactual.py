@@ -0,0 +1,55 @@
+"""Counterfactual amendment costs and cheapest-first search"""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+pytest.importorskip('joblib')
+pytest.importorskip('yaml')
+
+from counterfactual import amendment_costs, product_amounts, _candidate_grid, _cheapest_success
+from predict import CROP_FEATURES
+
+PRICES = {'Urea': 15, 'DAP': 30, 'MOP': 20}
+
+def test_costs_grow_with_every_input():
+    base = np.array([[10.0, 10.0, 10.0, 0.0]])
+    cost = amendment_costs(base, PRICES)[0]
+
+    for i in range(3):
+        more = base.copy()
+        more[0, i] += 10
+        assert amendment_costs(more, PRICES)[0] > cost
+    for ph_change in (0.5, -0.5):
+        assert amendment_costs(base + [[0, 0, 0, ph_change]], PRICES)[0] > cost
+
+def test_dap_nitrogen_is_credited_against_urea():
+    # 46 kg P2O5 needs 100 kg DAP, which also supplies 18 kg N
+    assert product_amounts(np.array([[18.0, 46.0, 0.0]]))[0].tolist() == pytest.approx([0.0, 100.0, 0.0])
+    assert product_amounts(np.array([[28.0, 46.0, 0.0]]))[0, 0] == pytest.approx(10 / 0.46)
+
+    with_dap_n = amendment_costs(np.array([[18.0, 46.0, 0.0, 0.0]]), PRICES)[0]
+    assert with_dap_n == pytest.approx(100 * PRICES['DAP'])
+
+class _NeedsNitrogen:
+    """Recommends class 1 once N reaches a threshold"""
+
+    def __init__(self, n_needed):
+        self.n_needed = n_needed
+
+    def predict_proba(self, X):
+        success = (X[:, CROP_FEATURES.index('N')] >= self.n_needed).astype(float)
+        return np.stack([1 - success, success], axis=1)
+
+def test_search_returns_cheapest_successful_amendment():
+    base = np.array([30.0, 20.0, 20.0, 25.0, 70.0, 6.5, 800.0])
+    soil = base[[CROP_FEATURES.index(f) for f in ['N', 'P', 'K', 'ph']]]
+    deltas = _candidate_grid(soil, [np.arange(0, 60, 10)] * 3, np.array([-0.5, 0.0, 0.5]))
+
+    best, probability, _, evaluated = _cheapest_success(
+        base, deltas, amendment_costs(deltas, PRICES), {'crop_model': _NeedsNitrogen(60)}, target_idx=1
+    )
+
+    assert best.tolist() == [30.0, 0.0, 0.0, 0.0]
+    assert probability == 1.0
+    assert evaluated <= len(deltas)
@@ -0,0 +1,38 @@
+"""Coordinate to region and sub-division lookups"""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from region_resolver import resolve_region, resolve_regions, inside_outline
+
+@pytest.mark.parametrize('lat,lng,subdivision,region', [
+    (30.90, 75.85, 'PUNJAB', 'north_india'),
+    (22.57, 88.36, 'GANGETIC WEST BENGAL', 'east_india'),
+    (9.93, 78.12, 'TAMIL NADU', 'south_india'),
+    (11.62, 92.73, 'ANDAMAN & NICOBAR ISLANDS', 'east_india'),
+])
+def test_resolves_indian_coordinates(lat, lng, subdivision, region):
+    assert resolve_region(lat, lng) == {'region': region, 'subdivision': subdivision}
+
+@pytest.mark.parametrize('lat,lng', [
+    (31.55, 74.34),  # Lahore
+    (27.70, 85.30),  # Kathmandu
+    (23.81, 90.41),  # Dhaka
+    (6.93, 79.85),   # Colombo
+    (29.65, 91.10),  # Lhasa
+    (0.0, 80.0),     # Indian Ocean
+])
+def test_neighbouring_countries_resolve_to_nothing(lat, lng):
+    assert not inside_outline(lat, lng)
+    assert resolve_region(lat, lng) is None
+
+def test_missing_or_invalid_coordinates():
+    assert resolve_region(None, 75.0) is None
+    assert resolve_region('north', 75.0) is None
+
+def test_batch_lookup_matches_single_lookups():
+    regions, subdivisions = resolve_regions([30.90, np.nan, 31.55], [75.85, 75.0, 74.34])
+
+    assert list(regions) == ['north_india', 'default', 'default']
+    assert list(subdivisions) == ['PUNJAB', '', '']